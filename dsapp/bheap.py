@@ -16,6 +16,7 @@ INF = float('inf')
 
 
 class BinomialNode(object):
+    __slots__ = ["key", "value", "degree", "child", "parent", "sibling"]
 
     def __init__(self, key, value = None):
         self.key = key
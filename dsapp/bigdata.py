@@ -3,8 +3,15 @@
 
 import random
 import heapq
+import multiprocessing
+import os
+import shutil
 import string
+import tempfile
 import time
+import zlib
+from collections import Counter
+from itertools import chain
 from os.path import join, exists
 
 from pprint import pprint
@@ -72,7 +79,7 @@ def find_max(tempdirs = []):
     # divide+hash
     with open(TDATA) as f:
         for line in f:
-            fi = '%03i' % (hash(line.strip())%100)
+            fi = '%03i' % (stable_hash(line.strip())%100)
             if fi not in fd:
                 fd[fi] = open('tmp/%s.dat'%fi, 'w+')
             fd[fi].write(line)
@@ -135,7 +142,7 @@ def find_top_k(k = 10):
     # divide+hash
     with open(TDATA) as f:
         for line in f:
-            fi = '%03i' % (hash(line.strip())%100)
+            fi = '%03i' % (stable_hash(line.strip())%100)
             if fi not in fd:
                 fd[fi] = open('tmp/%s.dat'%fi, 'w+')
             fd[fi].write(line)
@@ -168,6 +175,134 @@ def test_find_top_k():
 
 ################################################################################
 
+def stable_hash(key):
+    """
+    crc32 of key. Unlike hash() it is the same in every process and every
+    run, python -R and PYTHONHASHSEED randomize the hash of str.
+
+    >>> stable_hash('202.40.136.38') % 100
+    89
+    """
+    return zlib.crc32(key) & 0xffffffff
+
+def _split(filename, parts):
+    """Offsets of parts byte ranges of filename that start at a line."""
+    size = os.path.getsize(filename)
+    offsets = [0]
+    with open(filename, 'rb') as f:
+        for i in xrange(1, parts):
+            f.seek(max(size * i // parts - 1, 0))
+            f.readline()
+            offsets.append(max(f.tell(), offsets[-1]))
+    offsets.append(size)
+
+    return offsets
+
+def _partition_range(args):
+    """Pool worker: keys of the lines in [start, end) to one file per partition."""
+    filename, start, end, dirname, index, partitions = args
+    paths = [join(dirname, '%03i-%03i.dat' % (fi, index)) for fi in xrange(partitions)]
+    fd = [open(path, 'wb') for path in paths]
+    crc32 = zlib.crc32
+    try:
+        with open(filename, 'rb') as f:
+            f.seek(start)
+            left = end - start
+            rest = ''
+            while left > 0:
+                block = f.read(min(left, 1 << 22))
+                if not block:
+                    break
+                left -= len(block)
+                lines = (rest + block).split('\n')
+                rest = lines.pop()
+                if left <= 0 and rest:
+                    # the range ends at a line start, so this is the last
+                    # line of the file, without a newline
+                    lines.append(rest)
+                buckets = [[] for fi in xrange(partitions)]
+                for line in lines:
+                    key = line.strip()
+                    # stable_hash inlined
+                    buckets[(crc32(key) & 0xffffffff) % partitions].append(key)
+                for f_out, bucket in zip(fd, buckets):
+                    if bucket:
+                        bucket.append('')
+                        f_out.write('\n'.join(bucket))
+    finally:
+        for f in fd:
+            f.close()
+
+    return paths
+
+def _count_partition(args):
+    """Pool worker: top k (count, key) of one partition."""
+    paths, k = args
+    counter = Counter()
+    for path in paths:
+        with open(path, 'rb') as f:
+            keys = f.read().split('\n')
+        keys.pop()
+        counter.update(keys)
+
+    return heapq.nlargest(k, ((v, key) for key, v in counter.iteritems()))
+
+@timethis
+def find_top_k_parallel(filename = TDATA, k = 10, partitions = 100, workers = None, tmpdir = None):
+    """Method: parallel divide-and-conquer + hash stat + heap
+
+    Map: the file is cut into a line aligned byte range per worker and
+    every worker writes the keys of its range to partitions files by
+    stable_hash. Reduce: every partition (its files from all the workers)
+    is counted by one worker with a Counter, and the top k of the
+    partitions are merged. The partition files go to a temporary directory
+    under tmpdir (default the system one), removed at the end.
+
+    Returns [(count, key)], largest first.
+
+    Profile result (single core machine, so the workers can only add
+    overhead here):
+
+      10 million strings (generate_words), 100 partitions:
+      find_top_k:             20.5817039013
+      find_top_k_parallel(1): 14.67648983
+      find_top_k_parallel(2): 19.2521700859
+      find_top_k_parallel(4): 17.8570151329
+      [(1501, 'ar'),
+       (1493, 'yt'),
+       (1489, 'cr'),
+       (1485, 'mx'),
+       (1484, 'nr'),
+       (1483, 'ke'),
+       (1478, 'df'),
+       (1477, 'kh'),
+       (1476, 'go'),
+       (1475, 'wi')]
+    """
+    workers = workers or multiprocessing.cpu_count()
+    dirname = tempfile.mkdtemp(prefix = 'topk', dir = tmpdir)
+    pool = multiprocessing.Pool(workers)
+    try:
+        offsets = _split(filename, workers)
+        jobs = [(filename, offsets[i], offsets[i+1], dirname, i, partitions)
+                for i in xrange(workers)]
+        ranges = pool.map(_partition_range, jobs, chunksize = 1)
+        jobs = [(paths, k) for paths in zip(*ranges)]
+        tops = pool.map(_count_partition, jobs, chunksize = 1)
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(dirname, True)
+
+    return heapq.nlargest(k, chain.from_iterable(tops))
+
+def test_find_top_k_parallel():
+    for workers in (1, 2, 4):
+        print 'workers:', workers
+        pprint(find_top_k_parallel(workers = workers))
+
+################################################################################
+
 from trie import Trie
 import datrie
 import pytrie
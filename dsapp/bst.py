@@ -5,8 +5,11 @@
 import sys
 from Queue import Queue
 
+from dsa.tree import BinaryTreeBase
 
-class TreeNode:
+
+class TreeNode(object):
+    __slots__ = ["key", "payload", "leftChild", "rightChild", "parent"]
     
     def __init__(self, key, val, left=None, right=None, parent=None):
         self.key = key
@@ -108,7 +111,10 @@ class TreeNode:
     __repr__ = __str__
 
 
-class BinarySearchTree:
+class BinarySearchTree(BinaryTreeBase):
+
+    _left = 'leftChild'
+    _right = 'rightChild'
 
     def __init__(self):
         self.root = None
@@ -117,6 +123,9 @@ class BinarySearchTree:
     def length(self):
         return self.size
 
+    def _new_node(self, key, val, parent, nleft, nright):
+        return TreeNode(key, val, parent = parent)
+
     def put(self, key, val):
         if self.root:
             self._put(key, val, self.root)
@@ -209,21 +218,6 @@ class BinarySearchTree:
                                        currentNode.rightChild.leftChild,
                                        currentNode.rightChild.rightChild)
 
-    def searchRange(self, kmin, kmax):
-        result = []
-        if self.root:
-            self._searchRange(kmin, kmax, result, self.root)
-        return result
-    
-    def _searchRange(self, kmin, kmax, result, currentNode):
-        if currentNode:
-            if  kmin < currentNode.key:
-                self._searchRange(kmin, kmax, result, currentNode.leftChild)
-            if kmin <= currentNode.key <= kmax:
-                result.append(currentNode)
-            if kmin > currentNode.key or currentNode.key < kmax:
-                self._searchRange(kmin, kmax, result, currentNode.rightChild)
-
     def printLevelOrder(self):
         if not self.root:
             return
@@ -313,45 +307,6 @@ class BinarySearchTree:
             if node.right is not None :
                 q.put(node.rightChild)
 
-    def preorder(self):
-        return self._preorder(self.root)
-    
-    def _preorder(self, currentNode):
-        nodes = []
-        nodes.append(currentNode)
-        if currentNode.hasLeftChild():
-            nodes.extend(self._preorder(currentNode.leftChild))
-        if currentNode.hasRightChild:
-            nodes.extend(self._preorder(currentNode.rightChild))
-        
-        return nodes
-
-    def inorder(self):
-        return self._inorder(self.root)
-    
-    def _inorder(self, currentNode):
-        nodes = []
-        if currentNode.hasLeftChild():
-            nodes.extend(self._inorder(currentNode.leftChild))
-        nodes.append(currentNode)
-        if currentNode.hasRightChild():
-            nodes.extend(self._inorder(currentNode.rightChild))
-        
-        return nodes
-
-    def postorder(self):
-        return self._postorder(self.root)
-    
-    def _postorder(self, currentNode):
-        nodes = []
-        if currentNode.hasLeftChild():
-            nodes.extend(self._postorder(currentNode.leftChild))
-        nodes.append(currentNode)
-        if currentNode.hasRightChild():
-            nodes.extend(self._postorder(currentNode.rightChild))
-        
-        return nodes
-
     def __getitem__(self, k):
         return self.get(k)
 
@@ -371,7 +326,7 @@ class BinarySearchTree:
         return self.size
 
     def __iter__(self):
-        return self.root.__iter__()
+        return (node.key for node in self.iter_inorder())
 
 
 if __name__ == '__main__':
@@ -395,7 +350,7 @@ if __name__ == '__main__':
     r.put(10, 'large')
     print min.findSuccessor()
     print 'search range:'
-    result = r.searchRange(7, 9)
+    result = list(r.searchRange(7, 9))
     print result
     print
     r.printLevelOrder()
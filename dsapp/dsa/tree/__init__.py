@@ -1,6 +1,11 @@
 #! /usr/bin/env python
 # coding: utf-8
 
+import gc
+import math
+from collections import deque
+from operator import itemgetter
+
 
 class BinaryNodeBase(object):
     
@@ -51,60 +56,201 @@ class BinaryNodeBase(object):
     __repr__ = __str__
 
 
-class BinaryTreeBase(object)
+################################################################################
+
+# Traversals are stack based generators: they never hit the recursion limit on
+# degenerate trees, hold O(height) nodes at a time and stop as soon as the
+# caller stops. left/right name the child attributes of the nodes.
+
+def iter_preorder(node, left = 'left', right = 'right'):
+    stack = [] if node is None else [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        child = getattr(node, right)
+        if child is not None:
+            stack.append(child)
+        child = getattr(node, left)
+        if child is not None:
+            stack.append(child)
+
+def iter_inorder(node, left = 'left', right = 'right'):
+    stack = []
+    while stack or node is not None:
+        if node is not None:
+            stack.append(node)
+            node = getattr(node, left)
+        else:
+            node = stack.pop()
+            yield node
+            node = getattr(node, right)
+
+def iter_postorder(node, left = 'left', right = 'right'):
+    stack = []
+    last = None
+    while stack or node is not None:
+        if node is not None:
+            stack.append(node)
+            node = getattr(node, left)
+        else:
+            child = getattr(stack[-1], right)
+            if child is not None and child is not last:
+                node = child
+            else:
+                last = stack.pop()
+                yield last
+
+def iter_levels(node, left = 'left', right = 'right', level = 1):
+    """Breadth first traversal, yields (level, node)."""
+    q = deque() if node is None else deque([(level, node)])
+    while q:
+        level, node = q.popleft()
+        yield level, node
+        child = getattr(node, left)
+        if child is not None:
+            q.append((level+1, child))
+        child = getattr(node, right)
+        if child is not None:
+            q.append((level+1, child))
+
+def _unique(iterable):
+    """Sorted (key, value) pairs as a list, the last value wins on equal keys."""
+    items = []
+    for key, value in iterable:
+        if items and not items[-1][0] < key:
+            if key < items[-1][0]:
+                raise ValueError('keys are not sorted: %r after %r' % (key, items[-1][0]))
+            items[-1] = (key, value)
+        else:
+            items.append((key, value))
+    return items
+
+def iter_range(node, kmin, kmax, left = 'left', right = 'right'):
+    """In order nodes of a search tree with kmin <= node.key <= kmax."""
+    stack = []
+    while stack or node is not None:
+        if node is not None:
+            if node.key < kmin:
+                node = getattr(node, right)
+            else:
+                stack.append(node)
+                node = getattr(node, left)
+        else:
+            node = stack.pop()
+            if node.key > kmax:
+                return
+            yield node
+            node = getattr(node, right)
+
+################################################################################
+
+class BinaryTreeBase(object):
+    """
+    Traversals shared by the binary trees, the tree keeps its root node in
+    self.root and the child attributes of the nodes are named by _left and
+    _right.
+
+    >>> class Node(object):
+    ...     def __init__(self, key, left = None, right = None):
+    ...         self.key, self.left, self.right = key, left, right
+    ...     __repr__ = lambda self: str(self.key)
+    >>> t = BinaryTreeBase()
+    >>> t.root = Node(4, Node(2, Node(1), Node(3)), Node(6, Node(5)))
+    >>> t.preorder(), t.inorder(), t.postorder()
+    ([4, 2, 1, 3, 6, 5], [1, 2, 3, 4, 5, 6], [1, 3, 2, 5, 6, 4])
+    >>> list(t.iter_levels())
+    [(1, 4), (2, 2), (2, 6), (3, 1), (3, 3), (3, 5)]
+    >>> list(t.searchRange(2, 5))
+    [2, 3, 4, 5]
+    >>> next(t.iter_inorder())
+    1
+    """
+
+    root = None
+    _left = 'left'
+    _right = 'right'
+
+    def _start(self, node):
+        return self.root if node is None else node
+
+    def iter_preorder(self, node = None):
+        return iter_preorder(self._start(node), self._left, self._right)
+
+    def iter_inorder(self, node = None):
+        return iter_inorder(self._start(node), self._left, self._right)
+
+    def iter_postorder(self, node = None):
+        return iter_postorder(self._start(node), self._left, self._right)
+
+    def iter_levels(self, node = None, level = 1):
+        return iter_levels(self._start(node), self._left, self._right, level)
+
+    def searchRange(self, kmin, kmax):
+        """Nodes with kmin <= key <= kmax, in order, as a generator."""
+        return iter_range(self.root, kmin, kmax, self._left, self._right)
+
+    #### bulk loading
+
+    @classmethod
+    def from_sorted(cls, iterable):
+        """
+        Perfectly balanced tree from (key, value) pairs in ascending key
+        order, built in O(n) without a single rotation. A repeated key keeps
+        its last value, like put does.
+        """
+        items = _unique(iterable)
+        tree = cls()
+        # nothing to collect while the nodes are being linked up, and the
+        # cyclic collector would otherwise rescan them over and over
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            tree.root = tree._build(items, 0, len(items), None)
+        finally:
+            if enabled:
+                gc.enable()
+        tree.size = len(items)
+        return tree
+
+    @classmethod
+    def from_unsorted(cls, iterable):
+        return cls.from_sorted(sorted(iterable, key = itemgetter(0)))
+
+    def _build(self, items, start, end, parent):
+        if start >= end:
+            return None
+        mid = (start + end) // 2
+        key, value = items[mid]
+        node = self._new_node(key, value, parent, mid - start, end - mid - 1)
+        setattr(node, self._left, self._build(items, start, mid, node))
+        setattr(node, self._right, self._build(items, mid + 1, end, node))
+        return node
+
+    def _new_node(self, key, value, parent, nleft, nright):
+        """Node for from_sorted, nleft/nright are the sizes of its subtrees."""
+        raise NotImplementedError
 
     def preorder(self):
         return self._preorder(self.root)
 
     def _preorder(self, node):
-        nodes = []
-        nodes.append(node)
-        if node.has_left():
-            nodes.extend(self._preorder(node.left))
-        if node.has_right():
-            nodes.extend(self._preorder(node.right))
-
-        return nodes
+        return list(self.iter_preorder(node))
 
     def inorder(self):
         return self._inorder(self.root)
 
     def _inorder(self, node):
-        nodes = []
-        if node.has_left():
-            nodes.extend(self._inorder(node.left))
-        nodes.append(node)
-        if node.has_right():
-            nodes.extend(self._inorder(node.right))
-
-        return nodes
+        return list(self.iter_inorder(node))
 
     def postorder(self):
         return self._postorder(self.root)
 
     def _postorder(self, node):
-        nodes = []
-        if node.has_left():
-            nodes.extend(self._postorder(node.left))
-        if node.has_right():
-            nodes.extend(self._postorder(node.right))
-        nodes.append(node)
-
-        return nodes
+        return list(self.iter_postorder(node))
 
     def bft(self, node, level = 1):
         """Breadth first traversal."""
-        q = Queue.Queue()
-        level = level
-        q.put((level, node))
-
-        while not q.empty():
-            level, node = q.get()
-            yield (level, node)
-            if node.has_left():
-                q.put((level+1, node.left))
-            if node.has_right():
-                q.put((level+1, node.right))
+        return self.iter_levels(node, level)
 
     def levels(self):
         leveldict = {}
@@ -115,9 +261,28 @@ class BinaryTreeBase(object)
         return leveldict
 
     def pprint(self):
+        """
+        Which side a node hangs on is read from its parent's _left/_right
+        attribute, so trees with leftChild/rightChild nodes print too.
+
+        >>> class Node(object):
+        ...     def __init__(self, key, left = None, right = None):
+        ...         self.key, self.leftChild, self.rightChild = key, left, right
+        ...     __repr__ = lambda self: str(self.key)
+        >>> t = BinaryTreeBase()
+        >>> t._left, t._right = 'leftChild', 'rightChild'
+        >>> t.root = Node(4, Node(2, Node(1), Node(3)), Node(6, Node(5)))
+        >>> t.pprint()
+           4
+         /  \\
+         2   6
+        /\\  /
+        1 3 5
+        """
         nodes = self.inorder()
-        length = [len(str(e)) for e in nodes]
         leveldict = self.levels()
+        # '/' or '\\' for every child, filled in one level ahead
+        sides = {}
         levels = leveldict.keys()
         for level in levels:
             levelnodes = leveldict.get(level)
@@ -130,10 +295,15 @@ class BinaryTreeBase(object)
                 end = start + len(str(node))
                 starts.append(start)
                 ends.append(end)
-                if node.is_left():
-                    branches.append((end-1, '/'))
-                elif node.is_right():
-                    branches.append((start-1, '\\'))
+                for attr, side in ((self._left, '/'), (self._right, '\\')):
+                    child = getattr(node, attr)
+                    if child is not None:
+                        sides[id(child)] = side
+                side = sides.get(id(node))
+                if side == '/':
+                    branches.append((end-1, side))
+                elif side == '\\':
+                    branches.append((start-1, side))
                 else:
                     if level > 1:
                         print 'error node: ', node
@@ -147,3 +317,74 @@ class BinaryTreeBase(object)
             pair = ['%s%s' % (' '*spaces[j], levelnodes[j]) for j in range(len(spaces))]
             print ''.join(pair)
 
+
+
+class SizedTreeBase(BinaryTreeBase):
+    """
+    Search tree whose nodes keep the size of their subtree in node.size,
+    which makes the order statistics O(log n). select and rank are 1-based
+    like SBTree's.
+
+    >>> from avl import AVLTree
+    >>> t = AVLTree.from_unsorted((k, str(k)) for k in [5, 1, 9, 3, 7])
+    >>> t.select(2).key, t.rank(7), t.rank(4)
+    (3, 4, 0)
+    >>> t.count_range(2, 8), t.percentile(50).key, t.percentile(100).key
+    (3, 5, 9)
+    """
+
+    def _sizeof(self, node):
+        return 0 if node is None else node.size
+
+    def _resize(self, node):
+        node.size = (1 + self._sizeof(getattr(node, self._left))
+                       + self._sizeof(getattr(node, self._right)))
+
+    def _shrink(self, node):
+        """One node was unlinked below node, fix the sizes up to the root."""
+        while node is not None:
+            node.size -= 1
+            node = node.parent
+
+    def select(self, k):
+        """The node of the k-th smallest key, None if k is out of range."""
+        node = self.root
+        while node is not None:
+            r = self._sizeof(getattr(node, self._left)) + 1
+            if k == r:
+                return node
+            elif k < r:
+                node = getattr(node, self._left)
+            else:
+                k -= r
+                node = getattr(node, self._right)
+        return None
+
+    def count_less(self, key, inclusive = False):
+        """Number of keys < key, or <= key if inclusive."""
+        count = 0
+        node = self.root
+        while node is not None:
+            if key < node.key or (key == node.key and not inclusive):
+                node = getattr(node, self._left)
+            else:
+                count += self._sizeof(getattr(node, self._left)) + 1
+                node = getattr(node, self._right)
+        return count
+
+    def rank(self, key):
+        """1-based position of key, 0 if key is not in the tree."""
+        count = self.count_less(key, True)
+        node = self.select(count)
+        return count if node is not None and node.key == key else 0
+
+    def count_range(self, kmin, kmax):
+        """Number of keys with kmin <= key <= kmax."""
+        return max(0, self.count_less(kmax, True) - self.count_less(kmin))
+
+    def percentile(self, p):
+        """Node at the p-th percentile (0 <= p <= 100), nearest rank."""
+        if not 0 <= p <= 100:
+            raise ValueError('percentile out of range: %r' % p)
+        n = self._sizeof(self.root)
+        return self.select(max(1, int(math.ceil(p * n / 100.0))))
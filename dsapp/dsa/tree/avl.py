@@ -4,14 +4,18 @@
 import sys
 import random
 
+from dsa.tree import SizedTreeBase
+
 MAXINT = 1000
 
 class AVLNode(object):
+    __slots__ = ["key", "payload", "balance", "size", "leftChild", "rightChild", "parent"]
     
     def __init__(self, key, val, left=None, right=None, parent=None):
         self.key = key
         self.payload = val
         self.balance = 0
+        self.size = 1
         self.leftChild = left
         self.rightChild = right
         self.parent = parent
@@ -105,7 +109,10 @@ class AVLNode(object):
     __repr__ = __str__
 
 
-class AVLTree(object):
+class AVLTree(SizedTreeBase):
+
+    _left = 'leftChild'
+    _right = 'rightChild'
 
     def __init__(self):
         self.root = None
@@ -115,7 +122,18 @@ class AVLTree(object):
         return self.size
 
 
+    def _new_node(self, key, val, parent, nleft, nright):
+        node = AVLNode(key, val, parent = parent)
+        # a perfectly balanced subtree of n nodes is n.bit_length() high
+        node.balance = nleft.bit_length() - nright.bit_length()
+        node.size = nleft + nright + 1
+        return node
+
     def put(self, key, val):
+        node = self._get(key, self.root)
+        if node:
+            node.payload = val
+            return
         if self.root:
             self._put(key, val, self.root)
         else:
@@ -123,6 +141,8 @@ class AVLTree(object):
         self.size += 1
 
     def _put(self, key, val, currentNode):
+        # the key is new, so every node on the way down gains one
+        currentNode.size += 1
         if key < currentNode.key:
             if currentNode.hasLeftChild():
                 self._put(key, val, currentNode.leftChild)
@@ -179,6 +199,8 @@ class AVLTree(object):
                 currentNode.parent.rightChild = node
         node.leftChild = currentNode
         currentNode.parent = node
+        node.size = currentNode.size
+        self._resize(currentNode)
         currentNode.balance = currentNode.balance + 1 - min(node.balance, 0)
         node.balance = node.balance + 1 + max(currentNode.balance, 0) 
 
@@ -199,6 +221,8 @@ class AVLTree(object):
                 currentNode.parent.rightChild = node
         node.rightChild = currentNode
         currentNode.parent = node
+        node.size = currentNode.size
+        self._resize(currentNode)
         currentNode.balance = currentNode.balance - 1 - max(node.balance, 0)
         node.balance = node.balance - 1 + min(currentNode.balance, 0) 
 
@@ -238,40 +262,47 @@ class AVLTree(object):
             raise KeyError('Error, key not in tree')
 
     def remove(self,currentNode):
-        if currentNode.isLeaf(): #leaf
-            if currentNode == currentNode.parent.leftChild:
-                currentNode.parent.leftChild = None
-            else:
-                currentNode.parent.rightChild = None
-        elif currentNode.hasBothChildren(): #interior
-            if currentNode.leftChild.priority < currentNode.rightChild.priority:
-                self.rightRotate(currentNode)
-            else:
-                self.leftRotate(currentNode)
-            self.remove(currentNode)
+        if currentNode.hasBothChildren(): #interior
+            # take over the successor's item and unlink the successor instead
+            succ = currentNode.rightChild.findMin()
+            currentNode.key, currentNode.payload = succ.key, succ.payload
+            currentNode = succ
+        if currentNode.hasLeftChild():
+            child = currentNode.leftChild
         else:
-            if currentNode.hasLeftChild():
-                currentNode.parent.leftChild = currentNode.leftChild
-                currentNode.leftChild.parent = currentNode.parent
-            if currentNode.hasRightChild():
-                currentNode.parent.rightChild = currentNode.rightChild
-                currentNode.rightChild.parent = currentNode.parent
-
-    def searchRange(self, kmin, kmax):
-        result = []
-        if self.root:
-            self._searchRange(kmin, kmax, result, self.root)
-        return result
-    
-    def _searchRange(self, kmin, kmax, result, currentNode):
-        if currentNode:
-            if  kmin < currentNode.key:
-                self._searchRange(kmin, kmax, result, currentNode.leftChild)
-            if kmin <= currentNode.key <= kmax:
-                result.append(currentNode)
-            if kmin > currentNode.key or currentNode.key < kmax:
-                self._searchRange(kmin, kmax, result, currentNode.rightChild)
-
+            child = currentNode.rightChild
+        parent = currentNode.parent
+        if child:
+            child.parent = parent
+        if parent is None:
+            self.root = child
+            return
+        self._shrink(parent)
+        if currentNode.isLeftChild():
+            parent.leftChild = child
+            parent.balance -= 1
+        else:
+            parent.rightChild = child
+            parent.balance += 1
+        self.retrace(parent)
+
+    def retrace(self, node):
+        """One side of node just lost a level, walk up fixing the balances."""
+        while node:
+            if node.balance < -1 or node.balance > 1:
+                self.rebalance(node)
+                node = node.parent
+                if node.balance != 0:
+                    return
+            elif node.balance != 0:
+                return
+            if node.isRoot():
+                return
+            if node.isLeftChild():
+                node.parent.balance -= 1
+            else:
+                node.parent.balance += 1
+            node = node.parent
 
     def splitLevels(self):
         if self.root:
@@ -329,45 +360,6 @@ class AVLTree(object):
             print ''.join(pair)
 
 
-    def preorder(self):
-        return self._preorder(self.root)
-    
-    def _preorder(self, currentNode):
-        nodes = []
-        nodes.append(currentNode)
-        if currentNode.hasLeftChild():
-            nodes.extend(self._preorder(currentNode.leftChild))
-        if currentNode.hasRightChild:
-            nodes.extend(self._preorder(currentNode.rightChild))
-        
-        return nodes
-
-    def inorder(self):
-        return self._inorder(self.root)
-    
-    def _inorder(self, currentNode):
-        nodes = []
-        if currentNode.hasLeftChild():
-            nodes.extend(self._inorder(currentNode.leftChild))
-        nodes.append(currentNode)
-        if currentNode.hasRightChild():
-            nodes.extend(self._inorder(currentNode.rightChild))
-        
-        return nodes
-
-    def postorder(self):
-        return self._postorder(self.root)
-    
-    def _postorder(self, currentNode):
-        nodes = []
-        if currentNode.hasLeftChild():
-            nodes.extend(self._postorder(currentNode.leftChild))
-        nodes.append(currentNode)
-        if currentNode.hasRightChild():
-            nodes.extend(self._postorder(currentNode.rightChild))
-        
-        return nodes
-
     def __getitem__(self, k):
         return self.get(k)
 
@@ -387,7 +379,174 @@ class AVLTree(object):
         return self.size
 
     def __iter__(self):
-        return self.root.__iter__()
+        return (node.key for node in self.iter_inorder())
+
+################################################################################
+
+# Persistent AVL tree: nodes are never changed once they are linked in, an
+# update copies the path from the root down to the changed node and shares
+# everything else with the previous version.
+
+class PersistentAVLNode(object):
+    __slots__ = ["key", "payload", "height", "size", "leftChild", "rightChild"]
+
+    def __init__(self, key, val, left=None, right=None):
+        self.key = key
+        self.payload = val
+        self.leftChild = left
+        self.rightChild = right
+        self.height = 1 + max(_height(left), _height(right))
+        self.size = 1 + _size(left) + _size(right)
+
+    def __str__(self):
+        return '(%s:%s) ' % (self.key, self.height)
+
+    __repr__ = __str__
+
+def _height(node):
+    return node.height if node else 0
+
+def _size(node):
+    return node.size if node else 0
+
+def _balanced(key, val, left, right):
+    """New node over left and right, rotated if their heights differ by 2."""
+    if _height(left) > _height(right) + 1:
+        if _height(left.leftChild) >= _height(left.rightChild):
+            return PersistentAVLNode(left.key, left.payload, left.leftChild,
+                                     PersistentAVLNode(key, val, left.rightChild, right))
+        mid = left.rightChild
+        return PersistentAVLNode(mid.key, mid.payload,
+                                 PersistentAVLNode(left.key, left.payload, left.leftChild, mid.leftChild),
+                                 PersistentAVLNode(key, val, mid.rightChild, right))
+    if _height(right) > _height(left) + 1:
+        if _height(right.rightChild) >= _height(right.leftChild):
+            return PersistentAVLNode(right.key, right.payload,
+                                     PersistentAVLNode(key, val, left, right.leftChild),
+                                     right.rightChild)
+        mid = right.leftChild
+        return PersistentAVLNode(mid.key, mid.payload,
+                                 PersistentAVLNode(key, val, left, mid.leftChild),
+                                 PersistentAVLNode(right.key, right.payload, mid.rightChild, right.rightChild))
+    return PersistentAVLNode(key, val, left, right)
+
+def _insert(node, key, val):
+    if node is None:
+        return PersistentAVLNode(key, val)
+    if key < node.key:
+        return _balanced(node.key, node.payload, _insert(node.leftChild, key, val), node.rightChild)
+    elif key > node.key:
+        return _balanced(node.key, node.payload, node.leftChild, _insert(node.rightChild, key, val))
+    else:
+        return PersistentAVLNode(key, val, node.leftChild, node.rightChild)
+
+def _pop_min(node):
+    """(smallest node, the subtree without it)"""
+    if node.leftChild is None:
+        return node, node.rightChild
+    least, left = _pop_min(node.leftChild)
+    return least, _balanced(node.key, node.payload, left, node.rightChild)
+
+def _remove(node, key):
+    if node is None:
+        raise KeyError('Error, key not in tree')
+    if key < node.key:
+        return _balanced(node.key, node.payload, _remove(node.leftChild, key), node.rightChild)
+    elif key > node.key:
+        return _balanced(node.key, node.payload, node.leftChild, _remove(node.rightChild, key))
+    elif node.leftChild is None:
+        return node.rightChild
+    elif node.rightChild is None:
+        return node.leftChild
+    else:
+        succ, right = _pop_min(node.rightChild)
+        return _balanced(succ.key, succ.payload, node.leftChild, right)
+
+
+class PersistentAVLTree(SizedTreeBase):
+    """
+    AVL tree with path copying: put and delete build a new root in
+    O(log n) and share the untouched nodes with the old one, so a version
+    never changes once it is published. snapshot() is O(1), readers can use
+    it without locks while one writer keeps updating the tree, and a version
+    is garbage collected as soon as nobody holds it.
+
+    >>> t = PersistentAVLTree.from_sorted((k, str(k)) for k in range(5))
+    >>> s = t.snapshot()
+    >>> root = t.put(9, '9')
+    >>> root is t.root, s.root.leftChild is t.root.leftChild
+    (True, True)
+    >>> root = t.delete(0)
+    >>> list(t), list(s)
+    ([1, 2, 3, 4, 9], [0, 1, 2, 3, 4])
+    """
+
+    _left = 'leftChild'
+    _right = 'rightChild'
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def length(self):
+        return self.size
+
+    def _new_node(self, key, val, parent, nleft, nright):
+        node = PersistentAVLNode(key, val)
+        node.size = nleft + nright + 1
+        node.height = node.size.bit_length()
+        return node
+
+    def _publish(self, root):
+        # root first: a reader that grabs self.root always sees a whole version
+        self.root = root
+        self.size = _size(root)
+        return root
+
+    def snapshot(self):
+        """Read-only view of the current version."""
+        tree = self.__class__()
+        tree.root = root = self.root
+        tree.size = _size(root)
+        return tree
+
+    def put(self, key, val):
+        """Insert or replace key, returns the new root."""
+        return self._publish(_insert(self.root, key, val))
+
+    def delete(self, key):
+        """Remove key, returns the new root."""
+        return self._publish(_remove(self.root, key))
+
+    def get(self, key):
+        node = self.root
+        while node:
+            if key < node.key:
+                node = node.leftChild
+            elif key > node.key:
+                node = node.rightChild
+            else:
+                return node
+        return None
+
+    def __getitem__(self, k):
+        return self.get(k)
+
+    def __contains__(self, k):
+        return self.get(k) is not None
+
+    def __setitem__(self, k, v):
+        self.put(k, v)
+
+    def __delitem__(self, key):
+        self.delete(key)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return (node.key for node in self.iter_inorder())
+
 
 if __name__ == '__main__':
     #test_BinaryTree()
@@ -409,4 +568,4 @@ if __name__ == '__main__':
 
     print 'AVL size: ', r.size
     r.printTree()
-    print r.searchRange(3, 7)
+    print list(r.searchRange(3, 7))
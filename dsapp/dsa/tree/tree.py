@@ -1,6 +1,8 @@
 #! /usr/bin/env python
 # coding: utf-8
 
+from dsa.tree import iter_preorder, iter_inorder, iter_postorder
+
 ################################################################################
 
 class BinaryTree(object):
@@ -39,25 +41,16 @@ class BinaryTree(object):
             self.rightChild = t
 
     def preorder(self):
-        print self.root
-        if self.leftChild:
-            self.leftChild.preorder()
-        if self.rightChild:
-            self.rightChild.preorder()
+        for t in iter_preorder(self, 'leftChild', 'rightChild'):
+            print t.root
 
     def inorder(self):
-        if self.leftChild:
-            self.leftChild.inorder()
-        print self.root
-        if self.rightChild:
-            self.rightChild.inorder()
+        for t in iter_inorder(self, 'leftChild', 'rightChild'):
+            print t.root
 
     def postorder(self):
-        if self.leftChild:
-            self.leftChild.postorder()
-        if self.rightChild:
-            self.rightChild.postorder()
-        print self.root
+        for t in iter_postorder(self, 'leftChild', 'rightChild'):
+            print t.root
 
 
 def test_BinaryTree():
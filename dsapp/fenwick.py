@@ -0,0 +1,430 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+"""
+Fenwick tree (binary indexed tree) and some examples.
+
+Point update with range sum, range update with range sum, in 1-D and 2-D.
+Everything is O(log n) per operation (O(log n * log m) in 2-D) and the
+trees are built from a list or numpy array in O(n) with numpy.
+
+Reference:
+
+- http://en.wikipedia.org/wiki/Fenwick_tree
+- http://www.topcoder.com/tc?module=Static&d1=tutorials&d2=binaryIndexedTrees
+
+"""
+
+from array import array
+
+import numpy as np
+
+################################################################################
+
+def _lowbit(idx):
+    return idx & -idx
+
+def _buffer(typecode, values):
+    """array buffer holding values, copied through a numpy view."""
+    buf = array(typecode, [0]) * len(values)
+    np.frombuffer(buf, dtype = typecode)[:] = values
+    return buf
+
+def _build(values, typecode):
+    """
+    Fenwick layout of values, 1-based with a leading 0, in O(n): node i
+    holds the sum of values (i - lowbit(i), i], taken from prefix sums.
+    """
+    n = len(values)
+    prefix = np.zeros(n + 1, dtype = typecode)
+    np.cumsum(values, out = prefix[1:])
+    idx = np.arange(1, n + 1)
+    tree = np.zeros(n + 1, dtype = typecode)
+    tree[1:] = prefix[idx] - prefix[idx - _lowbit(idx)]
+    return tree
+
+def _build2d(values, typecode):
+    """Fenwick layout of a 2-D array, see _build."""
+    n, m = values.shape
+    prefix = np.zeros((n + 1, m + 1), dtype = typecode)
+    prefix[1:, 1:] = values.cumsum(0).cumsum(1)
+    i = np.arange(n + 1)
+    j = np.arange(m + 1)
+    i0 = (i - _lowbit(i))[:, None]
+    j0 = (j - _lowbit(j))[None, :]
+    i = i[:, None]
+    j = j[None, :]
+    tree = prefix[i, j] - prefix[i0, j] - prefix[i, j0] + prefix[i0, j0]
+    tree[0, :] = 0
+    tree[:, 0] = 0
+    return tree
+
+################################################################################
+
+class FenwickTree(object):
+    """
+    Point update, range sum.
+
+    Positions are base, base+1, ..., base+n-1 and intervals are closed,
+    as in segmenttree.ArraySegmentTree.
+
+    >>> ft = FenwickTree([1, 2, 3, 4, 5])
+    >>> ft.query(1, 3)
+    9
+    >>> ft.update(2, 10)
+    >>> ft.query(0, 4), ft.prefix(2), ft.tolist()
+    (25, 16, [1, 2, 13, 4, 5])
+    """
+
+    base = 0
+    typecode = 'l'
+
+    def __init__(self, values = (), base = None, typecode = None):
+        if base is not None:
+            self.base = base
+        if typecode is not None:
+            self.typecode = typecode
+        if not hasattr(values, '__len__'):
+            values = list(values)
+        values = np.asarray(values, dtype = self.typecode).ravel()
+        self.n = len(values)
+        self.tree = _buffer(self.typecode, _build(values, self.typecode))
+
+    def __len__(self):
+        return self.n
+
+    def _prefix(self, i):
+        """Sum of the first i positions."""
+        tree = self.tree
+        result = 0
+        while i > 0:
+            result += tree[i]
+            i &= i - 1
+        return result
+
+    def prefix(self, x):
+        """Sum of [base, x]."""
+        return self._prefix(min(x - self.base + 1, self.n))
+
+    def query(self, start, end):
+        """Sum of [start, end]."""
+        l = max(start - self.base, 0)
+        r = min(end - self.base + 1, self.n)
+        if l >= r:
+            return 0
+        return self._prefix(r) - self._prefix(l)
+
+    def update(self, x, delta):
+        """Add delta to position x."""
+        i = x - self.base + 1
+        if i < 1:
+            return
+        tree, n = self.tree, self.n
+        while i <= n:
+            tree[i] += delta
+            i += i & -i
+
+    def tolist(self):
+        return [self._prefix(i + 1) - self._prefix(i) for i in xrange(self.n)]
+
+################################################################################
+
+class RangeFenwickTree(object):
+    """
+    Range update, range sum, with two Fenwick trees over the updates:
+
+      prefix(x) = values[1..x] + x * sum(b1, x) - sum(b2, x)
+
+    >>> ft = RangeFenwickTree([1, 2, 3, 4, 5])
+    >>> ft.update(1, 3, 2)
+    >>> ft.query(0, 4), ft.query(2, 4), ft.tolist()
+    (21, 16, [1, 4, 5, 6, 5])
+    """
+
+    base = 0
+    typecode = 'l'
+
+    def __init__(self, values = (), base = None, typecode = None):
+        if base is not None:
+            self.base = base
+        if typecode is not None:
+            self.typecode = typecode
+        if not hasattr(values, '__len__'):
+            values = list(values)
+        values = np.asarray(values, dtype = self.typecode).ravel()
+        tc = self.typecode
+        self.n = n = len(values)
+        prefix = np.zeros(n + 1, dtype = tc)
+        np.cumsum(values, out = prefix[1:])
+        self.static = _buffer(tc, prefix)
+        self.b1 = array(tc, [0]) * (n + 1)
+        self.b2 = array(tc, [0]) * (n + 1)
+
+    def __len__(self):
+        return self.n
+
+    def _add(self, i, delta):
+        """Add delta to [i, n] (1-based)."""
+        b1, b2, n = self.b1, self.b2, self.n
+        delta2 = delta * (i - 1)
+        while i <= n:
+            b1[i] += delta
+            b2[i] += delta2
+            i += i & -i
+
+    def _prefix(self, i):
+        b1, b2 = self.b1, self.b2
+        s1 = s2 = 0
+        x = i
+        while i > 0:
+            s1 += b1[i]
+            s2 += b2[i]
+            i &= i - 1
+        return self.static[x] + s1 * x - s2
+
+    def prefix(self, x):
+        """Sum of [base, x]."""
+        return self._prefix(max(min(x - self.base + 1, self.n), 0))
+
+    def query(self, start, end):
+        """Sum of [start, end]."""
+        l = max(start - self.base, 0)
+        r = min(end - self.base + 1, self.n)
+        if l >= r:
+            return 0
+        return self._prefix(r) - self._prefix(l)
+
+    def update(self, start, end, delta):
+        """Add delta to every position in [start, end]."""
+        l = max(start - self.base, 0)
+        r = min(end - self.base + 1, self.n)
+        if l >= r:
+            return
+        self._add(l + 1, delta)
+        if r < self.n:
+            self._add(r + 1, -delta)
+
+    def tolist(self):
+        return [self._prefix(i + 1) - self._prefix(i) for i in xrange(self.n)]
+
+################################################################################
+
+class FenwickTree2D(object):
+    """
+    Point update, rectangle sum over an n*m grid. The tree is one flat
+    buffer, cell (i, j) at i*(m+1)+j.
+
+    >>> ft = FenwickTree2D([[1, 2, 3], [4, 5, 6]])
+    >>> ft.query(0, 0, 1, 2), ft.query(1, 1, 1, 2)
+    (21, 11)
+    >>> ft.update(0, 1, 10)
+    >>> ft.query(0, 1, 1, 1), ft.prefix(0, 2)
+    (17, 16)
+    """
+
+    base = 0
+    typecode = 'l'
+
+    def __init__(self, values = (), base = None, typecode = None):
+        if base is not None:
+            self.base = base
+        if typecode is not None:
+            self.typecode = typecode
+        values = np.asarray(values, dtype = self.typecode)
+        if values.size == 0:
+            values = values.reshape(0, 0)
+        self.n, self.m = values.shape
+        tree = _build2d(values, self.typecode)
+        self.tree = _buffer(self.typecode, tree.ravel())
+
+    @property
+    def shape(self):
+        return (self.n, self.m)
+
+    def _prefix(self, i, j):
+        """Sum of the first i rows and j columns."""
+        tree, width = self.tree, self.m + 1
+        result = 0
+        while i > 0:
+            row = i * width
+            k = j
+            while k > 0:
+                result += tree[row + k]
+                k &= k - 1
+            i &= i - 1
+        return result
+
+    def _clip(self, x, y):
+        return (max(min(x - self.base + 1, self.n), 0),
+                max(min(y - self.base + 1, self.m), 0))
+
+    def prefix(self, x, y):
+        """Sum of [base, x] * [base, y]."""
+        return self._prefix(*self._clip(x, y))
+
+    def query(self, x1, y1, x2, y2):
+        """Sum of the rectangle [x1, x2] * [y1, y2]."""
+        i1, j1 = self._clip(x1 - 1, y1 - 1)
+        i2, j2 = self._clip(x2, y2)
+        if i1 >= i2 or j1 >= j2:
+            return 0
+        return self._prefix(i2, j2) - self._prefix(i1, j2) - \
+               self._prefix(i2, j1) + self._prefix(i1, j1)
+
+    def update(self, x, y, delta):
+        """Add delta to cell (x, y)."""
+        i, j = x - self.base + 1, y - self.base + 1
+        if i < 1 or j < 1:
+            return
+        tree, n, m = self.tree, self.n, self.m
+        width = m + 1
+        while i <= n:
+            row = i * width
+            k = j
+            while k <= m:
+                tree[row + k] += delta
+                k += k & -k
+            i += i & -i
+
+################################################################################
+
+class RangeFenwickTree2D(object):
+    """
+    Rectangle update, rectangle sum, with four Fenwick trees over the
+    updates d, d*i, d*j and d*i*j:
+
+      prefix(x, y) = values[1..x][1..y] + (x+1)(y+1) * s1
+                     - (y+1) * s2 - (x+1) * s3 + s4
+
+    >>> ft = RangeFenwickTree2D([[1, 2, 3], [4, 5, 6]])
+    >>> ft.update(0, 1, 1, 2, 1)
+    >>> ft.query(0, 0, 1, 2), ft.query(1, 2, 1, 2), ft.query(0, 0, 0, 0)
+    (25, 7, 1)
+    """
+
+    base = 0
+    typecode = 'l'
+
+    def __init__(self, values = (), base = None, typecode = None):
+        if base is not None:
+            self.base = base
+        if typecode is not None:
+            self.typecode = typecode
+        tc = self.typecode
+        values = np.asarray(values, dtype = tc)
+        if values.size == 0:
+            values = values.reshape(0, 0)
+        self.n, self.m = n, m = values.shape
+        prefix = np.zeros((n + 1, m + 1), dtype = tc)
+        prefix[1:, 1:] = values.cumsum(0).cumsum(1)
+        self.static = _buffer(tc, prefix.ravel())
+        size = (n + 1) * (m + 1)
+        self.t1 = array(tc, [0]) * size
+        self.t2 = array(tc, [0]) * size
+        self.t3 = array(tc, [0]) * size
+        self.t4 = array(tc, [0]) * size
+
+    @property
+    def shape(self):
+        return (self.n, self.m)
+
+    def _add(self, i, j, delta):
+        """Add delta to every cell >= (i, j) (1-based)."""
+        if i > self.n or j > self.m:
+            return
+        t1, t2, t3, t4 = self.t1, self.t2, self.t3, self.t4
+        n, m = self.n, self.m
+        width = m + 1
+        d2, d3, d4 = delta * i, delta * j, delta * i * j
+        while i <= n:
+            row = i * width
+            k = j
+            while k <= m:
+                t1[row + k] += delta
+                t2[row + k] += d2
+                t3[row + k] += d3
+                t4[row + k] += d4
+                k += k & -k
+            i += i & -i
+
+    def _prefix(self, x, y):
+        t1, t2, t3, t4 = self.t1, self.t2, self.t3, self.t4
+        width = self.m + 1
+        s1 = s2 = s3 = s4 = 0
+        i = x
+        while i > 0:
+            row = i * width
+            k = y
+            while k > 0:
+                s1 += t1[row + k]
+                s2 += t2[row + k]
+                s3 += t3[row + k]
+                s4 += t4[row + k]
+                k &= k - 1
+            i &= i - 1
+        return self.static[x * width + y] + (x + 1) * (y + 1) * s1 - \
+               (y + 1) * s2 - (x + 1) * s3 + s4
+
+    def _clip(self, x, y):
+        return (max(min(x - self.base + 1, self.n), 0),
+                max(min(y - self.base + 1, self.m), 0))
+
+    def prefix(self, x, y):
+        """Sum of [base, x] * [base, y]."""
+        return self._prefix(*self._clip(x, y))
+
+    def query(self, x1, y1, x2, y2):
+        """Sum of the rectangle [x1, x2] * [y1, y2]."""
+        i1, j1 = self._clip(x1 - 1, y1 - 1)
+        i2, j2 = self._clip(x2, y2)
+        if i1 >= i2 or j1 >= j2:
+            return 0
+        return self._prefix(i2, j2) - self._prefix(i1, j2) - \
+               self._prefix(i2, j1) + self._prefix(i1, j1)
+
+    def update(self, x1, y1, x2, y2, delta):
+        """Add delta to every cell of the rectangle [x1, x2] * [y1, y2]."""
+        i1, j1 = self._clip(x1 - 1, y1 - 1)
+        i2, j2 = self._clip(x2, y2)
+        if i1 >= i2 or j1 >= j2:
+            return
+        self._add(i1 + 1, j1 + 1, delta)
+        self._add(i1 + 1, j2 + 1, -delta)
+        self._add(i2 + 1, j1 + 1, -delta)
+        self._add(i2 + 1, j2 + 1, delta)
+
+################################################################################
+
+class hdu1166(FenwickTree):
+    """
+    Enemy lineup on a Fenwick tree, see segmenttree.hdu1166.
+
+    >>> import segmenttree
+    >>> segmenttree.hdu1166.benchmark(hdu1166) # doctest: +SKIP
+    """
+
+    name = 'Enemy lineup'
+    url = 'http://acm.hdu.edu.cn/showproblem.php?pid=1166'
+    label = 'FenwickTree, binary indexed tree'
+    base = 1
+
+class poj3468(RangeFenwickTree):
+    """
+    A Simple Problem with Integers on a Fenwick tree, see
+    segmenttree.poj3468.
+
+    >>> import segmenttree
+    >>> segmenttree.benchmark_engines(classes = [segmenttree.poj3468, poj3468]) # doctest: +SKIP
+    """
+
+    name = 'A Simple Problem with Integers'
+    url = 'http://poj.org/problem?id=3468'
+    labels = 'FenwickTree, binary indexed tree'
+    base = 1
+
+################################################################################
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -18,6 +18,7 @@ INF = float('inf')
 
 
 class FibonacciNode(object):
+    __slots__ = ["key", "value", "degree", "child", "parent", "left", "right", "mark"]
 
     def __init__(self, key, value = None):
         self.key = key
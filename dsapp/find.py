@@ -1,6 +1,8 @@
 #! /usr/bin/env python
 #coding: utf-8
 
+import os
+import sys
 import time
 import random
 import string
@@ -14,7 +16,7 @@ import sqlite3
 from mx.BeeBase import BeeDict
 from btree import BPlusTree
 from BTrees.OOBTree import OOBTree
-from pybtree import BTree, BPTree
+from pybtree import BTree, BPTree, PagedBPTree
 
 from bst import BinarySearchTree
 from treap import Treap
@@ -190,7 +192,7 @@ def find_range_with_bst(filename = TDATA, tmin = TMIN, tmax = TMAX):
             t.put(timestamp, user)
             
     t1 = time.time()
-    result = t.searchRange(tmin, tmax)
+    result = list(t.searchRange(tmin, tmax))
     t2 = time.time()
     print 'Time-consuming  : [setup]%6.4f [search]%6.4f [result]%s' %(t1 - t0, t2 - t1, len(result))
 
@@ -200,17 +202,14 @@ def find_range_with_treap(filename = TDATA, tmin = TMIN, tmax = TMAX):
     
       Memory-consuming: 670 MB
       Time-consuming  : [setup]91.4850 [search]0.0940 [result]32976
+      Time-consuming  : [setup]13.0979 [search]0.0358 [result]33045 (from_unsorted)
     """
-    t = Treap()
-    
     t0 = time.time()
     with open(filename, 'r') as f:
-        for line in f:
-            timestamp, user = line.rsplit(' ', 1)
-            t.put(timestamp, user)
+        t = Treap.from_unsorted(line.rsplit(' ', 1) for line in f)
             
     t1 = time.time()
-    result = t.searchRange(tmin, tmax)
+    result = list(t.searchRange(tmin, tmax))
     t2 = time.time()
     print 'Time-consuming  : [setup]%6.4f [search]%6.4f [result]%s' %(t1 - t0, t2 - t1, len(result))
 
@@ -220,17 +219,14 @@ def find_range_with_avl(filename = TDATA, tmin = TMIN, tmax = TMAX):
     
       Memory-consuming: 619 MB
       Time-consuming  : [setup]67.5160 [search]0.0940 [result]32976
+      Time-consuming  : [setup]6.9423 [search]0.2047 [result]33045 (from_unsorted)
     """
-    t = AVLTree()
-    
     t0 = time.time()
     with open(filename, 'r') as f:
-        for line in f:
-            timestamp, user = line.rsplit(' ', 1)
-            t.put(timestamp, user)
+        t = AVLTree.from_unsorted(line.rsplit(' ', 1) for line in f)
             
     t1 = time.time()
-    result = t.searchRange(tmin, tmax)
+    result = list(t.searchRange(tmin, tmax))
     t2 = time.time()
     print 'Time-consuming  : [setup]%6.4f [search]%6.4f [result]%s' %(t1 - t0, t2 - t1, len(result))
 
@@ -240,21 +236,56 @@ def find_range_with_sbt(filename = TDATA, tmin = TMIN, tmax = TMAX):
     
       Memory-consuming: 619 MB
       Time-consuming  : [setup]108.1870 [search]0.1100 [result]32976
+      Time-consuming  : [setup]9.4188 [search]0.0357 [result]33045 (from_unsorted)
     """
-    t = SBTree()
-    
     t0 = time.time()
     with open(filename, 'r') as f:
-        for line in f:
-            timestamp, user = line.rsplit(' ', 1)
-            t.put(timestamp, user)
+        t = SBTree.from_unsorted(line.rsplit(' ', 1) for line in f)
             
     t1 = time.time()
-    result = t.searchRange(tmin, tmax)
+    result = list(t.searchRange(tmin, tmax))
     t2 = time.time()
     print 'Time-consuming  : [setup]%6.4f [search]%6.4f [result]%s' %(t1 - t0, t2 - t1, len(result))
 
 
+def node_bytes(node):
+    """Size of a tree node, including its __dict__ if it has one."""
+    size = sys.getsizeof(node)
+    if hasattr(node, '__dict__'):
+        size += sys.getsizeof(node.__dict__)
+    return size
+
+def memory_per_key(numbers = (1000000, 10000000),
+                   classes = (BinarySearchTree, Treap, AVLTree, SBTree)):
+    """
+    Bytes of node overhead per key, keys and values themselves not counted.
+
+    Profile result(__dict__ nodes):
+
+      BinarySearchTree : [keys]1000000 [bytes/key]352.0
+      Treap            : [keys]1000000 [bytes/key]1112.0
+      AVLTree          : [keys]1000000 [bytes/key]1112.0
+      SBTree           : [keys]1000000 [bytes/key]1112.0
+
+    Profile result(__slots__ nodes):
+
+      BinarySearchTree : [keys]1000000 [bytes/key]88.0
+      Treap            : [keys]1000000 [bytes/key]96.0
+      AVLTree          : [keys]1000000 [bytes/key]96.0
+      SBTree           : [keys]1000000 [bytes/key]96.0
+      BinarySearchTree : [keys]10000000 [bytes/key]88.0
+    """
+    for number in numbers:
+        keys = [random.random() for i in xrange(number)]
+        for klass in classes:
+            t = klass()
+            for key in keys:
+                t.put(key, None)
+            nbytes = sum(node_bytes(node) for node in t.iter_inorder())
+            print '%-16s : [keys]%d [bytes/key]%.1f' % (klass.__name__, number, float(nbytes) / number)
+            del t
+
+
 def find_range_with_sqlite3(filename = TDATA, tmin = TMIN, tmax = TMAX):
     """
     Profile result:
@@ -392,14 +423,14 @@ def find_range_with_pybtree_BTree(filename = TDATA, tmin = TMIN, tmax = TMAX):
       
       Memory-consuming: 93 MB
       Time-consuming(list)  : [setup]16.4530 [search]0.0000 [result]34584
+
+     degree: 500, bulkload_unsorted
+
+      Time-consuming  : [setup]5.4544 [search]0.1162 [result]34621
     """
-    dic = BTree(500)
-    
     t0 = time.time()
     with open(filename, 'r') as f:
-        for line in f:
-            timestamp, user = line.rsplit('    ', 1)
-            dic[timestamp] = user
+        dic = BTree.bulkload_unsorted((line.rsplit('    ', 1) for line in f), 500)
 
     t1 = time.time()
     result = dic.keys(tmin, tmax)
@@ -424,20 +455,50 @@ def find_range_with_pybtree_BPTree(filename = TDATA, tmin = TMIN, tmax = TMAX):
       
       Memory-consuming: 95 MB
       Time-consuming  : [setup]18.4220 [search]0.0000 [result]34585
+
+     degree: 500, leaf cursor scan
+
+      Time-consuming  : [setup]9.1942 [search]0.0070 [result]34621
+
+     degree: 500, bulkload_unsorted, leaf cursor scan
+
+      Time-consuming  : [setup]5.2006 [search]0.1259 [result]34621
     """
-    dic = BPTree(500)
-    
     t0 = time.time()
     with open(filename, 'r') as f:
-        for line in f:
-            timestamp, user = line.rsplit('    ', 1)
-            dic[timestamp] = user
+        dic = BPTree.bulkload_unsorted((line.rsplit('    ', 1) for line in f), 500)
 
     t1 = time.time()
-    result = dic.keys(tmin, tmax)
+    result = [k for k, v in dic.seek(tmin).scan(tmax)]
     t2 = time.time()
     print 'Time-consuming  : [setup]%6.4f [search]%6.4f [result]%s' %(t1 - t0, t2 - t1, len(result))
 
+def find_range_with_pybtree_PagedBPTree(filename = TDATA, tmin = TMIN, tmax = TMAX,
+                                        pagefile = join(DATA_PATH, 'find.bpt'), cachesize = 1024):
+    """
+    ds: disk backed B+Tree, 4 KB pages, LRU pool of cachesize pages.
+
+    Profile result:
+
+     cachesize: 1024 (4 MB), 53 MB page file
+
+      Time-consuming  : [setup]69.3704 [search]0.0432 [result]34621
+    """
+    if exists(pagefile):
+        os.remove(pagefile)
+
+    t0 = time.time()
+    with PagedBPTree(pagefile, cachesize = cachesize) as dic:
+        with open(filename, 'r') as f:
+            for line in f:
+                timestamp, user = line.rsplit('    ', 1)
+                dic[timestamp] = user
+
+        t1 = time.time()
+        result = dic.keys(tmin, tmax)
+        t2 = time.time()
+    print 'Time-consuming  : [setup]%6.4f [search]%6.4f [result]%s' %(t1 - t0, t2 - t1, len(result))
+
 def find_range_with_mxBeeBase(filename = TDATA, tmin = TMIN, tmax = TMAX):
     """
     Faild.
@@ -475,6 +536,7 @@ if __name__ == '__main__':
     #find_range_with_treap()
     #find_range_with_avl()
     #find_range_with_sbt()
+    #memory_per_key()
     #find_range_with_FastAVLTree()
     #find_range_with_FastRBTree()
     #find_range_with_sqlite3()
@@ -482,5 +544,6 @@ if __name__ == '__main__':
     #find_range_with_BTrees()
     find_range_with_pybtree_BTree()
     #find_range_with_pybtree_BPTree()
+    #find_range_with_pybtree_PagedBPTree()
     #find_range_with_mxBeeBase()
 
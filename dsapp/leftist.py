@@ -47,6 +47,7 @@ def merge(A, B):
 
 
 class LeftistNode(object):
+    __slots__ = ["key", "value", "dist", "left", "right", "parent"]
     
     def __init__(self, key, value = None):
         self.key = key
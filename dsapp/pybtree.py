@@ -2,7 +2,12 @@
 # coding: utf-8
 
 import bisect
+import gc
 import Queue
+import random
+import sys
+import time
+from array import array
 
 try:
     # bad performance on my laptop(windows xp)
@@ -15,10 +20,11 @@ except:
 # based on chapter 18 of Introduction to Algorithms(Second Edition)
 
 class BNode(object):
+    __slots__ = ["keys", "values", "children"]
 
-    def __init__(self):
+    def __init__(self, typecode = None):
         # Will be better with deque?
-        self.keys = list()
+        self.keys = array(typecode) if typecode else list()
         self.values = list()
         self.children = list()
 
@@ -45,9 +51,22 @@ class BNode(object):
 
 class BTree(object):
 
-    def __init__(self, degree = 3):
+    def __init__(self, degree = 3, typecode = None):
+        """
+        typecode: None keeps the keys of a node in a list, any key type. An
+        array typecode such as 'l' (int64 on LP64) or 'd' (float64) keeps
+        them in a compact typed array.array instead, searched the same way
+        with bisect.
+
+        >>> b = BTree(2, 'd')
+        >>> for k in (2.5, 1.0, 4.0, 3.0):
+        ...     b[k] = str(k)
+        >>> b.root.keys, b[3.0]
+        (array('d', [2.5]), '3.0')
+        """
         self.degree = degree
-        self.root = BNode()
+        self.typecode = typecode
+        self.root = BNode(typecode)
 
         self._minkeys = self.degree - 1
         self._minchildren = self.degree
@@ -55,29 +74,97 @@ class BTree(object):
         self._maxchildren = 2 * self.degree
         #self.disk_write(self.root)
 
+    @classmethod
+    def bulkload(cls, items, degree = 3, fill_factor = 1.0, typecode = None):
+        """
+        Build a tree bottom-up from (key, value) items sorted by key, each
+        node filled to about fill_factor of its 2*degree-1 keys. Every item
+        is copied once per level instead of walked down from the root.
+
+        >>> b = BTree.bulkload([(k, str(k)) for k in range(20)], 2)
+        >>> b.root.keys, b[13], sorted(b.keys(4, 8))
+        ([11], '13', [4, 5, 6, 7, 8])
+        >>> b = BTree.bulkload([(3, 'c'), (1, 'a')])
+        Traceback (most recent call last):
+        ...
+        ValueError: items are not sorted by key
+        """
+        tree = cls(degree, typecode)
+        keys, values = _bulk_columns(items)
+        if typecode:
+            keys = array(typecode, keys)
+        per = tree._bulk_fill(fill_factor)
+
+        # nothing to collect while the levels are built, and the cyclic
+        # collector would otherwise rescan the new nodes over and over
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            tree.root = tree._bulk_build(keys, values, per)
+        finally:
+            if enabled:
+                gc.enable()
+        return tree
+
+    def _bulk_build(self, keys, values, per):
+        level = None
+        while True:
+            sizes = _bulk_sizes(len(keys), per, self._minkeys, 1)
+            nodes, upkeys, upvalues = [], keys[:0], []
+            i = c = 0
+            for size in sizes:
+                node = BNode()
+                node.keys = keys[i:i+size]
+                node.values = values[i:i+size]
+                if level is not None:
+                    node.children = level[c:c+size+1]
+                    c += size + 1
+                nodes.append(node)
+                if i + size < len(keys):
+                    upkeys.append(keys[i+size])
+                    upvalues.append(values[i+size])
+                i += size + 1
+            if len(nodes) == 1:
+                break
+            level, keys, values = nodes, upkeys, upvalues
+        return nodes[0]
+
+    @classmethod
+    def bulkload_unsorted(cls, items, degree = 3, fill_factor = 1.0, chunksize = 4000000,
+                          typecode = None):
+        """bulkload behind external_sort, for items in any order."""
+        return cls.bulkload(external_sort(items, chunksize), degree, fill_factor, typecode)
+
+    def _bulk_fill(self, fill_factor):
+        if not 0 < fill_factor <= 1:
+            raise ValueError('fill_factor must be in (0, 1]: %r' % fill_factor)
+        return max(self._minkeys, min(self._maxkeys, int(round(self._maxkeys * fill_factor))))
+
     def search(self, node, key):
-        i = bisect.bisect_left(node.keys, key)
-        if i < len(node.keys) and key == node.keys[i]:
-            return (node, i)
-        if node.is_leaf():
-            return (None, None)
-        else:
+        while True:
+            keys = node.keys
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and key == keys[i]:
+                return (node, i)
+            if not node.children:
+                return (None, None)
             # self.disk_read(node.children[i])
-            return self.search(node.children[i], key)
+            node = node.children[i]
 
     def ceiling(self, node, key):
-        i = bisect.bisect_left(node.keys, key)
-        if i < len(node.keys) and key == node.keys[i]:
-            return key
-        if node.is_leaf():
-            if i == len(node.keys):
-                return node.keys[-1]
-            return node.keys[i]
-        else:
-            return self.ceiling(node.children[i], key)
+        while True:
+            keys = node.keys
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and key == keys[i]:
+                return key
+            if not node.children:
+                if i == len(keys):
+                    return keys[-1]
+                return keys[i]
+            node = node.children[i]
 
     def split_child(self, x, i, y):
-        z = BNode()
+        z = BNode(self.typecode)
         z.keys = y.keys[self.degree:]
         z.values = y.values[self.degree:]
         if not y.is_leaf():
@@ -95,7 +182,7 @@ class BTree(object):
     def insert(self, key, value):
         if len(self.root.keys) == self._maxkeys:
             oldroot = self.root
-            self.root = BNode()
+            self.root = BNode(self.typecode)
             self.root.children.append(oldroot)
             self.split_child(self.root, 0, oldroot)
             self.insert_nonfull(self.root, key, value)
@@ -106,30 +193,29 @@ class BTree(object):
         # performance bottleneck fixed by bisect
         #while i > 0 and key < x.keys[i-1]:
         #    i -= 1
-        i = bisect.bisect_left(x.keys, key)
-        if x.is_leaf():
-            x.keys.insert(i, key)
-            x.values.insert(i, value)
-            #self.disk_write(x)
-        else:
+        while x.children:
+            i = bisect.bisect_left(x.keys, key)
             #self.disk_read(x.children[i])
             if len(x.children[i].keys) == self._maxkeys:
                 self.split_child(x, i, x.children[i])
                 if key > x.keys[i]:
                     i += 1
-            self.insert_nonfull(x.children[i], key, value)
+            x = x.children[i]
+        i = bisect.bisect_left(x.keys, key)
+        x.keys.insert(i, key)
+        x.values.insert(i, value)
+        #self.disk_write(x)
 
     def delete(self, key):
         self._delete(self.root, key)
 
     def _delete(self, node, key):
-        if key in node.keys:
+        ki = bisect.bisect_left(node.keys, key)
+        if ki < len(node.keys) and node.keys[ki] == key:
             if node.is_leaf():
-                index = node.keys.index(key)
-                node.keys.pop(index)
-                node.values.pop(index)
+                node.keys.pop(ki)
+                node.values.pop(ki)
             else:
-                ki = node.keys.index(key)
                 if len(node.children[ki].keys) >= self.degree:
                     nmax = node.children[ki].max()
                     kp = nmax.keys[-1]
@@ -416,15 +502,19 @@ def test_BTree():
 
 ################################### B+Tree #####################################
 
-from itertools import izip_longest
+from itertools import imap, islice, izip, izip_longest
+from operator import itemgetter
 
 class BPNode(object):
+    __slots__ = ["keys", "values", "children", "next", "prev"]
 
-    def __init__(self):
-        self.keys = list()
+    def __init__(self, typecode = None):
+        self.keys = array(typecode) if typecode else list()
         self.values = list()
         self.children = list()
+        # sibling leaves
         self.next = None
+        self.prev = None
 
     def is_leaf(self):
         return not bool(self.children)
@@ -447,11 +537,86 @@ class BPNode(object):
     __repr__ = __str__
 
 
+class BPCursor(object):
+    """
+    Position between two items of the leaf chain of a BPTree. next() and
+    prev() return the item after/before the position and step over it, each
+    step is O(1) and a scan holds no more than the cursor itself.
+    """
+    __slots__ = ["node", "index"]
+
+    def __init__(self, node, index = 0):
+        self.node = node
+        self.index = index
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        node, i = self.node, self.index
+        while i >= len(node.keys):
+            if node.next is None:
+                self.node, self.index = node, i
+                raise StopIteration
+            node, i = node.next, 0
+        self.node, self.index = node, i + 1
+        return node.keys[i], node.values[i]
+
+    def prev(self):
+        node, i = self.node, self.index
+        while i <= 0:
+            if node.prev is None:
+                self.node, self.index = node, i
+                raise StopIteration
+            node = node.prev
+            i = len(node.keys)
+        self.node, self.index = node, i - 1
+        return node.keys[i-1], node.values[i-1]
+
+    def take(self, n):
+        """Up to n next items as a list, copied a leaf slice at a time."""
+        items = []
+        node, i = self.node, self.index
+        while True:
+            j = min(len(node.keys), i + n - len(items))
+            items.extend(izip(node.keys[i:j], node.values[i:j]))
+            if len(items) >= n or node.next is None:
+                break
+            node, i = node.next, 0
+        self.node, self.index = node, max(i, j)
+        return items
+
+    def scan(self, kmax = None):
+        """
+        Generate the next items with key <= kmax (all of them if kmax is
+        None). The end of every leaf is found by bisect, so the cost is one
+        generator step per item. The cursor is moved a leaf ahead of the
+        items handed out, it is exact once the scan is exhausted.
+        """
+        node, i = self.node, self.index
+        while True:
+            keys = node.keys
+            j = len(keys) if kmax is None else max(i, bisect.bisect(keys, kmax, i))
+            self.node, self.index = node, j
+            for item in izip(keys[i:j], node.values[i:j]):
+                yield item
+            if j < len(keys) or node.next is None:
+                return
+            node, i = node.next, 0
+
+
 class BPTree(object):
 
-    def __init__(self, degree = 3):
+    def __init__(self, degree = 3, typecode = None):
+        """
+        typecode: None keeps the keys of a node in a list, any key type. An
+        array typecode such as 'l' (int64 on LP64) or 'd' (float64) keeps
+        them in a compact typed array.array instead, searched the same way
+        with bisect.
+        """
         self.degree = degree
-        self.root = BPNode()
+        self.typecode = typecode
+        self.root = BPNode(typecode)
 
         self._minkeys = self.degree - 1
         self._minchildren = self.degree
@@ -459,18 +624,85 @@ class BPTree(object):
         self._maxchildren = 2 * self.degree
         #self.disk_write(self.root)
 
+    @classmethod
+    def bulkload(cls, items, degree = 3, fill_factor = 1.0, typecode = None):
+        """
+        Build a tree bottom-up from (key, value) items sorted by key: the
+        leaves are sliced out of the items and linked, then every level of
+        separators is made of the first keys of the level below. Nodes are
+        filled to about fill_factor of their 2*degree-1 keys.
+
+        >>> b = BPTree.bulkload([(k, str(k)) for k in range(20)], 2)
+        >>> b.root.keys, b[13], b.keys(4, 8)
+        ([12], '13', [4, 5, 6, 7, 8])
+        >>> b = BPTree.bulkload([(k, k) for k in range(20)], 2, fill_factor = 0.5)
+        >>> b.root.min().keys, b.root.min().next.keys, len(b.items())
+        ([0, 1], [2, 3], 20)
+        """
+        tree = cls(degree, typecode)
+        keys, values = _bulk_columns(items)
+        if typecode:
+            keys = array(typecode, keys)
+        per = tree._bulk_fill(fill_factor)
+
+        # see BTree.bulkload
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            tree.root = tree._bulk_build(keys, values, per)
+        finally:
+            if enabled:
+                gc.enable()
+        return tree
+
+    def _bulk_build(self, keys, values, per):
+        level, firsts = [], keys[:0]
+        i = 0
+        for size in _bulk_sizes(len(keys), per, self._minkeys):
+            leaf = BPNode()
+            leaf.keys = keys[i:i+size]
+            leaf.values = values[i:i+size]
+            if level:
+                leaf.prev = level[-1]
+                level[-1].next = leaf
+            level.append(leaf)
+            if size:
+                firsts.append(keys[i])
+            i += size
+
+        while len(level) > 1:
+            nodes, upfirsts = [], keys[:0]
+            c = 0
+            for size in _bulk_sizes(len(level), per + 1, self._minchildren):
+                node = BPNode()
+                node.children = level[c:c+size]
+                node.keys = firsts[c+1:c+size]
+                nodes.append(node)
+                upfirsts.append(firsts[c])
+                c += size
+            level, firsts = nodes, upfirsts
+        return level[0]
+
+    @classmethod
+    def bulkload_unsorted(cls, items, degree = 3, fill_factor = 1.0, chunksize = 4000000,
+                          typecode = None):
+        """bulkload behind external_sort, for items in any order."""
+        return cls.bulkload(external_sort(items, chunksize), degree, fill_factor, typecode)
+
+    def _bulk_fill(self, fill_factor):
+        if not 0 < fill_factor <= 1:
+            raise ValueError('fill_factor must be in (0, 1]: %r' % fill_factor)
+        return max(self._minkeys, min(self._maxkeys, int(round(self._maxkeys * fill_factor))))
+
     def search(self, node, key):
-        i = bisect.bisect_left(node.keys, key)
-        if i < len(node.keys) and key == node.keys[i]:
-            if node.is_leaf():
-                return (node, i)
-            else:
-                return self.search(node.children[i+1], key)
-        if node.is_leaf():
-            return (None, None)
-        else:
+        while True:
+            keys = node.keys
+            i = bisect.bisect_left(keys, key)
+            found = i < len(keys) and key == keys[i]
+            if not node.children:
+                return (node, i) if found else (None, None)
             # self.disk_read(node.children[i])
-            return self.search(node.children[i], key)
+            node = node.children[i+1 if found else i]
 
     def ceiling(self, node, key):
         i = bisect.bisect(node.keys, key)
@@ -491,17 +723,42 @@ class BPTree(object):
         else:
             return self.ceiling(node.children[i], key)
 
+    def seek(self, key = None):
+        """
+        Cursor just before the first item with a key >= key, or before the
+        first item at all if key is None. O(log n).
+
+        >>> b = BPTree(2)
+        >>> for k in range(10):
+        ...     b[k] = str(k)
+        >>> c = b.seek(3.5)
+        >>> c.take(3), c.prev(), c.prev()
+        ([(4, '4'), (5, '5'), (6, '6')], (6, '6'), (5, '5'))
+        >>> [k for k, v in b.seek().scan(2)]
+        [0, 1, 2]
+        >>> c = b.seek(8)
+        >>> list(c.scan()), c.prev()
+        ([(8, '8'), (9, '9')], (9, '9'))
+        """
+        node = self.root
+        while node.children:
+            node = node.children[bisect.bisect_left(node.keys, key) if key is not None else 0]
+        return BPCursor(node, bisect.bisect_left(node.keys, key) if key is not None else 0)
+
     def split_child(self, x, i, y):
-        z = BPNode()
+        z = BPNode(self.typecode)
         z.keys = y.keys[self.degree:]
         z.values = y.values[self.degree:]
         if not y.is_leaf():
             z.children = y.children[self.degree:]
-            y.next = None
+            y.next = y.prev = None
         else:
             z.keys.insert(0, y.keys[self.degree-1])
             z.values.insert(0, y.values[self.degree-1])
             z.next = y.next
+            z.prev = y
+            if z.next:
+                z.next.prev = z
             y.next = z
         x.children.insert(i+1, z)
         x.keys.insert(i, y.keys[self.degree-1])
@@ -516,7 +773,7 @@ class BPTree(object):
     def insert(self, key, value):
         if len(self.root.keys) == self._maxkeys:
             oldroot = self.root
-            self.root = BPNode()
+            self.root = BPNode(self.typecode)
             self.root.children.append(oldroot)
             self.split_child(self.root, 0, oldroot)
             self.insert_nonfull(self.root, key, value)
@@ -527,31 +784,30 @@ class BPTree(object):
         # performance bottleneck fixed by bisect
         #while i > 0 and key < x.keys[i-1]:
         #    i -= 1
-        i = bisect.bisect_left(x.keys, key)
-        if x.is_leaf():
-            x.keys.insert(i, key)
-            x.values.insert(i, value)
-            #self.disk_write(x)
-        else:
+        while x.children:
+            i = bisect.bisect_left(x.keys, key)
             #self.disk_read(x.children[i])
             if len(x.children[i].keys) == self._maxkeys:
                 self.split_child(x, i, x.children[i])
                 if key > x.keys[i]:
                     i += 1
-            self.insert_nonfull(x.children[i], key, value)
+            x = x.children[i]
+        i = bisect.bisect_left(x.keys, key)
+        x.keys.insert(i, key)
+        x.values.insert(i, value)
+        #self.disk_write(x)
 
     def delete(self, key):
         self._delete(self.root, key)
 
     def _delete(self, node, key):
         """fixed!!!"""
-        if key in node.keys:
+        ki = bisect.bisect_left(node.keys, key)
+        if ki < len(node.keys) and node.keys[ki] == key:
             if node.is_leaf():
-                index = node.keys.index(key)
-                node.keys.pop(index)
-                node.values.pop(index)
+                node.keys.pop(ki)
+                node.values.pop(ki)
             else:
-                ki = node.keys.index(key)
                 if len(node.children[ki].keys) >= self.degree:
                     nmax = node.children[ki].max()
                     nmin = node.children[ki+1].min()
@@ -573,6 +829,8 @@ class BPTree(object):
                         node.children[ki].keys.extend(rnode.keys)
                         node.children[ki].values.extend(rnode.values)
                         node.children[ki].next = rnode.next
+                        if rnode.next:
+                            rnode.next.prev = node.children[ki]
                     else:
                         node.children[ki].keys.append(node.keys.pop(ki))
                         node.children[ki].keys.extend(rnode.keys)
@@ -617,6 +875,8 @@ class BPTree(object):
                             node.children[ci-1].keys.extend(rnode.keys)
                             node.children[ci-1].values.extend(rnode.values)
                             node.children[ci-1].next = rnode.next
+                            if rnode.next:
+                                rnode.next.prev = node.children[ci-1]
                         else:
                             node.children[ci-1].keys.append(node.keys.pop(ci-1))
                             node.children[ci-1].keys.extend(rnode.keys)
@@ -631,6 +891,8 @@ class BPTree(object):
                             node.children[ci].keys.extend(rnode.keys)
                             node.children[ci].values.extend(rnode.values)
                             node.children[ci].next = rnode.next
+                            if rnode.next:
+                                rnode.next.prev = node.children[ci]
                         else:
                             node.children[ci].keys.append(node.keys.pop(ci))
                             node.children[ci].keys.extend(rnode.keys)
@@ -665,25 +927,7 @@ class BPTree(object):
         return keys
 
     def iterkeys(self, kmin = None, kmax = None):
-        if kmin is None:
-            kmin = self.min()
-        if kmax is None:
-            kmax = self.max()
-        
-        return self._iterkeys(self.root, kmin, kmax)
-
-    def _iterkeys(self, node, kmin, kmax):
-        """return [k for k in allkeys if kmin <= k <= kmax]"""
-        imin = bisect.bisect_left(node.keys, kmin)
-        imax = bisect.bisect(node.keys, kmax)
-
-        if node.children:
-            for e in node.children[imin:imax+1]:
-                for k in self._iterkeys(e, kmin, kmax):
-                    yield k
-        if node.is_leaf():
-            for i in xrange(imin, imax):
-                yield node.keys[i]
+        return imap(itemgetter(0), self.seek(kmin).scan(kmax))
 
     def values(self, kmin = None, kmax = None):
         values = []
@@ -709,25 +953,7 @@ class BPTree(object):
         return values
 
     def itervalues(self, kmin = None, kmax = None):
-        if kmin is None:
-            kmin = self.min()
-        if kmax is None:
-            kmax = self.max()
-        
-        return self._itervalues(self.root, kmin, kmax)
-
-    def _itervalues(self, node, kmin, kmax):
-        """return [k for k in allkeys if kmin <= k <= kmax]"""
-        imin = bisect.bisect_left(node.keys, kmin)
-        imax = bisect.bisect(node.keys, kmax)
-
-        if node.children:
-            for e in node.children[imin:imax+1]:
-                for v in self._itervalues(e, kmin, kmax):
-                    yield v
-        if node.is_leaf():
-            for i in xrange(imin, imax):
-                yield node.values[i]
+        return imap(itemgetter(1), self.seek(kmin).scan(kmax))
 
     def items(self, kmin = None, kmax = None):
         items = []
@@ -753,15 +979,11 @@ class BPTree(object):
         return items
 
     def iteritems(self, kmin = None, kmax = None):
-        if kmin is None:
-            kmin = self.min()
-        if kmax is None:
-            kmax = self.max()
-        
-        return self._iteritems(self.root, kmin, kmax)
+        """Items with kmin <= key <= kmax in key order, via a leaf cursor."""
+        return self.seek(kmin).scan(kmax)
 
     def _iteritems(self, node, kmin, kmax):
-        """return [k for k in allkeys if kmin <= k <= kmax]"""
+        """Recursive version of iteritems, kept for benchmark_BPTree_range."""
         imin = bisect.bisect_left(node.keys, kmin)
         imax = bisect.bisect(node.keys, kmax)
 
@@ -871,6 +1093,919 @@ def test_BPTree():
     print 'iteritems()         :', list(b.iteritems())
     print 'items(min, max)     :', b.items(3.4, 7.9)
     print 'iteritems(min, max) :', list(b.iteritems(3.4, 7.9))
+    c = b.seek(5)
+    print 'seek(5).take(2)     :', c.take(2)
+    print 'prev()              :', c.prev()
+
+def benchmark_BPTree_range(n = 1000000, degree = 50, spans = (10, 1000, 100000), nqueries = 100):
+    """
+    Recursive descent (the former iteritems) vs. leaf cursor (seek + scan)
+    on nqueries random ranges of each span over n shuffled int keys.
+
+    >>> benchmark_BPTree_range() # doctest: +SKIP
+    span: 10      [recursive]0.0011 [cursor]0.0005 [result]1000
+    span: 1000    [recursive]0.0411 [cursor]0.0177 [result]100000
+    span: 100000  [recursive]3.2821 [cursor]1.3881 [result]10000000
+    """
+    keys = range(n)
+    random.shuffle(keys)
+    b = BPTree(degree)
+    for k in keys:
+        b[k] = k
+
+    for span in spans:
+        starts = [random.randint(0, n - span) for i in xrange(nqueries)]
+        t0 = time.time()
+        result = 0
+        for kmin in starts:
+            for item in b._iteritems(b.root, kmin, kmin + span - 1):
+                result += 1
+        t1 = time.time()
+        for kmin in starts:
+            for item in b.seek(kmin).scan(kmin + span - 1):
+                result -= 1
+        t2 = time.time()
+        print 'span: %-7s [recursive]%6.4f [cursor]%6.4f [result]%s' % (
+            span, t1 - t0, t2 - t1, nqueries * span if result == 0 else 'mismatch')
+
+################################# Bulk loading #################################
+
+import heapq
+import tempfile
+import cPickle
+from operator import gt
+
+def _bulk_columns(items):
+    """Split (key, value) items sorted by key into a key and a value list."""
+    items = list(items)
+    keys = map(itemgetter(0), items)
+    values = map(itemgetter(1), items)
+    if any(imap(gt, keys, islice(keys, 1, None))):
+        raise ValueError('items are not sorted by key')
+    return keys, values
+
+def _bulk_sizes(n, per, least, spare = 0):
+    """
+    Sizes of the nodes that n items are cut into, about per items each and
+    none below least, with spare items left out between two neighbours (the
+    keys a B-Tree moves up to the parent). Items are spread evenly so the
+    last node is not left underfull.
+    """
+    k = max(1, -(-(n + spare) // (per + spare)))
+    while k > 1 and (n - spare * (k - 1)) // k < least:
+        k -= 1
+    q, r = divmod(n - spare * (k - 1), k)
+    return [q + 1] * r + [q] * (k - r)
+
+def _read_run(f):
+    f.seek(0)
+    while True:
+        try:
+            batch = cPickle.load(f)
+        except EOFError:
+            f.close()
+            return
+        for item in batch:
+            yield item
+
+def external_sort(items, chunksize = 4000000, batch = 1024):
+    """
+    (key, value) items sorted by key, holding no more than chunksize of
+    them in memory: every chunk is sorted and spilled to a temporary file
+    as a run, the runs are merged lazily. Input that fits in one chunk is
+    sorted in memory only.
+
+    >>> list(external_sort([(3, 'c'), (1, 'a'), (2, 'b'), (0, '')], chunksize = 3))
+    [(0, ''), (1, 'a'), (2, 'b'), (3, 'c')]
+    """
+    items = iter(items)
+    runs = []
+    chunk = list(islice(items, chunksize))
+    while True:
+        chunk.sort(key = itemgetter(0))
+        head = list(islice(items, 1))
+        if not head and not runs:
+            return iter(chunk)
+        f = tempfile.TemporaryFile()
+        for i in xrange(0, len(chunk), batch):
+            cPickle.dump(chunk[i:i+batch], f, cPickle.HIGHEST_PROTOCOL)
+        runs.append(f)
+        if not head:
+            break
+        chunk = head + list(islice(items, chunksize - 1))
+    return heapq.merge(*[_read_run(f) for f in runs])
+
+def benchmark_bulkload(n = 1000000, degrees = (3, 50, 500)):
+    """
+    One insert per key vs. bulkload of the sorted items vs. bulkload_unsorted
+    of the shuffled items (in-memory sort + bottom-up build), n int keys.
+
+    >>> benchmark_bulkload() # doctest: +SKIP
+    BTree  degree: 3    [insert] 30.0606 [bulkload]0.6942 [unsorted]2.7665
+    BTree  degree: 50   [insert]  8.5047 [bulkload]0.3043 [unsorted]2.6182
+    BTree  degree: 500  [insert]  7.7530 [bulkload]0.3064 [unsorted]2.7723
+    BPTree degree: 3    [insert] 36.1103 [bulkload]0.8325 [unsorted]3.6381
+    BPTree degree: 50   [insert] 10.4982 [bulkload]0.3170 [unsorted]3.2311
+    BPTree degree: 500  [insert]  9.0173 [bulkload]0.2544 [unsorted]2.6046
+    """
+    items = [(k, k) for k in xrange(n)]
+    shuffled = items[:]
+    random.shuffle(shuffled)
+
+    for klass in (BTree, BPTree):
+        for degree in degrees:
+            t0 = time.time()
+            b = klass(degree)
+            for k, v in shuffled:
+                b.insert(k, v)
+            t1 = time.time()
+            klass.bulkload(items, degree)
+            t2 = time.time()
+            klass.bulkload_unsorted(shuffled, degree)
+            t3 = time.time()
+            print '%-6s degree: %-4s [insert]%8.4f [bulkload]%6.4f [unsorted]%6.4f' % (
+                klass.__name__, degree, t1 - t0, t2 - t1, t3 - t2)
+
+def _linear_search(node, key):
+    """BTree.search with the linear scan insert_nonfull once used."""
+    while True:
+        keys = node.keys
+        i = 0
+        while i < len(keys) and keys[i] < key:
+            i += 1
+        if i < len(keys) and key == keys[i]:
+            return (node, i)
+        if not node.children:
+            return (None, None)
+        node = node.children[i]
+
+def _keys_bytes(node):
+    size = sys.getsizeof(node.keys)
+    if isinstance(node.keys, list):
+        size += sum(sys.getsizeof(k) for k in node.keys)
+    return size + sum(_keys_bytes(child) for child in node.children)
+
+def benchmark_search(n = 1000000, degrees = (3, 10, 50, 100, 500, 1000), nqueries = 20000):
+    """
+    BTree.search with a linear scan of every node vs. bisect over list keys
+    vs. bisect over typed array('l') keys, on n int keys. [keys] is the
+    memory of the key containers and key objects.
+
+    >>> benchmark_search() # doctest: +SKIP
+    degree: 3     [linear] 0.3919 [bisect]0.1559 [typed]0.1460 [keys] 44 MB / 18 MB
+    degree: 10    [linear] 0.1374 [bisect]0.0815 [typed]0.0702 [keys] 34 MB / 10 MB
+    degree: 50    [linear] 0.3163 [bisect]0.0834 [typed]0.0789 [keys] 31 MB /  8 MB
+    degree: 100   [linear] 0.3650 [bisect]0.0498 [typed]0.0435 [keys] 30 MB /  7 MB
+    degree: 500   [linear] 1.3605 [bisect]0.0981 [typed]0.0756 [keys] 30 MB /  7 MB
+    degree: 1000  [linear] 2.6002 [bisect]0.0839 [typed]0.0605 [keys] 30 MB /  7 MB
+    """
+    items = [(k, k) for k in xrange(n)]
+    queries = [random.randrange(n) for i in xrange(nqueries)]
+
+    for degree in degrees:
+        b = BTree.bulkload(items, degree)
+        t = BTree.bulkload(items, degree, typecode = 'l')
+        t0 = time.time()
+        for k in queries:
+            _linear_search(b.root, k)
+        t1 = time.time()
+        for k in queries:
+            b.search(b.root, k)
+        t2 = time.time()
+        for k in queries:
+            t.search(t.root, k)
+        t3 = time.time()
+        print 'degree: %-5s [linear]%7.4f [bisect]%6.4f [typed]%6.4f [keys]%3d MB / %2d MB' % (
+            degree, t1 - t0, t2 - t1, t3 - t2, _keys_bytes(b.root) >> 20, _keys_bytes(t.root) >> 20)
+
+################################ Paged B+Tree ##################################
+
+# B+Tree kept in a single file of fixed-size pages. Page 0 is the header,
+# every other page holds one node: a leaf with its keys, values and the page
+# ids of its sibling leaves, or an internal node with separator keys and the
+# page ids of its children. Keys and values are anything marshal can store,
+# nodes split when their pages are full, not after a fixed number of keys.
+
+import os
+import mmap
+import marshal
+import struct
+from collections import OrderedDict
+
+_HEADER = struct.Struct('<4sIqqqq')     # magic, pagesize, root, npages, first leaf, count
+_PAGE = struct.Struct('<?qqII')         # leaf, next, prev, node bytes, payload size
+_MAGIC = 'BPT1'
+_NIL = -1
+_PIDSIZE = 9                            # marshalled page id, at most
+_OVERHEAD = 16                          # marshalled (keys, values) tuple and lists
+_MISSING = object()
+
+def _itemsize(obj):
+    return len(marshal.dumps(obj))
+
+class PageNode(object):
+    __slots__ = ["pid", "leaf", "keys", "values", "children", "next", "prev", "nbytes", "dirty"]
+
+    def __init__(self, pid, leaf, keys = None, values = None, children = None,
+                 next = _NIL, prev = _NIL, nbytes = None):
+        self.pid = pid
+        self.leaf = leaf
+        self.keys = keys or []
+        self.values = values or []
+        self.children = children or []
+        self.next = next
+        self.prev = prev
+        self.dirty = False
+        if nbytes is None:
+            self.measure()
+        else:
+            self.nbytes = nbytes
+
+    def measure(self):
+        """Upper bound of the page bytes, kept up to date on every change."""
+        self.nbytes = _PAGE.size + _OVERHEAD + sum(_itemsize(k) for k in self.keys)
+        if self.leaf:
+            self.nbytes += sum(_itemsize(v) for v in self.values)
+        else:
+            self.nbytes += _PIDSIZE * len(self.children)
+
+    def dump(self, pagesize):
+        payload = marshal.dumps((self.keys, self.values if self.leaf else self.children))
+        header = _PAGE.pack(self.leaf, self.next, self.prev, self.nbytes, len(payload))
+        if len(header) + len(payload) > pagesize:
+            raise ValueError('node of %d bytes overflows its page' % (len(header) + len(payload)))
+        return header + payload + '\0' * (pagesize - len(header) - len(payload))
+
+    @classmethod
+    def load(cls, pid, buf, offset):
+        leaf, next, prev, nbytes, size = _PAGE.unpack_from(buf, offset)
+        start = offset + _PAGE.size
+        keys, rest = marshal.loads(buf[start:start+size])
+        if leaf:
+            return cls(pid, True, keys, values = rest, next = next, prev = prev, nbytes = nbytes)
+        return cls(pid, False, keys, children = rest, nbytes = nbytes)
+
+    def __str__(self):
+        return '|%s|' % ' '.join(str(k) for k in self.keys)
+
+    __repr__ = __str__
+
+
+class BufferPool(object):
+    """
+    LRU cache of the nodes of a page file, at most capacity pages stay in
+    memory between operations. Pages are read through a read-only mmap of
+    the file and written back when they are evicted or flushed.
+    """
+
+    def __init__(self, filename, pagesize = 4096, capacity = 1024):
+        exists = os.path.exists(filename) and os.path.getsize(filename) > 0
+        self.file = open(filename, 'r+b' if exists else 'w+b', 0)
+        if exists:
+            magic, pagesize, root, npages, first, count = _HEADER.unpack(self.file.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError('%s is not a paged B+Tree file' % filename)
+        else:
+            root, npages, first, count = _NIL, 1, _NIL, 0
+        self.pagesize = pagesize
+        self.capacity = max(capacity, 1)
+        self.root, self.npages, self.first, self.count = root, npages, first, count
+        self.pages = OrderedDict()
+        self.mm = None
+        self.reads = self.writes = 0
+        if not exists:
+            self.write_header()
+        self._remap()
+
+    def _remap(self):
+        if self.mm is not None:
+            self.mm.close()
+        self.mm = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+
+    def get(self, pid):
+        node = self.pages.pop(pid, None)
+        if node is None:
+            offset = pid * self.pagesize
+            if offset + self.pagesize > len(self.mm):
+                self._remap()
+            node = PageNode.load(pid, self.mm, offset)
+            self.reads += 1
+        self.pages[pid] = node
+        return node
+
+    def new(self, leaf):
+        node = PageNode(self.npages, leaf)
+        node.dirty = True
+        self.npages += 1
+        self.pages[node.pid] = node
+        return node
+
+    def write(self, node):
+        self.file.seek(node.pid * self.pagesize)
+        self.file.write(node.dump(self.pagesize))
+        node.dirty = False
+        self.writes += 1
+
+    def write_header(self):
+        header = _HEADER.pack(_MAGIC, self.pagesize, self.root, self.npages, self.first, self.count)
+        self.file.seek(0)
+        self.file.write(header + '\0' * (self.pagesize - len(header)))
+
+    def trim(self):
+        """
+        Evict the least recently used pages over capacity. Only called
+        between operations, so a node is never evicted while it is changed.
+        """
+        while len(self.pages) > self.capacity:
+            pid, node = self.pages.popitem(last = False)
+            if node.dirty:
+                self.write(node)
+
+    def flush(self):
+        for node in self.pages.itervalues():
+            if node.dirty:
+                self.write(node)
+        self.write_header()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.flush()
+        self.pages.clear()
+        self.mm.close()
+        self.file.close()
+
+
+class PagedBPTree(object):
+    """
+    Disk backed B+Tree, the nodes live in a page file and only the buffer
+    pool's budget of pages is kept in memory. Keys may repeat, like BPTree.
+    Deletes do not merge underfull leaves.
+
+    >>> from tempfile import mkdtemp
+    >>> path = os.path.join(mkdtemp(), 'test.bpt')
+    >>> with PagedBPTree(path, pagesize = 256, cachesize = 4) as t:
+    ...     for k in range(200, 0, -1):
+    ...         t[k] = str(k)
+    ...     del t[50]
+    >>> t = PagedBPTree(path)
+    >>> len(t), t[7], t[50], t.keys(47, 53), t.min(), t.max()
+    (199, '7', None, [47, 48, 49, 51, 52, 53], 1, 200)
+    >>> t.close()
+    >>> t = PagedBPTree(path, cachesize = 2)
+    >>> next(t.iterkeys(100)), len(t.pool.pages) <= 2
+    (100, True)
+    >>> t.close()
+    """
+
+    def __init__(self, filename, pagesize = 4096, cachesize = 1024):
+        self.pool = BufferPool(filename, pagesize, cachesize)
+        self.room = self.pool.pagesize - _PAGE.size - _OVERHEAD
+        if self.pool.root == _NIL:
+            leaf = self.pool.new(True)
+            self.pool.root = self.pool.first = leaf.pid
+            self.flush()
+
+    def _leaf(self, key):
+        """Leftmost leaf that may hold key, the first leaf if key is None."""
+        pool = self.pool
+        if key is None:
+            return pool.get(pool.first)
+        node = pool.get(pool.root)
+        while not node.leaf:
+            node = pool.get(node.children[bisect.bisect_left(node.keys, key)])
+        return node
+
+    def insert(self, key, value):
+        size = _itemsize(key) + _itemsize(value)
+        if size + _PIDSIZE > self.room // 4:
+            raise ValueError('item of %d bytes does not fit a %d byte page' % (size, self.pool.pagesize))
+        pool = self.pool
+        split = self._insert(pool.get(pool.root), key, value, size)
+        if split:
+            sep, right = split
+            root = pool.new(False)
+            root.keys = [sep]
+            root.children = [pool.root, right.pid]
+            root.measure()
+            pool.root = root.pid
+        pool.count += 1
+        pool.trim()
+
+    def _insert(self, node, key, value, size):
+        i = bisect.bisect(node.keys, key)
+        if node.leaf:
+            node.keys.insert(i, key)
+            node.values.insert(i, value)
+            node.nbytes += size
+        else:
+            split = self._insert(self.pool.get(node.children[i]), key, value, size)
+            if split is None:
+                return None
+            sep, right = split
+            node.keys.insert(i, sep)
+            node.children.insert(i+1, right.pid)
+            node.nbytes += _itemsize(sep) + _PIDSIZE
+        node.dirty = True
+        if node.nbytes > self.room:
+            return self._split(node)
+        return None
+
+    def _split(self, node):
+        """Move the upper half of node's bytes to a new right sibling."""
+        if node.leaf:
+            sizes = [_itemsize(k) + _itemsize(v) for k, v in izip(node.keys, node.values)]
+        else:
+            sizes = [_itemsize(k) + _PIDSIZE for k in node.keys]
+        half, total, m = sum(sizes) / 2, 0, 0
+        while total < half:
+            total += sizes[m]
+            m += 1
+        m = min(max(m, 1), len(node.keys) - 1)
+
+        right = self.pool.new(node.leaf)
+        if node.leaf:
+            right.keys, node.keys = node.keys[m:], node.keys[:m]
+            right.values, node.values = node.values[m:], node.values[:m]
+            sep = right.keys[0]
+            right.next, right.prev, node.next = node.next, node.pid, right.pid
+            if right.next != _NIL:
+                after = self.pool.get(right.next)
+                after.prev = right.pid
+                after.dirty = True
+        else:
+            sep = node.keys[m]
+            right.keys, node.keys = node.keys[m+1:], node.keys[:m]
+            right.children, node.children = node.children[m+1:], node.children[:m+1]
+        node.measure()
+        right.measure()
+        return sep, right
+
+    def get(self, key, default = None):
+        node = self._leaf(key)
+        i = bisect.bisect_left(node.keys, key)
+        while i == len(node.keys) and node.next != _NIL:
+            node, i = self.pool.get(node.next), 0
+        self.pool.trim()
+        if i < len(node.keys) and node.keys[i] == key:
+            return node.values[i]
+        return default
+
+    def delete(self, key):
+        """Remove one item with key, the leaf is left as it is even if it underflows."""
+        node = self._leaf(key)
+        i = bisect.bisect_left(node.keys, key)
+        while i == len(node.keys) and node.next != _NIL:
+            node, i = self.pool.get(node.next), 0
+        if i == len(node.keys) or node.keys[i] != key:
+            self.pool.trim()
+            raise KeyError(key)
+        node.nbytes -= _itemsize(node.keys.pop(i)) + _itemsize(node.values.pop(i))
+        node.dirty = True
+        self.pool.count -= 1
+        self.pool.trim()
+
+    def iteritems(self, kmin = None, kmax = None):
+        """
+        Items with kmin <= key <= kmax, following the leaf links. The pool
+        is trimmed after every page read and once more when the generator
+        finishes or is dropped early, so it stays within capacity between
+        operations.
+        """
+        try:
+            node = self._leaf(kmin)
+            self.pool.trim()
+            i = 0 if kmin is None else bisect.bisect_left(node.keys, kmin)
+            while True:
+                keys, values = node.keys, node.values
+                for j in xrange(i, len(keys)):
+                    if kmax is not None and keys[j] > kmax:
+                        return
+                    yield keys[j], values[j]
+                if node.next == _NIL:
+                    return
+                node, i = self.pool.get(node.next), 0
+                self.pool.trim()
+        finally:
+            self.pool.trim()
+
+    def iterkeys(self, kmin = None, kmax = None):
+        return (k for k, v in self.iteritems(kmin, kmax))
+
+    def itervalues(self, kmin = None, kmax = None):
+        return (v for k, v in self.iteritems(kmin, kmax))
+
+    def items(self, kmin = None, kmax = None):
+        return list(self.iteritems(kmin, kmax))
+
+    def keys(self, kmin = None, kmax = None):
+        return list(self.iterkeys(kmin, kmax))
+
+    def values(self, kmin = None, kmax = None):
+        return list(self.itervalues(kmin, kmax))
+
+    def min(self):
+        pool = self.pool
+        node = self._leaf(None)
+        while not node.keys and node.next != _NIL:
+            node = pool.get(node.next)
+        pool.trim()
+        return node.keys[0] if node.keys else None
+
+    def max(self):
+        pool = self.pool
+        node = pool.get(pool.root)
+        while not node.leaf:
+            node = pool.get(node.children[-1])
+        while not node.keys and node.prev != _NIL:
+            node = pool.get(node.prev)
+        pool.trim()
+        return node.keys[-1] if node.keys else None
+
+    def flush(self):
+        self.pool.flush()
+
+    def close(self):
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.pool.count
+
+    def __contains__(self, k):
+        return self.get(k, _MISSING) is not _MISSING
+
+    def __setitem__(self, k, v):
+        self.insert(k, v)
+
+    def __getitem__(self, k):
+        return self.get(k)
+
+    def __delitem__(self, k):
+        self.delete(k)
+
+def test_PagedBPTree():
+    from tempfile import mkdtemp
+    path = os.path.join(mkdtemp(), 'test.bpt')
+    b = PagedBPTree(path, pagesize = 128, cachesize = 2)
+    for k in [0, 8, 9, 1, 7, 2, 6, 3, 5, 4, 10, 11]:
+        b[k] = str(k)
+    del b[11]
+    del b[1]
+    b.close()
+    b = PagedBPTree(path)
+    print 'pages               :', b.pool.npages
+    print 'min key: ', b.min()
+    print 'max key: ', b.max()
+    print 'keys                :', b.keys()
+    print 'keys(min, max)      :', b.keys(3.4, 7.9)
+    print 'values(min, max)    :', b.values(3.4, 7.9)
+    print 'items(min, max)     :', b.items(3.4, 7.9)
+    b.close()
+
+############################## Concurrent B+Tree ###############################
+
+import threading
+
+class CBPNode(object):
+    """
+    BPNode with a latch for writers and a version for readers: a writer
+    holds the latch and keeps the version odd while it changes the node,
+    a reader trusts what it read only if the version did not move.
+    """
+    __slots__ = ["keys", "values", "children", "next", "latch", "version"]
+
+    def __init__(self):
+        self.keys = list()
+        self.values = list()
+        self.children = list()
+        self.next = None
+        self.latch = threading.Lock()
+        self.version = 0
+
+    def __str__(self):
+        return '|%s|' % ' '.join(['{%s:%s}' % e for e in izip_longest(self.keys, self.values)])
+
+    __repr__ = __str__
+
+
+class ConcurrentBPTree(object):
+    """
+    Thread safe B+Tree with unique keys (insert replaces the value).
+
+    Writers crab down with latches: full nodes are split on the way down,
+    so a child's latch is taken before the parent's is let go and no more
+    than two latches are held at once; writers meet only at the root and
+    at the nodes they both change. Readers (get, iteritems) take no latch,
+    they descend optimistically and restart whenever a node version they
+    went through has moved. A range scan reads each leaf consistently but
+    is not a snapshot of the whole tree.
+
+    >>> t = ConcurrentBPTree(2)
+    >>> workers = [threading.Thread(target = lambda i = i: [t.insert(k, i) for k in range(i, 100, 4)])
+    ...            for i in range(4)]
+    >>> for w in workers: w.start()
+    >>> for w in workers: w.join()
+    >>> len(t.keys()), t[42], t.get(100), t.keys(10, 14)
+    (100, 2, None, [10, 11, 12, 13, 14])
+    """
+
+    def __init__(self, degree = 3):
+        self.degree = degree
+        self.root = CBPNode()
+        self._maxkeys = 2 * self.degree - 1
+        # guards the root pointer and the split of a full root
+        self._rootlatch = threading.Lock()
+
+    def _split_child(self, x, i, y):
+        """Split the full child y = x.children[i], both latched and marked."""
+        d = self.degree
+        z = CBPNode()
+        if y.children:
+            z.keys = y.keys[d:]
+            z.children = y.children[d:]
+            separator = y.keys[d-1]
+            y.children = y.children[:d]
+        else:
+            z.keys = y.keys[d-1:]
+            z.values = y.values[d-1:]
+            separator = z.keys[0]
+            y.values = y.values[:d-1]
+            z.next = y.next
+            y.next = z
+        y.keys = y.keys[:d-1]
+        x.children.insert(i+1, z)
+        x.keys.insert(i, separator)
+        return z
+
+    def insert(self, key, value):
+        with self._rootlatch:
+            node = self.root
+            node.latch.acquire()
+            if len(node.keys) == self._maxkeys:
+                root = CBPNode()
+                root.children.append(node)
+                root.latch.acquire()
+                node.version += 1
+                self._split_child(root, 0, node)
+                # publish the new root while the old one is still marked,
+                # a reader that got the old root either sees it odd or
+                # sees it replaced, and restarts
+                self.root = root
+                node.version += 1
+                node.latch.release()
+                node = root
+
+        while node.children:
+            i = bisect.bisect(node.keys, key)
+            child = node.children[i]
+            child.latch.acquire()
+            if len(child.keys) == self._maxkeys:
+                node.version += 1
+                child.version += 1
+                z = self._split_child(node, i, child)
+                node.version += 1
+                child.version += 1
+                if key >= node.keys[i]:
+                    z.latch.acquire()
+                    child.latch.release()
+                    child = z
+            node.latch.release()
+            node = child
+
+        i = bisect.bisect_left(node.keys, key)
+        node.version += 1
+        if i < len(node.keys) and node.keys[i] == key:
+            node.values[i] = value
+        else:
+            node.keys.insert(i, key)
+            node.values.insert(i, value)
+        node.version += 1
+        node.latch.release()
+
+    def _leaf(self, key):
+        """
+        Optimistic descent to the leaf that may hold key (the first leaf if
+        key is None), returns the leaf and the version it was reached with.
+        """
+        while True:
+            node = self.root
+            version = node.version
+            if version & 1 or node is not self.root:
+                continue
+            try:
+                while node.children:
+                    child = node.children[0 if key is None else bisect.bisect(node.keys, key)]
+                    cversion = child.version
+                    if node.version != version or cversion & 1:
+                        break
+                    node, version = child, cversion
+                else:
+                    return node, version
+            except IndexError:
+                # keys and children of a node being split seen half way
+                pass
+
+    def get(self, key, default = None):
+        while True:
+            leaf, version = self._leaf(key)
+            try:
+                keys = leaf.keys
+                i = bisect.bisect_left(keys, key)
+                value = leaf.values[i] if i < len(keys) and keys[i] == key else default
+            except IndexError:
+                continue
+            if leaf.version == version:
+                return value
+
+    def iteritems(self, kmin = None, kmax = None):
+        """Items with kmin <= key <= kmax in key order."""
+        last, inclusive = kmin, True
+        leaf, version = self._leaf(last)
+        while True:
+            keys, values, nxt = leaf.keys, leaf.values, leaf.next
+            if last is None:
+                i = 0
+            elif inclusive:
+                i = bisect.bisect_left(keys, last)
+            else:
+                i = bisect.bisect(keys, last)
+            j = len(keys) if kmax is None else max(i, bisect.bisect(keys, kmax))
+            items = zip(keys[i:j], values[i:j])
+            if leaf.version != version:
+                leaf, version = self._leaf(last)
+                continue
+            for item in items:
+                yield item
+            if items:
+                last, inclusive = items[-1][0], False
+            if j < len(keys) or nxt is None:
+                return
+            nversion = nxt.version
+            if nversion & 1 or leaf.version != version:
+                leaf, version = self._leaf(last)
+            else:
+                leaf, version = nxt, nversion
+
+    def iterkeys(self, kmin = None, kmax = None):
+        return imap(itemgetter(0), self.iteritems(kmin, kmax))
+
+    def itervalues(self, kmin = None, kmax = None):
+        return imap(itemgetter(1), self.iteritems(kmin, kmax))
+
+    def items(self, kmin = None, kmax = None):
+        return list(self.iteritems(kmin, kmax))
+
+    def keys(self, kmin = None, kmax = None):
+        return list(self.iterkeys(kmin, kmax))
+
+    def values(self, kmin = None, kmax = None):
+        return list(self.itervalues(kmin, kmax))
+
+    def __contains__(self, k):
+        return self.get(k, _MISSING) is not _MISSING
+
+    def __setitem__(self, k, v):
+        self.insert(k, v)
+
+    def __getitem__(self, k):
+        return self.get(k)
+
+def test_ConcurrentBPTree(nwriters = 4, nreaders = 4, n = 20000, degree = 3):
+    """
+    Writers insert interleaved key ranges while readers look up the keys
+    already published and check that range scans stay sorted and unique.
+    """
+    t = ConcurrentBPTree(degree)
+    done = [0] * nwriters
+    errors = []
+
+    def writer(w):
+        for k in xrange(w, n, nwriters):
+            t.insert(k, -k)
+            done[w] = k
+
+    def reader(r):
+        rnd = random.Random(r)
+        while min(done) < n - nwriters:
+            w = rnd.randrange(nwriters)
+            k = rnd.randint(0, done[w])
+            if k % nwriters == w and t.get(k) != -k:
+                errors.append(('get', k))
+            kmin = rnd.randrange(n)
+            keys = t.keys(kmin, kmin + 50)
+            if keys != sorted(set(keys)) or (keys and not kmin <= keys[0] <= keys[-1] <= kmin + 50):
+                errors.append(('scan', kmin, keys))
+
+    threads = [threading.Thread(target = writer, args = (w,)) for w in xrange(nwriters)]
+    threads += [threading.Thread(target = reader, args = (r,)) for r in xrange(nreaders)]
+    # switch threads every few bytecodes to interleave them as much as possible
+    interval = sys.getcheckinterval()
+    sys.setcheckinterval(5)
+    try:
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+    finally:
+        sys.setcheckinterval(interval)
+
+    print 'errors              :', errors[:5]
+    print 'keys == range(n)    :', t.keys() == range(n)
+    print 'values              :', t.values() == [-k for k in xrange(n)]
+
+def test_ConcurrentBPTree_root_split():
+    """
+    The writer splitting a full root is held while it publishes the new
+    root, and a get() runs meanwhile: it must find the key that moved to
+    the new right half instead of reading the old root as a leaf.
+    """
+    paused = threading.Event()
+    resume = threading.Event()
+
+    class HeldTree(ConcurrentBPTree):
+        hold = False
+
+        def __setattr__(self, name, value):
+            if name == 'root' and self.hold:
+                paused.set()
+                resume.wait()
+            object.__setattr__(self, name, value)
+
+    t = HeldTree(2)
+    for k in (1, 2, 3):
+        t.insert(k, k)
+    t.hold = True
+    result = []
+    writer = threading.Thread(target = t.insert, args = (4, 4))
+    reader = threading.Thread(target = lambda: result.append(t.get(3)))
+    writer.start()
+    paused.wait()
+    reader.start()
+    # a reader that spins on the marked old root only finishes after resume
+    reader.join(0.5)
+    resume.set()
+    writer.join()
+    reader.join()
+
+    print 'get(3) during root split :', result
+    print 'keys                     :', t.keys()
+
+def benchmark_ConcurrentBPTree(n = 200000, nthreads = (1, 2, 4, 8), degree = 50):
+    """
+    Throughput of n inserts and then n gets split over nthreads threads:
+    BPTree behind one global lock vs. ConcurrentBPTree.
+
+    CPython runs one thread at a time under the GIL, so neither side scales
+    with threads here and the latches cost 10-30% on inserts. What crabbing
+    buys is that writers and readers no longer queue on a single lock.
+
+    >>> benchmark_ConcurrentBPTree() # doctest: +SKIP
+    threads: 1  [global lock]insert 164195/s get 251322/s  [crabbing]insert 151502/s get 199911/s
+    threads: 2  [global lock]insert 167462/s get 205614/s  [crabbing]insert 127431/s get 243198/s
+    threads: 4  [global lock]insert 200095/s get 290741/s  [crabbing]insert 147968/s get 212816/s
+    threads: 8  [global lock]insert 175693/s get 201120/s  [crabbing]insert 119836/s get 182016/s
+    """
+    keys = range(n)
+    random.shuffle(keys)
+
+    def run(nthread, work):
+        threads = [threading.Thread(target = work, args = (keys[i::nthread],))
+                   for i in xrange(nthread)]
+        t0 = time.time()
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        return n / (time.time() - t0)
+
+    for nthread in nthreads:
+        b, lock = BPTree(degree), threading.Lock()
+        def insert(part):
+            for k in part:
+                with lock:
+                    b.insert(k, k)
+        def search(part):
+            for k in part:
+                with lock:
+                    b.search(b.root, k)
+        locked = run(nthread, insert), run(nthread, search)
+
+        c = ConcurrentBPTree(degree)
+        def insert(part):
+            for k in part:
+                c.insert(k, k)
+        def search(part):
+            for k in part:
+                c.get(k)
+        crabbed = run(nthread, insert), run(nthread, search)
+
+        print 'threads: %d  [global lock]insert %6d/s get %6d/s  [crabbing]insert %6d/s get %6d/s' % (
+            (nthread,) + locked + crabbed)
 
 #################################### END #######################################
 
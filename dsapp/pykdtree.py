@@ -13,9 +13,18 @@ Reference:
 - http://citeseerx.ist.psu.edu/viewdoc/download?doi=10.1.1.28.6468&rep=rep1&type=pdf
 """
 
+import atexit
+import math
+import multiprocessing
+import os
 import random
+import shutil
+import tempfile
 import Queue
 from heapq import heappush, heappop, heappushpop
+from operator import itemgetter
+
+import numpy as np
 
 INF = float('inf')
 
@@ -166,6 +175,7 @@ def median_with_sort(a, di = 0):
 
 
 class KDNode(object):
+    __slots__ = ["data", "split", "left", "right", "parent"]
 
     def __init__(self, pt = None, split = 0):
         self.data = pt
@@ -221,21 +231,27 @@ class KDTree(object):
     >>> pts = [(2,3), (5,4), (9,6), (4,7), (8,1), (7,2)]
     >>> kdt = KDTree(pts)
     >>> kdt.pprint()  # doctest: +SKIP
-                (5, 4)
-         /                 \
-    (2, 3)                  (7, 2)
-         \                 /     \
-          (4, 7)      (8, 1)      (9, 6)
+                      (7, 2)
+               /                 \
+          (5, 4)                  (9, 6)
+         /     \                 /
+    (2, 3)      (4, 7)      (8, 1)
     >>> node = kdt.search((2, 3))
     >>> node.parent
     (5, 4)
     >>> node.depth
-    1
+    2
     >>> node.parent.parent
+    (7, 2)
     >>> kdt.depth
     2
     >>> kdt.insert((3, 2))
-    (5, 4)
+    (7, 2)
+    >>> kdt = KDTree([(0,0), (0,1), (0,2), (1,0), (1,1), (0,1)])
+    >>> kdt.size, len(kdt.points), all(kdt.search(e) for e in kdt.points)
+    (5, 5, True)
+    >>> kdt.insert((0, 0)) and kdt.size
+    5
     >>> kdt = KDTree(k = 2)
     >>> [kdt.insert(e) for e in [(5,4), (2,3), (9,6), (4,7), (8,1), (7,2)]]
     [(5, 4), (5, 4), (5, 4), (5, 4), (5, 4), (5, 4)]
@@ -261,14 +277,36 @@ class KDTree(object):
     >>> kdt.delete(kdt.root, (5, 4))
     (7, 2)
     """
-    def __init__(self, pts = [], k = 3):
+    def __init__(self, pts = [], k = 3, alpha = 0.75):
         if pts:
             self.k = len(pts[0])
         else:
             self.k = k
         self.depth = 0
-        self.root = self.init(pts)
+        # scapegoat balance factor, None turns rebalancing off
+        self.alpha = alpha
+        # nodes in the tree, and the most since the last full rebuild
+        self.size = 0
+        self.max_size = 0
+        self.rebuilds = 0
+        # the points in insertion order, except that a delete moves the
+        # last point into the freed slot; query() returns indices into it
+        self.points = []
+        # slot of every point in self.points, for O(1) deletes
+        self._slots = {}
+        for pt in pts:
+            if pt not in self._slots:
+                self._slots[pt] = len(self.points)
+                self.points.append(pt)
+        # ArrayKDTree over self.points for query(), built on demand
+        self._flat = None
+        # init() can put equal split values on the left, where search()
+        # does not look, _build() keeps them on the right
+        #self.root = self.init(pts)
         #self.root = self.init_inplace(pts)
+        self.root = self._build(list(self.points))
+        self.size = self.max_size = len(self.points)
+        self.depth = self.depth_stats()['height']
 
     def init(self, pts, depth = 0):
         if not pts:
@@ -338,14 +376,159 @@ class KDTree(object):
                 return None
 
     def balance(self):
-        pass
+        """
+        Rebuild the whole tree around medians.
+
+        >>> kdt = KDTree(k = 2, alpha = None)
+        >>> [kdt.insert((i, i)) for i in range(7)][-1]
+        (0, 0)
+        >>> sorted(kdt.depth_stats().items())
+        [('height', 6), ('mean', 3.0), ('rebuilds', 0), ('size', 7)]
+        >>> kdt.balance()
+        (3, 3)
+        >>> sorted(kdt.depth_stats().items())
+        [('height', 2), ('mean', 1.4285714285714286), ('rebuilds', 1), ('size', 7)]
+        """
+        if self.root is not None:
+            self.root = self._rebuild(self.root, 0)
+        self.max_size = self.size
+        self.depth = self.depth_stats()['height']
+
+        return self.root
+
+    def _rebuild(self, node, depth):
+        parent = node.parent
+        subtree = self._build([e.data for e in self._nodes(node)], depth)
+        subtree.parent = parent
+        if parent is not None:
+            if parent.left is node:
+                parent.left = subtree
+            else:
+                parent.right = subtree
+        self.rebuilds += 1
+
+        return subtree
+
+    def _build(self, pts, depth = 0):
+        """
+        Median split where the left subtree only holds points strictly
+        below the split value, as search() and insert() expect. With
+        repeated values the split moves to whichever end of the run of the
+        median value is closer to the middle.
+        """
+        if not pts:
+            return None
+        split = depth % self.k
+        pts.sort(key = itemgetter(split))
+        n = len(pts)
+        i = j = n // 2
+        m = pts[i][split]
+        while i > 0 and pts[i-1][split] == m:
+            i -= 1
+        while j < n and pts[j][split] == m:
+            j += 1
+        if j < n and j - n // 2 < n // 2 - i:
+            i = j
+        node = KDNode(pts[i], split)
+        node.left = self._build(pts[:i], depth+1)
+        if node.left:
+            node.left.parent = node
+        node.right = self._build(pts[i+1:], depth+1)
+        if node.right:
+            node.right.parent = node
+
+        return node
+
+    def _nodes(self, node):
+        """Nodes of the subtree under node, without recursion."""
+        nodes = []
+        stack = [node] if node is not None else []
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            if node.right is not None:
+                stack.append(node.right)
+            if node.left is not None:
+                stack.append(node.left)
+
+        return nodes
+
+    def _count(self, node):
+        return len(self._nodes(node))
+
+    def _scapegoat(self, node):
+        """
+        After node was inserted deeper than log(size) / log(1 / alpha),
+        rebuild the subtree of its lowest ancestor that is too tall for its
+        size (Galperin and Rivest, scapegoat trees), which keeps inserts
+        O(log n) amortized.
+        """
+        base = 1 / self.alpha
+        if node.depth <= math.log(self.size, base):
+            return
+        size = height = 1
+        while node.parent is not None:
+            parent = node.parent
+            sibling = parent.right if parent.left is node else parent.left
+            size += self._count(sibling) + 1
+            node = parent
+            if height > math.log(size, base):
+                break
+            height += 1
+        goat = self._rebuild(node, node.depth)
+        if goat.parent is None:
+            self.root = goat
+
+    def depth_stats(self):
+        """
+        Size, height, mean node depth and number of subtree rebuilds.
+        """
+        total = height = 0
+        stack = [(self.root, 0)] if self.root is not None else []
+        while stack:
+            node, depth = stack.pop()
+            total += depth
+            height = max(height, depth)
+            if node.left is not None:
+                stack.append((node.left, depth+1))
+            if node.right is not None:
+                stack.append((node.right, depth+1))
+
+        return {'size': self.size, 'height': height, 'rebuilds': self.rebuilds,
+                'mean': float(total) / self.size if self.size else 0.0}
 
     def insert(self, pt):
+        """
+        Insert pt, rebuilding the subtree around a scapegoat when the new
+        node lands deeper than log(size) / log(1 / alpha).
+
+        >>> kdt = KDTree(k = 2)
+        >>> [kdt.insert((i, i)) for i in range(100)][-1]
+        (15, 15)
+        >>> sorted(kdt.depth_stats().items())
+        [('height', 15), ('mean', 5.72), ('rebuilds', 12), ('size', 100)]
+        >>> kdt = KDTree(k = 2, alpha = None)
+        >>> [kdt.insert((i, i)) for i in range(100)][-1]
+        (0, 0)
+        >>> sorted(kdt.depth_stats().items())
+        [('height', 99), ('mean', 49.5), ('rebuilds', 0), ('size', 100)]
+        """
+        new = self.search(pt) is None
+        if new:
+            self._slots[pt] = len(self.points)
+            self.points.append(pt)
+            self._drop_flat()
         if self.root:
-            return self._insert(pt, self.root, 0)
+            self._insert(pt, self.root, 0)
         else:
             self.root = self._insert(pt, self.root, 0)
-            return self.root
+        if new:
+            self.size += 1
+            self.max_size = max(self.max_size, self.size)
+            if self.alpha is not None:
+                self._scapegoat(self.search(pt))
+
+        return self.root
 
     def _insert(self, pt, node, depth = 0):
         if depth > self.depth:
@@ -369,29 +552,67 @@ class KDTree(object):
         return node
 
     def delete(self, node, pt):
+        """
+        Delete pt from the subtree under node and return that subtree.
+        Deleting from the root rebuilds the whole tree once it has shrunk
+        below alpha times its size at the last full rebuild.
+
+        >>> kdt = KDTree([(2,3), (5,4), (9,6), (4,7), (8,1), (7,2)])
+        >>> [kdt.delete(kdt.root, e) for e in [(9,6), (4,7), (1,1)]]
+        [(7, 2), (7, 2), (7, 2)]
+        >>> kdt.size, kdt.rebuilds
+        (4, 1)
+        >>> kdt.delete(kdt.root, (5, 4))
+        (7, 2)
+        >>> sorted(e.data for e in kdt.preorder())
+        [(2, 3), (7, 2), (8, 1)]
+        >>> kdt.points
+        [(2, 3), (8, 1), (7, 2)]
+        """
+        if node is not self.root:
+            return self._delete(node, pt)
+        if self._search(node, pt) is None:
+            return node
+        i = self._slots.pop(pt, None)
+        if i is not None:
+            last = self.points.pop()
+            if i < len(self.points):
+                self.points[i] = last
+                self._slots[last] = i
+        self._drop_flat()
+        self.root = self._delete(node, pt)
+        self.size -= 1
+        if self.alpha is not None and self.size < self.alpha * self.max_size:
+            self.balance()
+
+        return self.root
+
+    def _delete(self, node, pt):
         if node is None:
             return None
         split = node.split
-        sonsplit = (split + 1) % self.k
-        if pt[split] < node.data[split]:
-            node.left = self.delete(node.left, pt)
-        elif pt[split] > node.data[split]:
-            node.right = self.delete(node.right, pt)
-        else:
-            if node.is_leaf():
-                if node.is_left():
-                    node.parent.left = None
-                else:
-                    node.parent.right = None
-                return None
-            elif node.has_right():
-                succdata = self.min(node.right, node.split)
+        if node.data == pt:
+            if node.has_right():
+                succdata = self.min(node.right, split)
+                node.data = succdata
+                node.right = self._delete(node.right, succdata)
+            elif node.has_left():
+                # the minimum of the left subtree moves up, everything left
+                # of it is now >= on split and belongs to the right
+                succdata = self.min(node.left, split)
                 node.data = succdata
-                node.right = self.delete(node.right, succdata)
+                node.right = self._delete(node.left, succdata)
+                node.left = None
             else:
-                prevdata = self.max(node.left, node.split)
-                node.data = prevdata
-                node.left = self.delete(node.left, prevdata)
+                return None
+        elif pt[split] < node.data[split]:
+            node.left = self._delete(node.left, pt)
+        else:
+            node.right = self._delete(node.right, pt)
+        if node.left:
+            node.left.parent = node
+        if node.right:
+            node.right.parent = node
 
         return node
 
@@ -429,9 +650,15 @@ class KDTree(object):
 
                 return max(opts, key = lambda e: e[split])
 
-    def nearest(self, pt, k = 1):
+    def nearest(self, pt, k = 1, eps = 0, max_checks = None):
         """
         Recursive version of NN search.
+
+        With eps > 0 a branch is skipped unless it can hold a point closer
+        than dist / (1 + eps), so every returned distance is within a factor
+        (1 + eps) of the true k-th nearest. A max_checks budget on distance
+        computations only makes sense in best bin first order, so it is
+        handed over to inearest().
         
         >>> kdt = KDTree(k = 2)
         >>> [kdt.insert(e) for e in [(7,2), (5,4), (2,3), (9,6), (4,7), (8,1)]]
@@ -440,6 +667,10 @@ class KDTree(object):
         [((2, 3), 0.14142135623730964)]
         >>> kdt.nearest((2, 4.5))
         [((2, 3), 1.5)]
+        >>> kdt.nearest((2, 4.5), 2, eps = 1)
+        [((2, 3), 1.5), ((5, 4), 3.0413812651491097)]
+        >>> kdt.nearest((2, 4.5), max_checks = 2)
+        [((5, 4), 3.0413812651491097)]
         >>> kdt.pprint() # doctest: +SKIP
                           (7, 2)
                    /                 \
@@ -447,13 +678,15 @@ class KDTree(object):
              /     \                 /
         (2, 3)      (4, 7)      (8, 1)
         """
-        result = self._nearest(self.root, pt, k, [])
+        if max_checks is not None:
+            return self.inearest(pt, k, eps, max_checks)
+        result = self._nearest(self.root, pt, k, [], eps)
         result = [heappop(result) for i in range(len(result))][::-1]
         result = [(e[1], pow(abs(e[0]), 0.5)) for e in result]
         
         return result
 
-    def _nearest(self, node, pt, k = 1, result = []):
+    def _nearest(self, node, pt, k = 1, result = [], eps = 0):
         if node is None:
             return (None, float('inf'))
         
@@ -474,20 +707,24 @@ class KDTree(object):
                 nearer = node.right
                 further = node.left
     
-            self._nearest(nearer, pt, k, result)
+            self._nearest(nearer, pt, k, result, eps)
             if len(result) < k:
                 heappush(result, (-dist, node))
             else:
                 heappushpop(result, (-dist, node))
-            dmax = -result[0][0] if result else INF
-            if abs(pt[split]-data[split]) <= pow(dmax, 0.5):
-                self._nearest(further, pt, k, result)
+            dmax = -result[0][0] if len(result) == k else INF
+            if abs(pt[split]-data[split]) * (1 + eps) <= pow(dmax, 0.5):
+                self._nearest(further, pt, k, result, eps)
         
         return result
 
-    def inearest(self, pt, k = 1):
+    def inearest(self, pt, k = 1, eps = 0, max_checks = None):
         """
-        Iteration version of NN search.
+        Iteration version of NN search, best bin first: the branches not
+        taken on the way down wait in a priority queue ordered by their
+        distance from pt and the closest one is descended next. The search
+        stops when the closest branch is farther than dist / (1 + eps), or
+        after max_checks distance computations.
         
         >>> kdt = KDTree(k = 2)
         >>> [kdt.insert(e) for e in [(7,2), (5,4), (2,3), (9,6), (4,7), (8,1)]]
@@ -496,6 +733,10 @@ class KDTree(object):
         [((2, 3), 0.14142135623730964)]
         >>> kdt.inearest((2, 4.5))
         [((2, 3), 1.5)]
+        >>> kdt.inearest((8.5, 5), 3)
+        [((9, 6), 1.118033988749895), ((7, 2), 3.3541019662496847), ((5, 4), 3.640054944640259)]
+        >>> kdt.inearest((8.5, 5), 3, max_checks = 3)
+        [((9, 6), 1.118033988749895), ((7, 2), 3.3541019662496847), ((8, 1), 4.031128874149275)]
         >>> kdt.pprint() # doctest: +SKIP
                           (7, 2)
                    /                 \
@@ -503,58 +744,85 @@ class KDTree(object):
              /     \                 /
         (2, 3)      (4, 7)      (8, 1)
         """
-        return self._inearest(self.root, pt, k)
+        return self._inearest(self.root, pt, k, eps, max_checks)
 
-    def _inearest(self, node, pt, k = 1):
+    def _inearest(self, node, pt, k = 1, eps = 0, max_checks = None):
         if node is None:
             return (None, float('inf'))
         result = []
-
-        def generate_sp(node):
-            sp = []
-            while node:
-                sp.append(node)
+        # (squared distance from pt to the branch, branch)
+        bins = [(0, node)]
+        factor = (1 + eps) ** 2
+        checks = 0 if max_checks is None else max_checks
+
+        while bins:
+            bound, node = heappop(bins)
+            if len(result) == k and bound * factor > -result[0][0]:
+                break
+            while node is not None:
+                if max_checks is not None:
+                    if checks == 0:
+                        break
+                    checks -= 1
                 data = node.data
                 split = node.split
-                if pt[split] <= data[split]:
-                    node = node.left
-                else:
-                    node = node.right
-            return sp
-        
-        sp = generate_sp(node)
-        nearest = sp.pop(-1)
-        dnearest = distance(nearest.data, pt)
-        heappush(result, (-dnearest, nearest))
-
-        # backtracking
-        while sp:
-            back = sp.pop(-1)
-            data = back.data
-            dback = distance(data, pt)
-            if back.is_leaf():
-                if len(result) < k:
-                    heappush(result, (-dback, back))
-                else:
-                    if dback < -result[0][0]:
-                        heappushpop(result, (-dback, back))
-            else:
-                split = back.split
+                dist = distance(data, pt)
                 if len(result) < k:
-                    heappush(result, (-dback, back))
+                    heappush(result, (-dist, node))
+                elif dist < -result[0][0]:
+                    heappushpop(result, (-dist, node))
+                diff = pt[split] - data[split]
+                if diff <= 0:
+                    nearer = node.left
+                    further = node.right
                 else:
-                    heappushpop(result, (-dback, back))
-                if abs(pt[split]-data[split]) <= pow(-result[0][0], 0.5):
-                    if pt[split] <= data[split]:
-                        sp.extend(generate_sp(back.right))
-                    else:
-                        sp.extend(generate_sp(back.left))
+                    nearer = node.right
+                    further = node.left
+                if further is not None:
+                    dfurther = max(bound, diff * diff)
+                    if len(result) < k or dfurther * factor <= -result[0][0]:
+                        heappush(bins, (dfurther, further))
+                node = nearer
+            if max_checks is not None and checks == 0:
+                break
 
         result = [heappop(result) for i in range(len(result))][::-1]
         result = [(e[1], pow(abs(e[0]), 0.5)) for e in result]
 
         return result
 
+    def query(self, points, k = 1, leafsize = 32):
+        """
+        k nearest neighbours of every row of an (m, d) array, answered by an
+        ArrayKDTree over self.points that is built on the first call and
+        kept until the tree changes. Returns (distances, indices) like
+        scipy.spatial.cKDTree.query, the indices point into self.points.
+
+        >>> kdt = KDTree([(7,2), (5,4), (2,3), (9,6), (4,7), (8,1)])
+        >>> d, i = kdt.query(np.array([(2.1, 3.1), (9, 5)]), 2)
+        >>> d.round(4).tolist(), i.tolist()
+        ([[0.1414, 3.0364], [1.0, 3.6056]], [[2, 1], [3, 0]])
+        >>> kdt.points[2], kdt.points[3]
+        ((2, 3), (9, 6))
+        """
+        return self._array(leafsize).query(points, k)
+
+    def query_parallel(self, points, k = 1, workers = None, leafsize = 32):
+        """query() over a pool of workers, see ArrayKDTree.query_parallel."""
+        return self._array(leafsize).query_parallel(points, k, workers)
+
+    def _array(self, leafsize = 32):
+        if self._flat is None or self._flat.leafsize != leafsize:
+            self._drop_flat()
+            self._flat = ArrayKDTree(self.points, leafsize)
+        return self._flat
+
+    def _drop_flat(self):
+        """Forget the ArrayKDTree of query(), with its query_parallel copy."""
+        if self._flat is not None:
+            self._flat.close()
+            self._flat = None
+
     def search_range(self, pt, radius):
         """
         Find all points within distance radius of point(s) x.
@@ -566,6 +834,40 @@ class KDTree(object):
         """
         return self._search_range(self.root, pt, radius, [])
 
+    def count_range(self, pt, radius, leafsize = 32):
+        """
+        Number of points within distance radius of pt, counted on the
+        ArrayKDTree of query() without building a list of nodes.
+
+        >>> kdt = KDTree(zip(range(10), range(10)))
+        >>> kdt.count_range((1, 1), 2)
+        3
+        """
+        return self._array(leafsize).count_range(pt, radius)
+
+    def box_query(self, lo, hi, leafsize = 32):
+        """
+        Indices into self.points of the points with lo <= point <= hi.
+
+        >>> kdt = KDTree(zip(range(10), range(10)))
+        >>> kdt.box_query((2, 0), (5, 3)).tolist()
+        [2, 3]
+        """
+        return self._array(leafsize).box_query(lo, hi)
+
+    def aggregate_range(self, pt, radius, fn = np.add, values = None, default = None,
+                        leafsize = 32):
+        """
+        fn.reduce over values (one per point of self.points, default the
+        points) of the points within distance radius of pt, default if there
+        are none.
+
+        >>> kdt = KDTree(zip(range(10), range(10)))
+        >>> kdt.aggregate_range((1, 1), 2).tolist()
+        [3.0, 3.0]
+        """
+        return self._array(leafsize).aggregate_range(pt, radius, fn, values, default)
+
     def _search_range(self, node, pt, radius, result = []):
         if node is None:
             return (None, float('inf'))
@@ -689,6 +991,469 @@ class KDTree(object):
             pair = ['%s%s' % (' '*spaces[j], levelnodes[j]) for j in range(len(spaces))]
             print ''.join(pair)
 
+################################################################################
+
+
+# parallel arrays of the ArrayKDTree node table
+_FIELDS = ('split_dim', 'split_value', 'left', 'right', 'start', 'end', 'lower', 'upper')
+# all the arrays of an ArrayKDTree
+_ARRAYS = ('data', 'indices') + _FIELDS
+
+def _build_table(work, order, leafsize, maxdepth = -1):
+    """
+    Build the node table of an ArrayKDTree over work, permuting the rows of
+    work and order in place so that every node owns a slice of them.
+    Splitting stops at depth maxdepth (never if -1), the nodes left to split
+    there are returned as pending.
+    """
+    table = dict((field, []) for field in _FIELDS)
+    dims, values, lefts, rights = table['split_dim'], table['split_value'], table['left'], table['right']
+    starts, ends, lowers, uppers = table['start'], table['end'], table['lower'], table['upper']
+    pending = []
+
+    def new_node(start, end):
+        dims.append(-1)
+        values.append(0.0)
+        lefts.append(-1)
+        rights.append(-1)
+        starts.append(start)
+        ends.append(end)
+        pts = work[start:end]
+        lowers.append(pts.min(axis = 0) if end > start else np.full(work.shape[1], INF))
+        uppers.append(pts.max(axis = 0) if end > start else np.full(work.shape[1], -INF))
+        return len(starts) - 1
+
+    stack = [(new_node(0, len(work)), 0)]
+    while stack:
+        node, depth = stack.pop()
+        start, end = starts[node], ends[node]
+        if end - start <= leafsize:
+            continue
+        if depth == maxdepth:
+            pending.append(node)
+            continue
+        pts = work[start:end]
+        dim = int(np.argmax(uppers[node] - lowers[node]))
+        mid = (end - start) // 2
+        part = np.argpartition(pts[:, dim], mid)
+        work[start:end] = pts[part]
+        order[start:end] = order[start:end][part]
+        dims[node] = dim
+        values[node] = work[start + mid, dim]
+        lefts[node] = new_node(start, start + mid)
+        rights[node] = new_node(start + mid, end)
+        stack.append((rights[node], depth + 1))
+        stack.append((lefts[node], depth + 1))
+
+    return table, pending
+
+def _build_subtree(args):
+    """Pool worker: the table of a whole subtree and the row order of it."""
+    work, leafsize = args
+    order = np.arange(len(work))
+    table, pending = _build_table(work, order, leafsize)
+    table['lower'] = np.array(table['lower'])
+    table['upper'] = np.array(table['upper'])
+    return order, table
+
+def _ranges(starts, ends):
+    """np.arange(start, end) of every pair, concatenated."""
+    sizes = ends - starts
+    offsets = np.repeat(starts - np.cumsum(sizes) + sizes, sizes)
+    return np.arange(sizes.sum(), dtype = np.intp) + offsets
+
+# tree of a query_parallel worker process, memory mapped by _init_worker
+_worker_tree = None
+
+# temporary copies made by query_parallel and not closed yet
+_tempdirs = set()
+
+def _remove_tempdirs():
+    for dirname in list(_tempdirs):
+        shutil.rmtree(dirname, True)
+
+atexit.register(_remove_tempdirs)
+
+def _init_worker(dirname):
+    global _worker_tree
+    _worker_tree = ArrayKDTree.load(dirname)
+
+def _query_worker(args):
+    points, k = args
+    return _worker_tree.query(points, k)
+
+class ArrayKDTree(object):
+    """
+    Static KD-tree laid out in flat arrays instead of KDNode objects.
+
+    The points are copied into one contiguous (n, d) float array and
+    reordered so that every node owns a slice [start, end) of it. A node
+    splits its slice at the median of its widest dimension with
+    np.argpartition, down to leaves of no more than leafsize points (16-64
+    work best). The node table is kept in parallel arrays: split dimension,
+    split value, children (-1 for a leaf), slice bounds and the bounding
+    box of the node's points (lower, upper). Queries compute distances to
+    all the points of a leaf at once with numpy.
+
+    With workers > 1 and at least parallel points, the top levels are split
+    here and the subtrees below them are built in a process pool, then
+    grafted into the table.
+
+    >>> t = ArrayKDTree([(7,2), (5,4), (2,3), (9,6), (4,7), (8,1)], leafsize = 2)
+    >>> t.query([(2.1, 3.1), (9, 5)])
+    (array([0.14142136, 1.        ]), array([2, 3]))
+    >>> d, i = t.query([(6.5, 3)], 3)
+    >>> d.round(4).tolist(), i.tolist()
+    ([[1.118, 1.8028, 2.5]], [[0, 1, 5]])
+    >>> t.lower[0].tolist(), t.upper[0].tolist()
+    ([2.0, 1.0], [9.0, 7.0])
+    """
+
+    def __init__(self, data, leafsize = 32, workers = 1, parallel = 1000000):
+        work = np.array(data, dtype = float, ndmin = 2)
+        self.n, self.k = work.shape
+        self.leafsize = max(1, leafsize)
+        order = np.arange(self.n)
+
+        if workers > 1 and self.n >= parallel:
+            # one or two subtrees per worker
+            maxdepth = int(np.ceil(np.log2(workers)))
+            table, pending = _build_table(work, order, self.leafsize, maxdepth)
+            pool = multiprocessing.Pool(workers)
+            try:
+                jobs = [(work[table['start'][node]:table['end'][node]], self.leafsize)
+                        for node in pending]
+                subtrees = pool.map(_build_subtree, jobs)
+            finally:
+                pool.close()
+                pool.join()
+            for node, (suborder, subtable) in zip(pending, subtrees):
+                self._graft(table, node, suborder, subtable, work, order)
+        else:
+            table, pending = _build_table(work, order, self.leafsize)
+
+        self.data = work
+        self.indices = order
+        for field in _FIELDS:
+            dtype = float if field in ('split_value', 'lower', 'upper') else np.intp
+            setattr(self, field, np.array(table[field], dtype = dtype))
+        # directory of the saved arrays once query_parallel shared them
+        self._shared = None
+        # and the temporary one query_parallel created for that, see close()
+        self._tempdir = None
+
+    def save(self, dirname):
+        """Write the arrays of the tree to dirname as .npy files."""
+        for field in _ARRAYS:
+            np.save(os.path.join(dirname, field + '.npy'), getattr(self, field))
+        np.save(os.path.join(dirname, 'leafsize.npy'), np.array([self.leafsize]))
+        return dirname
+
+    @classmethod
+    def load(cls, dirname, mmap_mode = 'r'):
+        """
+        Tree saved by save(). With an mmap_mode the arrays are memory
+        mapped, so processes that load the same directory share its pages.
+        """
+        tree = object.__new__(cls)
+        for field in _ARRAYS:
+            setattr(tree, field, np.load(os.path.join(dirname, field + '.npy'), mmap_mode = mmap_mode))
+        tree.leafsize = int(np.load(os.path.join(dirname, 'leafsize.npy'))[0])
+        tree.n, tree.k = tree.data.shape
+        tree._shared = dirname
+        tree._tempdir = None
+        return tree
+
+    def close(self):
+        """
+        Remove the temporary copy of the tree made by query_parallel, if
+        any. A later query_parallel makes a new one. Called when the tree is
+        garbage collected, and at exit for trees still alive then.
+
+        >>> t = ArrayKDTree(np.random.rand(100, 2))
+        >>> d, i = t.query_parallel(np.random.rand(10, 2), 2, 2)
+        >>> dirname = t._tempdir
+        >>> os.path.isdir(dirname), dirname in _tempdirs
+        (True, True)
+        >>> t.close()
+        >>> os.path.isdir(dirname), dirname in _tempdirs, t._shared
+        (False, False, None)
+        """
+        dirname = getattr(self, '_tempdir', None)
+        if dirname is None:
+            return
+        # a forked child must not remove the copy of its parent
+        if dirname in _tempdirs and self._owner == os.getpid():
+            shutil.rmtree(dirname, True)
+            _tempdirs.discard(dirname)
+        self._tempdir = self._shared = None
+
+    __del__ = close
+
+    @staticmethod
+    def _graft(table, node, suborder, subtable, work, order):
+        """Put a subtree built by _build_subtree in the place of node."""
+        start = table['start'][node]
+        end = table['end'][node]
+        work[start:end] = work[start:end][suborder]
+        order[start:end] = order[start:end][suborder]
+        # local node 0 becomes node, local node i > 0 becomes base + i
+        base = len(table['start']) - 1
+        for field in _FIELDS:
+            column = subtable[field]
+            if field in ('left', 'right'):
+                column = [c + base if c > 0 else c for c in column]
+            elif field in ('start', 'end'):
+                column = [c + start for c in column]
+            else:
+                column = list(column)
+            table[field][node] = column[0]
+            table[field].extend(column[1:])
+
+    def query(self, points, k = 1, chunksize = 4096):
+        """
+        k nearest neighbours of every row of points, as arrays of distances
+        and indices into the original data, sorted by distance. Shapes are
+        (m,) for k == 1 and (m, k) otherwise. Missing neighbours (k > n) get
+        distance inf and index n, as in scipy.spatial.cKDTree.
+
+        All the points of a chunk go down the tree together, one numpy step
+        per level:
+
+        1. every point descends to the smallest node holding at least k
+           points, the k-th distance in there bounds its search radius;
+        2. (point, node) pairs are expanded from the root, dropping far
+           children whose splitting plane or bounding box lies beyond the
+           radius;
+        3. the leaves reached are scanned as one padded block and the k
+           nearest are picked per point.
+
+        >>> t = ArrayKDTree([(0,0), (1,0), (2,0), (3,0), (4,0)], leafsize = 2)
+        >>> d, i = t.query([(0, 0)], 7)
+        >>> d.tolist(), i.tolist()
+        ([[0.0, 1.0, 2.0, 3.0, 4.0, inf, inf]], [[0, 1, 2, 3, 4, 5, 5]])
+        """
+        points = np.array(points, dtype = float, ndmin = 2)
+        m = len(points)
+        dist = np.full((m, k), INF)
+        idx = np.full((m, k), self.n, dtype = np.intp)
+        for c in xrange(0, m, chunksize):
+            self._query_chunk(points[c:c+chunksize], k, dist[c:c+chunksize], idx[c:c+chunksize])
+        dist = np.sqrt(dist)
+        if k == 1:
+            return dist[:, 0], idx[:, 0]
+        return dist, idx
+
+    def query_parallel(self, points, k = 1, workers = None, chunksize = 16384):
+        """
+        query() spread over a pool of worker processes. The tree is not
+        pickled: its arrays are saved once to a temporary directory and
+        every worker memory maps them, so all the workers read the same
+        pages. Only the chunks of query points and their answers travel.
+
+        >>> t = ArrayKDTree(np.random.rand(1000, 3))
+        >>> pts = np.random.rand(100, 3)
+        >>> [np.array_equal(a, b) for a, b in zip(t.query_parallel(pts, 3, 2, 30), t.query(pts, 3))]
+        [True, True]
+        """
+        points = np.array(points, dtype = float, ndmin = 2)
+        if self._shared is None:
+            self._tempdir = self._shared = self.save(tempfile.mkdtemp(prefix = 'kdtree'))
+            self._owner = os.getpid()
+            _tempdirs.add(self._tempdir)
+        chunks = [(points[c:c+chunksize], k) for c in xrange(0, len(points), chunksize)]
+        pool = multiprocessing.Pool(workers, _init_worker, (self._shared,))
+        try:
+            results = pool.map(_query_worker, chunks)
+        finally:
+            pool.close()
+            pool.join()
+        if not results:
+            return self.query(points, k)
+        return np.concatenate([d for d, i in results]), np.concatenate([i for d, i in results])
+
+    def count_range(self, pt, radius):
+        """
+        Number of points within distance radius of pt. Nodes whose bounding
+        box lies inside the ball add end - start without looking at their
+        points, only the leaves crossing the sphere are scanned.
+
+        >>> t = ArrayKDTree([(i, j) for i in range(10) for j in range(10)], leafsize = 4)
+        >>> t.count_range((4.5, 4.5), 2), t.count_range((0, 0), 1), t.count_range((20, 20), 3)
+        (12, 3, 0)
+        """
+        nodes, pos = self._range(*self._ball(pt, radius))
+        return int((self.end[nodes] - self.start[nodes]).sum()) + len(pos)
+
+    def box_query(self, lo, hi):
+        """
+        Sorted indices of the points with lo <= point <= hi in every
+        dimension.
+
+        >>> t = ArrayKDTree([(7,2), (5,4), (2,3), (9,6), (4,7), (8,1)], leafsize = 2)
+        >>> t.box_query((4, 1), (8, 4)).tolist()
+        [0, 1, 5]
+        """
+        lo = np.asarray(lo, dtype = float)
+        hi = np.asarray(hi, dtype = float)
+
+        def box(lower, upper):
+            outside = (upper < lo).any(axis = 1) | (lower > hi).any(axis = 1)
+            inside = (lower >= lo).all(axis = 1) & (upper <= hi).all(axis = 1)
+            return outside, inside
+
+        def within(pts):
+            return ((pts >= lo) & (pts <= hi)).all(axis = 1)
+
+        nodes, pos = self._range(box, within)
+        pos = np.concatenate((_ranges(self.start[nodes], self.end[nodes]), pos))
+        return np.sort(self.indices[pos])
+
+    def aggregate_range(self, pt, radius, fn = np.add, values = None, default = None):
+        """
+        Reduce with the ufunc fn the values (one row per point, default the
+        points themselves) of the points within distance radius of pt. The
+        slices of the nodes inside the ball are reduced whole, without
+        distance tests. With no point in the ball default is returned, as
+        ufuncs like np.maximum have no identity to reduce an empty array to.
+
+        >>> t = ArrayKDTree([(i, j) for i in range(10) for j in range(10)], leafsize = 4)
+        >>> t.aggregate_range((4.5, 4.5), 2).tolist()
+        [54.0, 54.0]
+        >>> t.aggregate_range((4.5, 4.5), 2, np.maximum, np.arange(100)).tolist()
+        65
+        >>> t.aggregate_range((50, 50), 1, np.maximum) is None
+        True
+        >>> t.aggregate_range((50, 50), 1, np.add, np.arange(100), 0)
+        0
+        """
+        nodes, pos = self._range(*self._ball(pt, radius))
+        pos = np.concatenate((_ranges(self.start[nodes], self.end[nodes]), pos))
+        if not len(pos):
+            return default
+        if values is None:
+            return fn.reduce(self.data[pos], axis = 0)
+        return fn.reduce(np.asarray(values)[self.indices[pos]], axis = 0)
+
+    def _ball(self, pt, radius):
+        """Node box and point tests for the ball around pt, see _range."""
+        pt = np.asarray(pt, dtype = float)
+        r2 = radius * radius
+
+        def box(lower, upper):
+            gap = np.maximum(lower - pt, 0) + np.maximum(pt - upper, 0)
+            span = np.maximum(np.abs(pt - lower), np.abs(upper - pt))
+            outside = np.einsum('ij,ij->i', gap, gap) > r2
+            inside = np.einsum('ij,ij->i', span, span) <= r2
+            return outside, inside
+
+        def within(pts):
+            diff = pts - pt
+            return np.einsum('ij,ij->i', diff, diff) <= r2
+
+        return box, within
+
+    def _range(self, box, within):
+        """
+        Walk down from the root a level of nodes at a time. box(lower,
+        upper) tells which nodes lie outside and which inside the range,
+        within(points) which points are in it. Returns the nodes inside the
+        range and the positions in self.data of the points in range from
+        the leaves that straddle its border.
+        """
+        inside, pos = [], [np.empty(0, dtype = np.intp)]
+        nodes = np.zeros(1, dtype = np.intp)
+        while len(nodes):
+            outside, contained = box(self.lower[nodes], self.upper[nodes])
+            inside.append(nodes[contained])
+            nodes = nodes[~(outside | contained)]
+            left = self.left[nodes]
+            leaf = left < 0
+            if leaf.any():
+                leaves = nodes[leaf]
+                cand = _ranges(self.start[leaves], self.end[leaves])
+                pos.append(cand[within(self.data[cand])])
+                nodes = nodes[~leaf]
+                left = left[~leaf]
+            nodes = np.concatenate((left, self.right[nodes]))
+
+        return np.concatenate(inside), np.concatenate(pos)
+
+    def _gather(self, points, nodes):
+        """
+        Squared distances from points[i] to the points of nodes[i], padded
+        with inf into one block, the positions in self.data they are for
+        (0 in the padding) and the mask of the cells that are not padding.
+        """
+        starts = self.start[nodes]
+        sizes = self.end[nodes] - starts
+        cols = np.arange(sizes.max() if len(sizes) else 0)
+        valid = cols < sizes[:, None]
+        pos = np.where(valid, starts[:, None] + cols, 0)
+        diff = self.data[pos] - points[:, None, :]
+        d2 = np.einsum('ijk,ijk->ij', diff, diff)
+        d2[~valid] = INF
+        return d2, pos, valid
+
+    def _query_chunk(self, points, k, dist, idx):
+        q = len(points)
+        rows = np.arange(q)
+        sizes = self.end - self.start
+
+        # 1. radius from the smallest node with k points around each point
+        node = np.zeros(q, dtype = np.intp)
+        while True:
+            left = self.left[node]
+            below = points[rows, self.split_dim[node]] < self.split_value[node]
+            child = np.where(below, left, self.right[node])
+            down = (left >= 0) & (sizes[child] >= k)
+            if not down.any():
+                break
+            node = np.where(down, child, node)
+        d2, pos, valid = self._gather(points, node)
+        if d2.shape[1] >= k:
+            radius = np.partition(d2, k - 1, axis = 1)[:, k-1]
+        else:
+            radius = np.full(q, INF)
+
+        # 2. (point, node) pairs within the radius: the nearer child is
+        # always taken, the further one if its splitting plane and then its
+        # bounding box are close enough
+        qs, nodes = rows, np.zeros(q, dtype = np.intp)
+        leafqs, leaves = [], []
+        while len(qs):
+            leaf = self.left[nodes] < 0
+            leafqs.append(qs[leaf])
+            leaves.append(nodes[leaf])
+            inner = ~leaf
+            qs, nodes = qs[inner], nodes[inner]
+            delta = points[qs, self.split_dim[nodes]] - self.split_value[nodes]
+            below = delta < 0
+            near = np.where(below, self.left[nodes], self.right[nodes])
+            far = np.where(below, self.right[nodes], self.left[nodes])
+            keep = delta * delta <= radius[qs]
+            farqs, far = qs[keep], far[keep]
+            pts = points[farqs]
+            gap = np.maximum(self.lower[far] - pts, 0) + np.maximum(pts - self.upper[far], 0)
+            keep = np.einsum('ij,ij->i', gap, gap) <= radius[farqs]
+            qs = np.concatenate((qs, farqs[keep]))
+            nodes = np.concatenate((near, far[keep]))
+
+        # 3. scan the leaves, keep the k nearest of every point
+        leafqs = np.concatenate(leafqs)
+        d2, pos, valid = self._gather(points[leafqs], np.concatenate(leaves))
+        # with k > n the radius is inf, which the padding would pass
+        inside = (d2 <= radius[leafqs][:, None]) & valid
+        qq = np.broadcast_to(leafqs[:, None], d2.shape)[inside]
+        dd = d2[inside]
+        pp = pos[inside]
+        order = np.lexsort((dd, qq))
+        qq, dd, pp = qq[order], dd[order], pp[order]
+        rank = np.arange(len(qq)) - np.searchsorted(qq, qq)
+        nearest = rank < k
+        dist[qq[nearest], rank[nearest]] = dd[nearest]
+        idx[qq[nearest], rank[nearest]] = self.indices[pp[nearest]]
+
 
 if __name__ == '__main__':
     import doctest
@@ -1,8 +1,11 @@
 #! /usr/bin/env python
 #coding: utf-8
 
+from dsa.tree import BinaryTreeBase
+
 
 class SBTNode(object):
+    __slots__ = ["key", "value", "size", "left", "right", "parent"]
     
     def __init__(self, key, val, left=None, right=None, parent=None):
         self.key = key
@@ -101,7 +104,7 @@ class SBTNode(object):
     __repr__ = __str__
 
 
-class SBTree(object):
+class SBTree(BinaryTreeBase):
 
     def __init__(self):
         self.root = None
@@ -219,6 +222,11 @@ class SBTree(object):
         self.maintain(t, False)
         self.maintain(t, True)
 
+    def _new_node(self, key, val, parent, nleft, nright):
+        node = SBTNode(key, val, parent = parent)
+        node.size = nleft + nright + 1
+        return node
+
     def insert(self, key, val):
         if self.root:
             self._insert(key, val, self.root)
@@ -376,7 +384,7 @@ class SBTree(object):
         return self.size
 
     def __iter__(self):
-        return self.root.__iter__()
+        return (node.key for node in self.iter_inorder())
 
     # Additional methods
     put = insert
@@ -385,60 +393,6 @@ class SBTree(object):
     def length(self):
         return self.size
         
-    def preorder(self):
-        return self._preorder(self.root)
-    
-    def _preorder(self, t):
-        nodes = []
-        nodes.append(t)
-        if t.hasLeft():
-            nodes.extend(self._preorder(t.left))
-        if t.hasRight:
-            nodes.extend(self._preorder(t.right))
-        
-        return nodes
-
-    def inorder(self):
-        return self._inorder(self.root)
-    
-    def _inorder(self, t):
-        nodes = []
-        if t.hasLeft():
-            nodes.extend(self._inorder(t.left))
-        nodes.append(t)
-        if t.hasRight():
-            nodes.extend(self._inorder(t.right))
-        
-        return nodes
-
-    def postorder(self):
-        return self._postorder(self.root)
-    
-    def _postorder(self, t):
-        nodes = []
-        if t.hasLeft():
-            nodes.extend(self._postorder(t.left))
-        nodes.append(t)
-        if t.hasRight():
-            nodes.extend(self._postorder(t.right))
-        
-        return nodes
-    
-    def searchRange(self, kmin, kmax):
-        result = []
-        if self.root:
-            self._searchRange(kmin, kmax, result, self.root)
-        return result
-    
-    def _searchRange(self, kmin, kmax, result, t):
-        if t:
-            if  kmin < t.key:
-                self._searchRange(kmin, kmax, result, t.left)
-            if kmin <= t.key <= kmax:
-                result.append(t)
-            if kmin > t.key or t.key < kmax:
-                self._searchRange(kmin, kmax, result, t.right)
-
     def levels(self):
         if self.root:
             level = 1
@@ -521,4 +475,4 @@ if __name__ == '__main__':
 
     print 'SBT size: ', r.size
     r.pprint()
-    print r.searchRange(3, 7)
+    print list(r.searchRange(3, 7))
@@ -13,12 +13,21 @@ Reference:
 """
 
 
+import sys
+import time
+import heapq
 import random
-import Queue
+import shutil
+from array import array
+from itertools import islice, izip
 from os.path import join
 from io import BytesIO
+from tempfile import mkdtemp
+
+import numpy as np
 
 from settings import DATA_PATH
+from dsa.tree import BinaryTreeBase
 
 ################################################################################
 
@@ -84,7 +93,7 @@ class Node(object):
 
     __repr__ = __str__
 
-class SegmentTree(object):
+class SegmentTree(BinaryTreeBase):
 
     def __init__(self, points = []):
         self.points = sorted(points)
@@ -143,6 +152,31 @@ class SegmentTree(object):
 
         return node
 
+    def searchRange(self, kmin, kmax):
+        """
+        Leaves with kmin <= point <= kmax, in order, as a generator. The
+        nodes carry [start, end] instead of a key, so the inherited
+        searchRange does not apply.
+
+        >>> st = SegmentTree(range(5))
+        >>> list(st.searchRange(1, 3))
+        [[1,1], [2,2], [3,3]]
+        >>> list(st.searchRange(5, 9))
+        []
+        """
+        stack = [] if self.root is None else [self.root]
+        while stack:
+            node = stack.pop()
+            if node.end < kmin or node.start > kmax:
+                continue
+            if node.is_leaf():
+                yield node
+                continue
+            if node.right is not None:
+                stack.append(node.right)
+            if node.left is not None:
+                stack.append(node.left)
+
     def query_intersect(self, start, end, key = 'max'):
         """
         key: ['max', 'min', 'sum', 'delta']
@@ -431,122 +465,569 @@ class SegmentTree(object):
             if end > mid:
                 self._set(node.right, start, end, value)
             node.data['sum'] = node.left.calcsum() + node.right.calcsum()
-        
 
-    #### some common methods
 
-    def preorder(self):
-        return self._preorder(self.root)
+################################################################################
 
-    def _preorder(self, node):
-        nodes = []
-        nodes.append(node)
-        if node.has_left():
-            nodes.extend(self._preorder(node.left))
-        if node.has_right():
-            nodes.extend(self._preorder(node.right))
+class ArraySegmentTree(object):
+    """
+    Flat, array-backed segment tree.
+
+    The tree is stored bottom-up in ``2*size`` slots (``size`` is the
+    smallest power of 2 >= n): node ``p`` has children ``2p`` and ``2p+1``
+    and leaf ``i`` lives at ``size+i``. Sum, min and max are kept in
+    parallel ``array`` buffers, and internal nodes carry lazy add/assign
+    tags, so there is no per-node object or dict at all. Updates and
+    queries walk the tree iteratively; tags are pushed down only along the
+    two boundary paths of an interval.
+
+    Positions are ``base, base+1, ..., base+n-1`` and intervals are closed,
+    as in ``SegmentTree``.
+
+    >>> st = ArraySegmentTree(range(4))
+    >>> st.add(1, 3, 2)
+    >>> st.query_sum_add(1, 3)
+    12
+    >>> st.query_min(0, 3), st.query_max(0, 3)
+    (0, 5)
+    >>> st.set(0, 2, 1)
+    >>> st.query_sum(0, 3), st.query_min(1, 3), st.query_max(0, 2)
+    (8, 1, 1)
+    >>> st.add(2, 3, -1)
+    >>> [st.query_sum(i, i) for i in range(4)]
+    [1, 1, 0, 4]
+    """
+
+    base = 0
+    typecode = 'l'
+
+    def __init__(self, values = (), base = None, typecode = None):
+        if base is not None:
+            self.base = base
+        if typecode is not None:
+            self.typecode = typecode
+        self.build(values)
+
+    def build(self, values):
+        """Bulk construction in O(n), vectorized with numpy."""
+        tc = self.typecode
+        if not hasattr(values, '__len__'):
+            values = list(values)
+        leaves = np.asarray(values, dtype = tc).ravel()
+        n = len(leaves)
+        h = max(1, (n - 1).bit_length())
+        size = 1 << h
+        self.n, self.h, self.size = n, h, size
+        if tc == 'd':
+            self.zero, self.inf = 0.0, float('inf')
+        else:
+            self.zero, self.inf = 0, sys.maxint
+
+        self.sum = array(tc, [self.zero]) * (2 * size)
+        self.min = array(tc, [self.inf]) * (2 * size)
+        self.max = array(tc, [-self.inf]) * (2 * size)
+        self.lazy = array(tc, [self.zero]) * size
+        self.value = array(tc, [self.zero]) * size
+        self.assigned = bytearray(size)
+
+        s, lo, hi = self._views()
+        s[size:size+n] = leaves
+        lo[size:size+n] = leaves
+        hi[size:size+n] = leaves
+        self._rebuild()
+
+    def _views(self):
+        """Writable numpy views over the sum/min/max buffers."""
+        tc = self.typecode
+        return (np.frombuffer(self.sum, dtype = tc),
+                np.frombuffer(self.min, dtype = tc),
+                np.frombuffer(self.max, dtype = tc))
+
+    def _tag_views(self):
+        """Writable numpy views over the lazy/value/assigned buffers."""
+        tc = self.typecode
+        return (np.frombuffer(self.lazy, dtype = tc),
+                np.frombuffer(self.value, dtype = tc),
+                np.frombuffer(self.assigned, dtype = np.uint8))
+
+    def _rebuild(self):
+        """Recompute every internal node from the leaves, level by level.
+
+        Only valid when no internal node carries a tag.
+        """
+        self._prefix = None
+        s, lo, hi = self._views()
+        i = self.size
+        while i > 1:
+            j = i >> 1
+            s[j:i] = s[i:2*i:2] + s[i+1:2*i:2]
+            lo[j:i] = np.minimum(lo[i:2*i:2], lo[i+1:2*i:2])
+            hi[j:i] = np.maximum(hi[i:2*i:2], hi[i+1:2*i:2])
+            i = j
+
+    def flush(self):
+        """Push every pending tag down to the leaves, level by level."""
+        s, lo, hi = self._views()
+        lazy, value, assigned = self._tag_views()
+        for d in xrange(self.h):
+            i, j = 1 << d, 2 << d
+            k = self.size >> (d + 1)
+            a = assigned[i:j].astype(bool)
+            if not a.any() and not lazy[i:j].any():
+                continue
+            v = value[i:j]
+            z = np.where(a, 0, lazy[i:j])
+            for c in (slice(j, 2*j, 2), slice(j+1, 2*j, 2)):
+                s[c] = np.where(a, v * k, s[c] + z * k)
+                lo[c] = np.where(a, v, lo[c] + z)
+                hi[c] = np.where(a, v, hi[c] + z)
+                if j < self.size:
+                    ca = assigned[c].astype(bool)
+                    value[c] = np.where(a, v, np.where(ca, value[c] + z, value[c]))
+                    lazy[c] = np.where(a | ca, 0, lazy[c] + z)
+                    assigned[c] = a | ca
+            assigned[i:j] = 0
+            lazy[i:j] = 0
+
+    def _clip(self, starts, ends):
+        """Closed [start, end] batches to clipped half-open leaf offsets."""
+        l = np.asarray(starts, dtype = np.int64) - self.base
+        r = np.asarray(ends, dtype = np.int64) - self.base + 1
+        return np.clip(l, 0, self.n), np.clip(r, 0, self.n)
+
+    def _small_batch(self, m):
+        """Whether m single operations beat one O(n) vectorized pass."""
+        return m * self.h * 80 < self.n
+
+    def __len__(self):
+        return self.n
+
+    def _apply_add(self, p, delta, k):
+        self.sum[p] += delta * k
+        self.min[p] += delta
+        self.max[p] += delta
+        if p < self.size:
+            if self.assigned[p]:
+                self.value[p] += delta
+            else:
+                self.lazy[p] += delta
+
+    def _apply_set(self, p, value, k):
+        self.sum[p] = value * k
+        self.min[p] = value
+        self.max[p] = value
+        if p < self.size:
+            self.assigned[p] = 1
+            self.value[p] = value
+            self.lazy[p] = self.zero
+
+    def _push(self, i, k):
+        """Move the tags of node i to its children of length k."""
+        if self.assigned[i]:
+            value = self.value[i]
+            self._apply_set(2*i, value, k)
+            self._apply_set(2*i+1, value, k)
+            self.assigned[i] = 0
+        elif self.lazy[i]:
+            delta = self.lazy[i]
+            self._apply_add(2*i, delta, k)
+            self._apply_add(2*i+1, delta, k)
+            self.lazy[i] = self.zero
+
+    def push_down(self, p):
+        """Push pending tags from the root down to (excluding) node p."""
+        assigned, lazy = self.assigned, self.lazy
+        for s in xrange(p.bit_length() - 1, 0, -1):
+            i = p >> s
+            if assigned[i] or lazy[i]:
+                self._push(i, 1 << (s - 1))
+
+    def push_up(self, p):
+        """Recompute every ancestor of node p from its children."""
+        s, lo, hi = self.sum, self.min, self.max
+        assigned, lazy = self.assigned, self.lazy
+        k = 1
+        while p > 1:
+            p >>= 1
+            k <<= 1
+            l, r = 2*p, 2*p+1
+            if assigned[p]:
+                value = self.value[p]
+                s[p], lo[p], hi[p] = value * k, value, value
+            else:
+                delta = lazy[p]
+                s[p] = s[l] + s[r] + delta * k
+                lo[p] = (lo[l] if lo[l] < lo[r] else lo[r]) + delta
+                hi[p] = (hi[l] if hi[l] > hi[r] else hi[r]) + delta
+
+    def _range(self, start, end):
+        l = max(start - self.base, 0)
+        r = min(end - self.base + 1, self.n)
+        return l + self.size, r + self.size
+
+    def _update(self, start, end, apply, x):
+        l, r = self._range(start, end)
+        if l >= r:
+            return
+        self._prefix = None
+        l0, r0 = l, r - 1
+        self.push_down(l0)
+        if r0 == l0:
+            apply(l0, x, 1)
+            self.push_up(l0)
+            return
+        self.push_down(r0)
+        k = 1
+        while l < r:
+            if l & 1:
+                apply(l, x, k)
+                l += 1
+            if r & 1:
+                r -= 1
+                apply(r, x, k)
+            l >>= 1
+            r >>= 1
+            k <<= 1
+        self.push_up(l0)
+        self.push_up(r0)
+
+    def _query(self, start, end, buf, combine, init):
+        l, r = self._range(start, end)
+        result = init
+        if l >= r:
+            return result
+        self.push_down(l)
+        self.push_down(r - 1)
+        while l < r:
+            if l & 1:
+                result = combine(result, buf[l])
+                l += 1
+            if r & 1:
+                r -= 1
+                result = combine(result, buf[r])
+            l >>= 1
+            r >>= 1
+        return result
 
-        return nodes
+    def add(self, start, end, delta):
+        """Add delta to every position in [start, end]."""
+        self._update(start, end, self._apply_add, delta)
 
-    def inorder(self):
-        return self._inorder(self.root)
+    def add_many(self, starts, ends, deltas):
+        """
+        Add deltas[i] to every position in [starts[i], ends[i]], for all i.
 
-    def _inorder(self, node):
-        nodes = []
-        if node.has_left():
-            nodes.extend(self._inorder(node.left))
-        nodes.append(node)
-        if node.has_right():
-            nodes.extend(self._inorder(node.right))
+        A large batch is applied offline in one vectorized pass: the adds
+        are summed into a difference array, swept into the leaves with
+        cumsum and the internal nodes are rebuilt. deltas may be a scalar.
 
-        return nodes
+        >>> st = ArraySegmentTree([1, 2, 3, 4, 5])
+        >>> st.add_many([0, 1, 4], [2, 3, 4], [10, 1, -5])
+        >>> st.tolist()
+        [11, 13, 14, 5, 0]
+        """
+        l, r = self._clip(starts, ends)
+        deltas = np.broadcast_to(np.asarray(deltas, dtype = self.typecode),
+                                 l.shape)
+        if self._small_batch(len(l)):
+            base = self.base
+            for a, b, delta in zip(l.tolist(), r.tolist(), deltas.tolist()):
+                if a < b:
+                    self.add(a + base, b - 1 + base, delta)
+            return
 
-    def postorder(self):
-        return self._postorder(self.root)
+        keep = l < r
+        l, r, deltas = l[keep], r[keep], deltas[keep]
+        diff = np.zeros(self.n + 1, dtype = self.typecode)
+        np.add.at(diff, l, deltas)
+        np.add.at(diff, r, -deltas)
+        self.flush()
+        s, lo, hi = self._views()
+        leaves = slice(self.size, self.size + self.n)
+        delta = np.cumsum(diff[:-1])
+        s[leaves] += delta
+        lo[leaves] += delta
+        hi[leaves] += delta
+        self._rebuild()
 
-    def _postorder(self, node):
-        nodes = []
-        if node.has_left():
-            nodes.extend(self._postorder(node.left))
-        if node.has_right():
-            nodes.extend(self._postorder(node.right))
-        nodes.append(node)
-
-        return nodes
-
-    def bft(self, node, level = 1):
-        """Breadth first traversal."""
-        q = Queue.Queue()
-        level = level
-        q.put((level, node))
-
-        while not q.empty():
-            level, node = q.get()
-            yield (level, node)
-            if node.has_left():
-                q.put((level+1, node.left))
-            if node.has_right():
-                q.put((level+1, node.right))
-
-    def levels(self):
-        leveldict = {}
-
-        for level, node in self.bft(self.root):
-            leveldict.setdefault(level, []).append(node)
-
-        return leveldict
-
-    def pprint(self):
-        nodes = self.inorder()
-        length = [len(str(e)) for e in nodes]
-        leveldict = self.levels()
-        levels = leveldict.keys()
-        for level in levels:
-            levelnodes = leveldict.get(level)
-            starts = []
-            ends = []
-            branches = []
-            for node in levelnodes:
-                index = nodes.index(node)
-                start = sum([len(str(e)) for e in nodes[:index]])
-                end = start + len(str(node))
-                starts.append(start)
-                ends.append(end)
-                if node.is_left():
-                    branches.append((end-1, '/'))
-                elif node.is_right():
-                    branches.append((start-1, '\\'))
-                else:
-                    if level > 1:
-                        print 'error node: ', node
-            if level > 1:
-                spaces = [branches[0][0]]
-                spaces.extend([branches[k+1][0] - branches[k][0] - 1 for k in range(len(branches)-1)])
-                pair = ['%s%s' % (' '*spaces[m], branches[m][1]) for m in range(len(branches))]
-                print ''.join(pair)
-            spaces = [starts[0]]
-            spaces.extend([starts[i] - ends[i-1] for i in range(1, len(starts))])
-            pair = ['%s%s' % (' '*spaces[j], levelnodes[j]) for j in range(len(spaces))]
-            print ''.join(pair)
+    def set(self, start, end, value):
+        """Replace every position in [start, end] by value."""
+        self._update(start, end, self._apply_set, value)
 
+    def query_sum(self, start, end):
+        l, r = self._range(start, end)
+        result = self.zero
+        if l >= r:
+            return result
+        self.push_down(l)
+        self.push_down(r - 1)
+        s = self.sum
+        while l < r:
+            if l & 1:
+                result += s[l]
+                l += 1
+            if r & 1:
+                r -= 1
+                result += s[r]
+            l >>= 1
+            r >>= 1
+        return result
+
+    def query_sum_many(self, starts, ends):
+        """
+        Sums of [starts[i], ends[i]] for all i, as a numpy array.
+
+        A large batch is answered from the prefix sums of the leaves, which
+        are cached until the next update.
+
+        >>> st = ArraySegmentTree([1, 2, 3, 4, 5])
+        >>> st.query_sum_many([0, 1, 3], [4, 2, 3]).tolist()
+        [15, 5, 4]
+        """
+        l, r = self._clip(starts, ends)
+        if self._prefix is None and self._small_batch(len(l)):
+            base = self.base
+            return np.array([self.query_sum(a + base, b - 1 + base)
+                             for a, b in zip(l.tolist(), r.tolist())],
+                            dtype = self.typecode)
+        if self._prefix is None:
+            self.flush()
+            s = self._views()[0]
+            self._prefix = np.zeros(self.n + 1, dtype = self.typecode)
+            np.cumsum(s[self.size:self.size+self.n], out = self._prefix[1:])
+        return np.where(l < r, self._prefix[r] - self._prefix[np.minimum(l, r)], 0)
+
+    # add and set are mixed freely in the flat tree, keep both names of
+    # the node-based tree
+    query_sum_add = query_sum
+    query_sum_set = query_sum
+
+    def query_min(self, start, end):
+        return self._query(start, end, self.min, min, self.inf)
+
+    def query_max(self, start, end):
+        return self._query(start, end, self.max, max, -self.inf)
+
+    def tolist(self):
+        """Current value of every position."""
+        self.flush()
+        return self.sum[self.size:self.size+self.n].tolist()
+
+    def nbytes(self):
+        """Memory held by the buffers, in bytes."""
+        return sum(buf.itemsize * len(buf) for buf in
+                   (self.sum, self.min, self.max, self.lazy, self.value)) + \
+               len(self.assigned)
 
 ################################################################################
 
-class hdu1166(SegmentTree):
+class IntervalSet(object):
     """
-    Enemy lineup.
-    
-    TYPE
-    ----
-    
-      - UPDATE: Single-point increase or decrease
-      - QUERY : Sum query
-        
+    Set of half-open intervals over fixed, sorted coordinates.
+
+    The coordinates cut the line into elementary intervals
+    [coords[i], coords[i+1]), and a flat tree keeps, for every node, how
+    many of its elementary intervals are in the set. Internal nodes carry
+    a lazy set tag (all out / all in) or a lazy flip tag, so every
+    operation is O(log n). All interval ends must be coordinates.
+
+    Operations, T = [start, end):
+
+      - U: S = S | T      union
+      - I: S = S & T      intersect
+      - D: S = S - T      difference
+      - C: S = T - S      complement
+      - S: S = S ^ T      xor
+
+    >>> iset = IntervalSet(range(11))
+    >>> iset.union(1, 6)
+    >>> iset.difference(3, 4)
+    >>> iset.intervals()
+    [(1, 3), (4, 6)]
+    >>> iset.apply([('S', 2, 5), ('C', 0, 10), ('I', 2, 9)])
+    >>> iset.intervals()
+    [(2, 3), (4, 5), (6, 9)]
+    >>> 4 in iset, 5 in iset, len(iset)
+    (True, False, 5)
     """
-    
-    name = 'Enemy lineup'
-    url = 'http://acm.hdu.edu.cn/showproblem.php?pid=1166'
-    label = 'SegmentTree, segment tree'
+
+    OUT, IN = 1, 2
+
+    def __init__(self, coords):
+        self.coords = list(coords)
+        self.index = dict((x, i) for i, x in enumerate(self.coords))
+        m = max(len(self.coords) - 1, 1)
+        h = max(1, (m - 1).bit_length())
+        self.m, self.h, self.size = m, h, 1 << h
+        self.cnt = array('l', [0]) * (2 * self.size)
+        self.tag = bytearray(self.size)
+        self.flip = bytearray(self.size)
+
+    @classmethod
+    def from_operations(cls, ops):
+        """Empty set over the ends of ops, then apply(ops)."""
+        ops = list(ops)
+        coords = sorted(set(e for op in ops for e in op[1:]))
+        iset = cls(coords)
+        iset.apply(ops)
+        return iset
+
+    def _apply_set(self, p, tag, k):
+        self.cnt[p] = k if tag == self.IN else 0
+        if p < self.size:
+            self.tag[p] = tag
+            self.flip[p] = 0
+
+    def _apply_flip(self, p, k):
+        self.cnt[p] = k - self.cnt[p]
+        if p < self.size:
+            if self.tag[p]:
+                self.tag[p] = self.OUT + self.IN - self.tag[p]
+            else:
+                self.flip[p] ^= 1
+
+    def _push(self, p, k):
+        """Move the tag of node p to its children of length k."""
+        if self.tag[p]:
+            self._apply_set(2*p, self.tag[p], k)
+            self._apply_set(2*p+1, self.tag[p], k)
+            self.tag[p] = 0
+        elif self.flip[p]:
+            self._apply_flip(2*p, k)
+            self._apply_flip(2*p+1, k)
+            self.flip[p] = 0
+
+    def push_down(self, p):
+        """Push pending tags from the root down to (excluding) node p."""
+        tag, flip = self.tag, self.flip
+        for s in xrange(p.bit_length() - 1, 0, -1):
+            i = p >> s
+            if tag[i] or flip[i]:
+                self._push(i, 1 << (s - 1))
+
+    def push_up(self, p):
+        """Recompute every ancestor of node p from its children."""
+        cnt, tag, flip = self.cnt, self.tag, self.flip
+        k = 1
+        while p > 1:
+            p >>= 1
+            k <<= 1
+            if tag[p]:
+                continue
+            c = cnt[2*p] + cnt[2*p+1]
+            cnt[p] = k - c if flip[p] else c
+
+    def _update(self, l, r, tag):
+        """Set (tag) or flip (tag is None) elementary intervals [l, r)."""
+        if l >= r:
+            return
+        l += self.size
+        r += self.size
+        l0, r0 = l, r - 1
+        self.push_down(l0)
+        self.push_down(r0)
+        k = 1
+        while l < r:
+            if l & 1:
+                if tag:
+                    self._apply_set(l, tag, k)
+                else:
+                    self._apply_flip(l, k)
+                l += 1
+            if r & 1:
+                r -= 1
+                if tag:
+                    self._apply_set(r, tag, k)
+                else:
+                    self._apply_flip(r, k)
+            l >>= 1
+            r >>= 1
+            k <<= 1
+        self.push_up(l0)
+        self.push_up(r0)
+
+    def _range(self, start, end):
+        return self.index[start], self.index[end]
+
+    def union(self, start, end):
+        l, r = self._range(start, end)
+        self._update(l, r, self.IN)
+
+    def intersect(self, start, end):
+        l, r = self._range(start, end)
+        self._update(0, l, self.OUT)
+        self._update(r, self.m, self.OUT)
+
+    def difference(self, start, end):
+        l, r = self._range(start, end)
+        self._update(l, r, self.OUT)
+
+    def complement(self, start, end):
+        l, r = self._range(start, end)
+        self._update(0, l, self.OUT)
+        self._update(r, self.m, self.OUT)
+        self._update(l, r, None)
+
+    def xor(self, start, end):
+        l, r = self._range(start, end)
+        self._update(l, r, None)
+
+    def apply(self, ops):
+        """Apply (op, start, end) for op in 'UIDCS', in order."""
+        methods = {'U': self.union, 'I': self.intersect,
+                   'D': self.difference, 'C': self.complement,
+                   'S': self.xor}
+        for op, start, end in ops:
+            methods[op](start, end)
+
+    def __contains__(self, x):
+        """Whether the elementary interval starting at x is in the set."""
+        i = self.index.get(x)
+        if i is None or i >= self.m:
+            return False
+        p = i + self.size
+        self.push_down(p)
+        return self.cnt[p] > 0
+
+    def __len__(self):
+        """Number of elementary intervals in the set."""
+        return self.cnt[1]
+
+    def __iter__(self):
+        """
+        Disjoint, maximal intervals of the set, in order. Empty subtrees
+        are skipped and full subtrees are not entered, so k intervals cost
+        O(k log n).
+        """
+        cnt, size, coords = self.cnt, self.size, self.coords
+        start = end = None
+        stack = [(1, 0, size)]
+        while stack:
+            p, pos, k = stack.pop()
+            c = cnt[p]
+            if c == 0:
+                continue
+            if c == k:
+                if pos != end:
+                    if start is not None:
+                        yield coords[start], coords[end]
+                    start = pos
+                end = pos + k
+                continue
+            k >>= 1
+            self._push(p, k)
+            stack.append((2*p+1, pos + k, k))
+            stack.append((2*p, pos, k))
+        if start is not None:
+            yield coords[start], coords[end]
+
+    def intervals(self):
+        return list(self)
+
+################################################################################
+
+class hdu1166_node(SegmentTree):
+    """Node-based hdu1166, kept as the baseline of the benchmarks."""
 
     def push_up(self, node):
         node.data['sum'] = node.left.data.get('sum', 0) +\
@@ -605,7 +1086,30 @@ class hdu1166(SegmentTree):
             else:
                 self.update(x, delta, node.right)
             self.push_up(node)
+
+class hdu1166(ArraySegmentTree):
+    """
+    Enemy lineup.
+    
+    TYPE
+    ----
+    
+      - UPDATE: Single-point increase or decrease
+      - QUERY : Sum query
+        
+    """
     
+    name = 'Enemy lineup'
+    url = 'http://acm.hdu.edu.cn/showproblem.php?pid=1166'
+    label = 'SegmentTree, segment tree'
+    base = 1
+
+    def query(self, start, end):
+        return self.query_sum(start, end)
+
+    def update(self, x, delta):
+        self.add(x, x, delta)
+
     @staticmethod
     def sample():
         """
@@ -670,22 +1174,42 @@ class hdu1166(SegmentTree):
             f.write('End')
 
     @staticmethod
-    def benchmark():
+    def benchmark(klass = None):
         """
+        Run hdu1166.dat on klass (hdu1166 by default), any class with a
+        hdu1166-like constructor, query(a, b) and update(x, delta).
+
+        [result] is the sum of all query answers. hdu1166_node sorts the
+        camps before building, so it only agrees with hdu1166 when the camps
+        are given in order.
+
         >>> hdu1166.benchmark() # doctest: +SKIP
+        Case 1:
+        segmenttree.hdu1166      : [setup]0.0002 [ops]0.4931 [result]14203193
+        >>> hdu1166.benchmark(hdu1166_node) # doctest: +SKIP
+        Case 1:
+        segmenttree.hdu1166_node : [setup]0.0003 [ops]0.5179 [result]14736853
+        >>> import fenwick
+        >>> hdu1166.benchmark(fenwick.hdu1166) # doctest: +SKIP
+        Case 1:
+        fenwick.hdu1166          : [setup]0.0002 [ops]0.1354 [result]14203193
         """
+        klass = klass or hdu1166
         with open(join(DATA_PATH, 'hdu1166.dat')) as f:
             ncase = int(f.readline())
             for i in range(1, ncase+1):
                 print 'Case %s:' % i
                 ncamp = int(f.readline())
                 nicamp = [int(e) for e in f.readline().split()]
-                st = hdu1166(nicamp)
+                t0 = time.time()
+                st = klass(nicamp)
+                t1 = time.time()
+                result = 0
                 line = f.readline().strip()
                 while line != 'End':
                     a, b = [int(e) for e in line.split()[1:]]
                     if line.startswith('Q'):
-                        print st.query(a, b)
+                        result += st.query(a, b)
                     elif line.startswith('A'):
                         st.update(a, b)
                     elif line.startswith('S'):
@@ -693,6 +1217,9 @@ class hdu1166(SegmentTree):
                     else:
                         pass
                     line = f.readline().strip()
+                t2 = time.time()
+                print '%-24s : [setup]%6.4f [ops]%6.4f [result]%s' % (
+                    _qualname(klass), t1 - t0, t2 - t1, result)
 
     @staticmethod
     def naive():
@@ -700,21 +1227,8 @@ class hdu1166(SegmentTree):
 
 ################################################################################
 
-class hdu1754(SegmentTree):
-    """
-    I Hate It.
-    
-    TYPE
-    ----
-    
-      - UPDATE: Single-point replacement.
-      - QUERY : Max query
-        
-    """
-    
-    name = 'I Hate It'
-    url = 'http://acm.hdu.edu.cn/showproblem.php?pid=1754'
-    label = 'SegmentTree, segment tree'
+class hdu1754_node(SegmentTree):
+    """Node-based hdu1754, kept as the baseline of the benchmarks."""
 
     def push_up(self, node):
         node.data['max'] = max(node.left.data.get('max', 0),
@@ -773,7 +1287,30 @@ class hdu1754(SegmentTree):
             else:
                 self.update(x, value, node.right)
             self.push_up(node)
+
+class hdu1754(ArraySegmentTree):
+    """
+    I Hate It.
     
+    TYPE
+    ----
+    
+      - UPDATE: Single-point replacement.
+      - QUERY : Max query
+        
+    """
+    
+    name = 'I Hate It'
+    url = 'http://acm.hdu.edu.cn/showproblem.php?pid=1754'
+    label = 'SegmentTree, segment tree'
+    base = 1
+
+    def query(self, start, end):
+        return self.query_max(start, end)
+
+    def update(self, x, value):
+        self.set(x, x, value)
+
     @staticmethod
     def sample():
         """
@@ -822,22 +1359,9 @@ class hdu1754(SegmentTree):
 
 ################################################################################
 
-class poj3468(SegmentTree):
-    """
-    A Simple Problem with Integers.
-    
-    TYPE
-    ----
-    
-      - UPDATE: Interval increase or decrease.
-      - QUERY : Sum query
-        
-    """
+class poj3468_node(SegmentTree):
+    """Node-based poj3468, kept as the baseline of the benchmarks."""
 
-    name = 'A Simple Problem with Integers'
-    url = 'http://poj.org/problem?id=3468'
-    labels = 'SegmentTree, segment tree'
-    
     def push_up(self, node):
         node.data['sum'] = node.left.data.get('sum', 0) +\
                            node.right.data.get('sum', 0)
@@ -911,6 +1435,44 @@ class poj3468(SegmentTree):
                 self.update(start, end, delta, node.right)
             self.push_up(node)
 
+class poj3468(ArraySegmentTree):
+    """
+    A Simple Problem with Integers.
+    
+    TYPE
+    ----
+    
+      - UPDATE: Interval increase or decrease.
+      - QUERY : Sum query
+        
+    """
+
+    name = 'A Simple Problem with Integers'
+    url = 'http://poj.org/problem?id=3468'
+    labels = 'SegmentTree, segment tree'
+    base = 1
+
+    def query(self, start, end):
+        return self.query_sum(start, end)
+
+    def update(self, start, end, delta):
+        self.add(start, end, delta)
+
+    def update_many(self, starts, ends, deltas):
+        """
+        Batched update(), see ArraySegmentTree.add_many.
+
+        >>> st = poj3468([1, 2, 3, 4, 5, 6, 7, 8, 9, 10])
+        >>> st.update_many([3, 1], [6, 10], [3, 1])
+        >>> st.query_many([4, 1, 2], [4, 10, 4]).tolist()
+        [8, 77, 18]
+        """
+        self.add_many(starts, ends, deltas)
+
+    def query_many(self, starts, ends):
+        """Batched query(), see ArraySegmentTree.query_sum_many."""
+        return self.query_sum_many(starts, ends)
+
     @staticmethod
     def sample():
         """
@@ -1101,7 +1663,7 @@ class poj2528(SegmentTree):
 
 ################################################################################
 
-class poj3225(SegmentTree):
+class poj3225(IntervalSet):
     """
     Help with Intervals.
     
@@ -1111,35 +1673,340 @@ class poj3225(SegmentTree):
       - UPDATE: Interval replacement, interval XOR.
       - QUERY : Hash query
 
+    Open and closed ends are told apart by doubling the coordinates: 2x
+    stands for the point x and 2x+1 for the open interval (x, x+1), so
+    every interval of the problem is a half-open interval of the
+    IntervalSet over 0..2*maxn+1.
+
+    >>> st = poj3225()
+    >>> st.update('U', '[1,5]')
+    >>> st.update('D', '(2,3)')
+    >>> st.query()
+    '[1,2] [3,5]'
     """
 
     name = 'Help with Intervals'
     url = 'http://poj.org/problem?id=3225'
     labels = 'SegmentTree, segment tree'
 
+    def __init__(self, maxn = 65535):
+        IntervalSet.__init__(self, xrange(2 * maxn + 3))
+
+    @staticmethod
+    def parse(interval):
+        """'[a,b)' to half-open doubled coordinates [start, end)."""
+        a, b = interval[1:-1].split(',')
+        start = 2 * int(a) + (interval[0] == '(')
+        end = 2 * int(b) + (interval[-1] == ']')
+        return start, max(start, end)
+
+    def update(self, op, interval):
+        start, end = self.parse(interval)
+        self.apply([(op, start, end)])
+
+    def query(self):
+        result = []
+        for start, end in self:
+            end -= 1
+            result.append('%s%d,%d%s' % ('[('[start & 1], start >> 1,
+                                         (end + 1) >> 1, '])'[end & 1]))
+        return ' '.join(result) or 'empty set'
+
+    @staticmethod
+    def sample():
+        """
+        >>> poj3225.sample()
+        (2,3)
+        """
+        input = """\
+            U [1,5]
+            D [3,3]
+            S [2,4]
+            C (1,5)
+            I (2,3]"""
+
+        with BytesIO(input) as f:
+            st = poj3225()
+            for line in f:
+                op, interval = line.split()
+                st.update(op, interval)
+            print st.query()
+
+    @staticmethod
+    def generate_data():
+        pass
+
+    @staticmethod
+    def benchmark(nops = 100000, maxn = 65535):
+        """
+        >>> poj3225.benchmark() # doctest: +SKIP
+        poj3225                  : [setup]0.0409 [ops]12.8441 [query]0.0001 [result]1
+        """
+        ops = []
+        for i in xrange(nops):
+            a = random.randint(0, maxn)
+            b = random.randint(a, maxn)
+            ops.append('%s %s%s,%s%s' % (random.choice('UIDCS'),
+                                         random.choice('[('), a, b,
+                                         random.choice('])')))
+        t0 = time.time()
+        st = poj3225(maxn)
+        t1 = time.time()
+        for line in ops:
+            op, interval = line.split()
+            st.update(op, interval)
+        t2 = time.time()
+        result = len(st.intervals())
+        t3 = time.time()
+        print '%-24s : [setup]%6.4f [ops]%6.4f [query]%6.4f [result]%s' % (
+            'poj3225', t1 - t0, t2 - t1, t3 - t2, result)
+
+    @staticmethod
+    def naive():
+        pass
 
 ################################################################################
 
-class poj3667(SegmentTree):
+class poj3667(object):
     """
     Hotel.
     
     TYPE
     ----
     
-      - UPDATE: Interval replacement, interval XOR.
+      - UPDATE: Interval replacement.
       - QUERY : Breakpoints leftmost query
 
+    Slots base, base+1, ..., base+n-1 are either free or occupied. Every
+    node of a flat tree keeps the longest free run starting at its left
+    end (pre), ending at its right end (suf) and anywhere inside (best);
+    internal nodes carry a lazy free/occupy tag. The tree is padded to a
+    power of 2 with occupied slots.
+
+    >>> hotel = poj3667(10)
+    >>> hotel.allocate(3), hotel.allocate(3), hotel.allocate(3)
+    (1, 4, 7)
+    >>> hotel.allocate(3) is None
+    True
+    >>> hotel.release(5, 5)
+    >>> hotel.allocate(6), hotel.find(1) is None, hotel.free()
+    (5, True, 0)
     """
 
     name = 'Hotel'
     url = 'http://poj.org/problem?id=3667'
     labels = 'SegmentTree, segment tree'
 
+    base = 1
+    FREE, OCCUPIED = 1, 2
+
+    def __init__(self, n, base = None):
+        if base is not None:
+            self.base = base
+        h = max(1, (n - 1).bit_length())
+        size = 1 << h
+        self.n, self.h, self.size = n, h, size
+
+        runs = np.zeros(2 * size, dtype = 'l')
+        runs[size:size+n] = 1
+        pre, suf, best = runs.copy(), runs.copy(), runs.copy()
+        i, k = size, 1
+        while i > 1:
+            j = i >> 1
+            l, r = slice(i, 2*i, 2), slice(i+1, 2*i, 2)
+            pre[j:i] = np.where(pre[l] < k, pre[l], k + pre[r])
+            suf[j:i] = np.where(suf[r] < k, suf[r], k + suf[l])
+            best[j:i] = np.maximum(np.maximum(best[l], best[r]),
+                                   suf[l] + pre[r])
+            i, k = j, k << 1
+        self.pre = array('l', pre.tostring())
+        self.suf = array('l', suf.tostring())
+        self.best = array('l', best.tostring())
+        self.tag = bytearray(size)
+
+    def __len__(self):
+        return self.n
+
+    def _apply(self, p, tag, k):
+        run = k if tag == self.FREE else 0
+        self.pre[p] = self.suf[p] = self.best[p] = run
+        if p < self.size:
+            self.tag[p] = tag
+
+    def _push(self, p, k):
+        """Move the tag of node p to its children of length k."""
+        tag = self.tag[p]
+        if tag:
+            self._apply(2*p, tag, k)
+            self._apply(2*p+1, tag, k)
+            self.tag[p] = 0
+
+    def push_down(self, p):
+        """Push pending tags from the root down to (excluding) node p."""
+        tags = self.tag
+        for s in xrange(p.bit_length() - 1, 0, -1):
+            if tags[p >> s]:
+                self._push(p >> s, 1 << (s - 1))
+
+    def push_up(self, p, q = None):
+        """Recompute every ancestor of leaves p and q from their children."""
+        pre, suf, best, tags = self.pre, self.suf, self.best, self.tag
+        if q is None:
+            q = p
+        k = 1
+        while p > 1:
+            p >>= 1
+            q >>= 1
+            for i in ((p,) if p == q else (p, q)):
+                if tags[i]:
+                    # the tag already holds the whole node
+                    continue
+                l, r = 2*i, 2*i+1
+                pre[i] = pre[l] if pre[l] < k else k + pre[r]
+                suf[i] = suf[r] if suf[r] < k else k + suf[l]
+                run = suf[l] + pre[r]
+                if best[l] > run:
+                    run = best[l]
+                if best[r] > run:
+                    run = best[r]
+                best[i] = run
+            k <<= 1
+
+    def _update(self, start, end, tag):
+        l = max(start - self.base, 0) + self.size
+        r = min(end - self.base + 1, self.n) + self.size
+        if l >= r:
+            return
+        l0, r0 = l, r - 1
+        self.push_down(l0)
+        self.push_down(r0)
+        pre, suf, best, tags = self.pre, self.suf, self.best, self.tag
+        size, free = self.size, tag == self.FREE
+        k = 1
+        while l < r:
+            if l & 1:
+                pre[l] = suf[l] = best[l] = k if free else 0
+                if l < size:
+                    tags[l] = tag
+                l += 1
+            if r & 1:
+                r -= 1
+                pre[r] = suf[r] = best[r] = k if free else 0
+                if r < size:
+                    tags[r] = tag
+            l >>= 1
+            r >>= 1
+            k <<= 1
+        self.push_up(l0, r0)
+
+    def free(self):
+        """Length of the longest free run."""
+        return self.best[1]
+
+    def find(self, length):
+        """Leftmost slot starting length free slots, or None."""
+        if length <= 0 or self.best[1] < length:
+            return None
+        pre, suf, best = self.pre, self.suf, self.best
+        p, pos, k = 1, 0, self.size
+        while p < self.size:
+            self._push(p, k >> 1)
+            k >>= 1
+            l = 2*p
+            if best[l] >= length:
+                p = l
+            elif suf[l] + pre[l+1] >= length:
+                return pos + k - suf[l] + self.base
+            else:
+                p, pos = l + 1, pos + k
+        return pos + self.base
+
+    def occupy(self, start, length):
+        """Mark [start, start+length) as occupied."""
+        self._update(start, start + length - 1, self.OCCUPIED)
+
+    def release(self, start, length):
+        """Mark [start, start+length) as free."""
+        self._update(start, start + length - 1, self.FREE)
+
+    def allocate(self, length):
+        """Occupy the leftmost run of length free slots, return its start
+        slot, or None if there is no such run."""
+        start = self.find(length)
+        if start is not None:
+            self.occupy(start, length)
+        return start
+
+    @staticmethod
+    def sample():
+        """
+        >>> poj3667.sample()
+        1
+        4
+        7
+        0
+        5
+        """
+        input = """\
+            10 6
+            1 3
+            1 3
+            1 3
+            1 3
+            2 5 5
+            1 6"""
+
+        with BytesIO(input) as f:
+            n, m = [int(e) for e in f.readline().split()]
+            hotel = poj3667(n)
+            for i in xrange(m):
+                param = [int(e) for e in f.readline().split()]
+                if param[0] == 1:
+                    print hotel.allocate(param[1]) or 0
+                else:
+                    hotel.release(param[1], param[2])
+
+    @staticmethod
+    def generate_data():
+        pass
+
+    @staticmethod
+    def benchmark(n = 1000000, nops = 1000000):
+        """
+        Random allocate/release of 1..1000 slots, half each.
+
+        >>> poj3667.benchmark(nops = 200000) # doctest: +SKIP
+        poj3667                  : [setup]0.1093 [ops]9.8441 [ops/s]20316 [result]30689749403
+        """
+        ops = []
+        for i in xrange(nops):
+            length = random.randint(1, 1000)
+            if random.random() < 0.5:
+                ops.append((length, 0))
+            else:
+                ops.append((length, random.randint(1, n - length + 1)))
+
+        t0 = time.time()
+        hotel = poj3667(n)
+        t1 = time.time()
+        result = 0
+        for length, start in ops:
+            if start:
+                hotel.release(start, length)
+            else:
+                result += hotel.allocate(length) or 0
+        t2 = time.time()
+        print '%-24s : [setup]%6.4f [ops]%6.4f [ops/s]%d [result]%s' % (
+            'poj3667', t1 - t0, t2 - t1, nops / (t2 - t1), result)
+
+    @staticmethod
+    def naive():
+        pass
+
 ################################################################################
 
 
-class hdu1542(SegmentTree):
+class hdu1542(object):
     """
     Atlantis.
     
@@ -1151,20 +2018,369 @@ class hdu1542(SegmentTree):
       - UPDATE: Interval increase and decrease.
       - QUERY : Root node query
 
+    The x coordinates are compressed into elementary intervals
+    [xs[i], xs[i+1]) and a flat cover-count tree is kept over them. A node
+    with a positive cover count is covered in full, so counts are never
+    pushed down; each node keeps the covered length, the number of covered
+    runs and whether its two ends are covered (for the perimeter).
+
+    A horizontal line sweeps the events (bottom edge +1, top edge -1)
+    sorted by y, bottom edges first on ties. Between two events the
+    covered length gives the area and the number of runs gives the
+    vertical edges; the change of covered length at each event gives the
+    horizontal edges.
+
+    >>> hdu1542.union([(10, 10, 20, 20), (15, 15, 25, 25.5)])
+    (180.0, 61.0)
+    >>> hdu1542.union([(0, 0, 2, 2), (2, 0, 4, 2), (1, 2, 3, 3)])
+    (10.0, 14.0)
     """
 
     name = 'Atlantis'
     url = 'http://acm.hdu.edu.cn/showproblem.php?pid=1542'
     labels = 'SegmentTree, segment tree'
 
+    def __init__(self, xs):
+        xs = np.asarray(xs, dtype = 'd')
+        m = max(len(xs) - 1, 1)
+        h = max(1, (m - 1).bit_length())
+        size = 1 << h
+        self.xs, self.size = xs, size
+
+        width = np.zeros(2 * size)
+        width[size:size+len(xs)-1] = np.diff(xs)
+        i = size
+        while i > 1:
+            width[i>>1:i] = width[i:2*i:2] + width[i+1:2*i:2]
+            i >>= 1
+        self.width = array('d', width.tostring())
+        self.length = array('d', [0.0]) * (2 * size)
+        self.cnt = array('l', [0]) * (2 * size)
+        self.segs = array('l', [0]) * (2 * size)
+        self.lcov = bytearray(2 * size)
+        self.rcov = bytearray(2 * size)
+
+    def pull(self, p):
+        """Recompute node p from its cover count and children."""
+        if self.cnt[p] > 0:
+            self.length[p] = self.width[p]
+            self.segs[p] = 1
+            self.lcov[p] = self.rcov[p] = 1
+        elif p >= self.size:
+            self.length[p] = 0.0
+            self.segs[p] = 0
+            self.lcov[p] = self.rcov[p] = 0
+        else:
+            l, r = 2*p, 2*p+1
+            self.length[p] = self.length[l] + self.length[r]
+            self.segs[p] = self.segs[l] + self.segs[r] - \
+                           (self.rcov[l] & self.lcov[r])
+            self.lcov[p] = self.lcov[l]
+            self.rcov[p] = self.rcov[r]
+
+    def update(self, start, end, delta):
+        """Add delta to the cover count of elementary intervals [start, end)."""
+        size, cnt = self.size, self.cnt
+        l, r = start + size, end + size
+        p, q = l >> 1, (r - 1) >> 1
+        nodes = []
+        while l < r:
+            if l & 1:
+                cnt[l] += delta
+                nodes.append(l)
+                l += 1
+            if r & 1:
+                r -= 1
+                cnt[r] += delta
+                nodes.append(r)
+            l >>= 1
+            r >>= 1
+        while p:
+            nodes.append(p)
+            if q != p:
+                nodes.append(q)
+            p >>= 1
+            q >>= 1
+
+        # pull() inlined, this is the whole cost of the sweep
+        width, length, segs = self.width, self.length, self.segs
+        lcov, rcov = self.lcov, self.rcov
+        for p in nodes:
+            if cnt[p] > 0:
+                length[p] = width[p]
+                segs[p] = 1
+                lcov[p] = rcov[p] = 1
+            elif p >= size:
+                length[p] = 0.0
+                segs[p] = 0
+                lcov[p] = rcov[p] = 0
+            else:
+                l, r = 2*p, 2*p+1
+                length[p] = length[l] + length[r]
+                segs[p] = segs[l] + segs[r] - (rcov[l] & lcov[r])
+                lcov[p] = lcov[l]
+                rcov[p] = rcov[r]
+
+    def query(self):
+        """Covered length and number of covered runs."""
+        return self.length[1], self.segs[1]
+
+    @staticmethod
+    def _normalize(rects):
+        """(n, 4) float array of non-empty rectangles, x1 < x2, y1 < y2."""
+        rects = np.asarray(rects, dtype = 'd').reshape(-1, 4)
+        x1 = np.minimum(rects[:, 0], rects[:, 2])
+        x2 = np.maximum(rects[:, 0], rects[:, 2])
+        y1 = np.minimum(rects[:, 1], rects[:, 3])
+        y2 = np.maximum(rects[:, 1], rects[:, 3])
+        keep = (x1 < x2) & (y1 < y2)
+        return np.column_stack((x1, y1, x2, y2))[keep]
+
+    @staticmethod
+    def _events(rects, xs):
+        """Events of rects sorted by (y, -delta, start, end), as arrays."""
+        l = np.searchsorted(xs, rects[:, 0])
+        r = np.searchsorted(xs, rects[:, 2])
+        y = np.concatenate((rects[:, 1], rects[:, 3]))
+        d = np.concatenate((np.ones(len(rects), dtype = 'l'),
+                            -np.ones(len(rects), dtype = 'l')))
+        l = np.concatenate((l, l))
+        r = np.concatenate((r, r))
+        order = np.lexsort((r, l, -d, y))
+        return y[order], -d[order], l[order], r[order]
+
+    @classmethod
+    def _sweep(cls, xs, events):
+        """Area and perimeter of the union, events as (y, -delta, l, r)."""
+        st = cls(xs)
+        area = perimeter = 0.0
+        length, segs = 0.0, 0
+        lasty = None
+        for y, negd, l, r in events:
+            if lasty is not None:
+                area += length * (y - lasty)
+                perimeter += 2 * segs * (y - lasty)
+            st.update(l, r, -negd)
+            newlength, segs = st.query()
+            perimeter += abs(newlength - length)
+            length, lasty = newlength, y
+        return area, perimeter
+
+    @classmethod
+    def union(cls, rects):
+        """Area and perimeter of the union of rects, (x1, y1, x2, y2) each."""
+        rects = cls._normalize(rects)
+        xs = np.unique(rects[:, [0, 2]])
+        y, negd, l, r = cls._events(rects, xs)
+        return cls._sweep(xs, izip(y.tolist(), negd.tolist(),
+                                   l.tolist(), r.tolist()))
+
+    @staticmethod
+    def _read_chunks(filename, chunksize):
+        """(n, 4) arrays of at most chunksize rectangles from filename.
+
+        Lines without exactly 4 numbers (e.g. the counts of the original
+        input) are skipped.
+        """
+        with open(filename) as f:
+            while True:
+                lines = list(islice(f, chunksize))
+                if not lines:
+                    break
+                rows = [line.split() for line in lines]
+                rows = [row for row in rows if len(row) == 4]
+                if rows:
+                    yield np.array(rows, dtype = 'd')
+
+    @classmethod
+    def union_file(cls, filename, chunksize = 100000, tmpdir = None,
+                   blocksize = 10000):
+        """
+        union() of the rectangles in filename, x1 y1 x2 y2 per line, read
+        chunksize lines at a time.
+
+        The first pass collects the distinct x coordinates. The second pass
+        writes the events of each chunk, sorted, to a run file in tmpdir.
+        The sweep then merges the memory-mapped runs blocksize events at a
+        time, so memory is bounded by the distinct x coordinates and one
+        chunk, not by the number of rectangles.
+        """
+        xs = np.zeros(0)
+        for rects in cls._read_chunks(filename, chunksize):
+            rects = cls._normalize(rects)
+            xs = np.union1d(xs, rects[:, [0, 2]].ravel())
+
+        tmpdir = mkdtemp(dir = tmpdir)
+        try:
+            runs = []
+            for rects in cls._read_chunks(filename, chunksize):
+                rects = cls._normalize(rects)
+                if len(rects) == 0:
+                    continue
+                events = np.column_stack(cls._events(rects, xs))
+                runfile = join(tmpdir, '%s.npy' % len(runs))
+                np.save(runfile, events)
+                runs.append(runfile)
+
+            def iterrun(runfile):
+                events = np.load(runfile, mmap_mode = 'r')
+                for k in xrange(0, len(events), blocksize):
+                    block = events[k:k+blocksize]
+                    for y, negd, l, r in block.tolist():
+                        yield y, int(negd), int(l), int(r)
+
+            return cls._sweep(xs, heapq.merge(*[iterrun(e) for e in runs]))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    @staticmethod
+    def sample():
+        """
+        >>> hdu1542.sample()
+        Test case #1
+        Total explored area: 180.00
+        <BLANKLINE>
+        """
+        input = """\
+            2
+            10 10 20 20
+            15 15 25 25.5
+            0"""
+
+        with BytesIO(input) as f:
+            i = 0
+            n = int(f.readline())
+            while n:
+                i += 1
+                rects = [[float(e) for e in f.readline().split()]
+                         for j in xrange(n)]
+                area, perimeter = hdu1542.union(rects)
+                print 'Test case #%s' % i
+                print 'Total explored area: %.2f' % area
+                print
+                n = int(f.readline())
+
+    @staticmethod
+    def generate_data(n = 1000000, maxc = 100000.0):
+        """
+        >>> hdu1542.generate_data() # doctest: +SKIP
+        """
+        with open(join(DATA_PATH, 'hdu1542.dat'), 'w') as f:
+            for i in xrange(n):
+                x = random.uniform(0, maxc)
+                y = random.uniform(0, maxc)
+                w = random.uniform(0, maxc / 100)
+                h = random.uniform(0, maxc / 100)
+                f.write('%.2f %.2f %.2f %.2f\n' % (x, y, x + w, y + h))
+
+    @staticmethod
+    def benchmark():
+        """
+        1000000 rectangles from generate_data():
+
+        >>> hdu1542.benchmark() # doctest: +SKIP
+        union                    : [setup]11.0913 [sweep]118.5138 [result](10159489677.00793, 499785.32000192953)
+        union_file               : [setup]0.0000 [sweep]102.8720 [result](10159489677.00793, 499785.32000192953)
+        """
+        filename = join(DATA_PATH, 'hdu1542.dat')
+        t0 = time.time()
+        rects = np.loadtxt(filename)
+        t1 = time.time()
+        result = hdu1542.union(rects)
+        t2 = time.time()
+        print '%-24s : [setup]%6.4f [sweep]%6.4f [result]%s' % (
+            'union', t1 - t0, t2 - t1, result)
+        del rects
+
+        t0 = time.time()
+        result = hdu1542.union_file(filename)
+        t1 = time.time()
+        print '%-24s : [setup]%6.4f [sweep]%6.4f [result]%s' % (
+            'union_file', 0, t1 - t0, result)
+
+    @staticmethod
+    def naive():
+        pass
+
 ################################################################################
 
 # benchmark: interval add and query sum
 
+def _qualname(klass):
+    return '%s.%s' % (klass.__module__, klass.__name__)
+
+def benchmark_engines(n = 1000000, nops = 100000, classes = None):
+    """
+    Node-based vs. array-backed segment tree on random interval adds and
+    sum queries over n points.
+
+    The node-based tree keys its nodes by the sorted point values, so the
+    points are 1..n to make both trees answer the same.
 
+    Profile result(n = 1000000, nops = 100000):
 
+      Memory-consuming: [poj3468_node]2806 MB [poj3468]107 MB
+
+    >>> benchmark_engines() # doctest: +SKIP
+    segmenttree.poj3468_node : [setup]21.8725 [ops]21.7219 [result]6883875583065232
+    segmenttree.poj3468      : [setup]0.2381 [ops]16.3701 [result]6883875583065232
+    >>> import fenwick
+    >>> benchmark_engines(classes = [poj3468, fenwick.poj3468]) # doctest: +SKIP
+    segmenttree.poj3468      : [setup]0.1793 [ops]11.2248 [result]6883875583065232
+    fenwick.poj3468          : [setup]0.1315 [ops]1.0001 [result]6883875583065232
+    """
+    classes = classes or [poj3468_node, poj3468]
+    points = range(1, n+1)
+    ops = []
+    for i in xrange(nops):
+        a = random.randint(1, n)
+        b = random.randint(a, n)
+        ops.append((random.choice('QC'), a, b, random.randint(-100, 100)))
+
+    for klass in classes:
+        t0 = time.time()
+        st = klass(points)
+        t1 = time.time()
+        result = 0
+        for cmd, a, b, c in ops:
+            if cmd == 'Q':
+                result += st.query(a, b)
+            else:
+                st.update(a, b, c)
+        t2 = time.time()
+        print '%-24s : [setup]%6.4f [ops]%6.4f [result]%s' % (
+            _qualname(klass), t1 - t0, t2 - t1, result)
 
+def benchmark_batches(n = 1000000, batch = 100000):
+    """
+    One call per operation vs. update_many/query_many on poj3468.
 
+    >>> benchmark_batches() # doctest: +SKIP
+    single               : [update]17.3953 [query]3.7363 [result]20064998165748689
+    batch                : [update]0.0812 [query]0.0116 [result]20064998165748689
+    """
+    starts = np.random.randint(1, n+1, batch)
+    ends = np.minimum(starts + np.random.randint(0, n, batch), n)
+    deltas = np.random.randint(-100, 100, batch)
+
+    st = poj3468(range(1, n+1))
+    t0 = time.time()
+    for a, b, c in zip(starts.tolist(), ends.tolist(), deltas.tolist()):
+        st.update(a, b, c)
+    t1 = time.time()
+    result = [st.query(a, b) for a, b in zip(starts.tolist(), ends.tolist())]
+    t2 = time.time()
+    print '%-20s : [update]%6.4f [query]%6.4f [result]%s' % (
+        'single', t1 - t0, t2 - t1, sum(result))
+
+    st = poj3468(range(1, n+1))
+    t0 = time.time()
+    st.update_many(starts, ends, deltas)
+    t1 = time.time()
+    result = st.query_many(starts, ends)
+    t2 = time.time()
+    print '%-20s : [update]%6.4f [query]%6.4f [result]%s' % (
+        'batch', t1 - t0, t2 - t1, result.sum())
 
 ################################################################################
 
@@ -4,9 +4,12 @@
 import sys
 import random
 
+from dsa.tree import SizedTreeBase
+
 MAXINT = 1000
 
 class TreapNode(object):
+    __slots__ = ["key", "payload", "priority", "size", "leftChild", "rightChild", "parent"]
     
     def __init__(self, key, val, left=None, right=None, parent=None, priority=None):
         self.key = key
@@ -15,6 +18,7 @@ class TreapNode(object):
             self.priority = random.randint(0, MAXINT)
         else:
             self.priority = priority
+        self.size = 1
         self.leftChild = left
         self.rightChild = right
         self.parent = parent
@@ -108,7 +112,79 @@ class TreapNode(object):
     __repr__ = __str__
 
 
-class Treap(object):
+################################################################################
+
+# Split and merge work on subtrees: they relink the nodes in place and keep
+# node.size up to date, the caller fixes the parent of the returned root.
+
+def _resize(node):
+    node.size = 1
+    if node.leftChild:
+        node.size += node.leftChild.size
+    if node.rightChild:
+        node.size += node.rightChild.size
+
+def _split(node, key, inclusive = False):
+    """(keys < key, keys >= key), or (keys <= key, keys > key) if inclusive."""
+    if node is None:
+        return None, None
+    if node.key < key or (inclusive and node.key == key):
+        left, right = _split(node.rightChild, key, inclusive)
+        node.rightChild = left
+        if left:
+            left.parent = node
+        _resize(node)
+        return node, right
+    else:
+        left, right = _split(node.leftChild, key, inclusive)
+        node.leftChild = right
+        if right:
+            right.parent = node
+        _resize(node)
+        return left, node
+
+def _merge(left, right):
+    """Concatenate two treaps, every key of left is below every key of right."""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority <= right.priority:
+        left.rightChild = _merge(left.rightChild, right)
+        left.rightChild.parent = left
+        _resize(left)
+        return left
+    else:
+        right.leftChild = _merge(left, right.leftChild)
+        right.leftChild.parent = right
+        _resize(right)
+        return right
+
+def _union(a, b, keep_b):
+    """Union of two treaps, on equal keys b's item wins if keep_b."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if b.priority < a.priority:
+        a, b, keep_b = b, a, not keep_b
+    left, right = _split(b, a.key)
+    same, right = _split(right, a.key, True)
+    if same and keep_b:
+        a.payload = same.payload
+    a.leftChild = _union(a.leftChild, left, keep_b)
+    a.rightChild = _union(a.rightChild, right, keep_b)
+    for child in (a.leftChild, a.rightChild):
+        if child:
+            child.parent = a
+    _resize(a)
+    return a
+
+
+class Treap(SizedTreeBase):
+
+    _left = 'leftChild'
+    _right = 'rightChild'
 
     def __init__(self):
         self.root = None
@@ -118,7 +194,26 @@ class Treap(object):
         return self.size
 
 
+    @classmethod
+    def from_sorted(cls, iterable):
+        tree = super(Treap, cls).from_sorted(iterable)
+        # each level draws its priorities from its own band, bands increase
+        # with depth, so the heap order holds without any rotation
+        width = (MAXINT + 1) // max(tree.size.bit_length(), 1)
+        for level, node in tree.iter_levels():
+            node.priority = random.randint((level - 1) * width, level * width - 1)
+        return tree
+
+    def _new_node(self, key, val, parent, nleft, nright):
+        node = TreapNode(key, val, parent = parent, priority = 0)
+        node.size = nleft + nright + 1
+        return node
+
     def put(self, key, val, priority = None):
+        node = self._get(key, self.root)
+        if node:
+            node.payload = val
+            return
         if self.root:
             self._put(key, val, self.root, priority = priority)
         else:
@@ -126,6 +221,8 @@ class Treap(object):
         self.size += 1
 
     def _put(self, key, val, currentNode, priority = None):
+        # the key is new, so every node on the way down gains one
+        currentNode.size += 1
         if key < currentNode.key:
             if currentNode.hasLeftChild():
                 self._put(key, val, currentNode.leftChild, priority = priority)
@@ -140,9 +237,6 @@ class Treap(object):
                 currentNode.rightChild = TreapNode(key, val, parent = currentNode, priority = priority)
             if currentNode.rightChild.priority < currentNode.priority:
                 self.leftRotate(currentNode)
-        else:
-            currentNode.payload = val
-            currentNode.priority = random.randint(0, MAXINT)
 
 
     def leftRotate(self, currentNode):
@@ -161,6 +255,8 @@ class Treap(object):
                 currentNode.parent.rightChild = node
         node.leftChild = currentNode
         currentNode.parent = node
+        node.size = currentNode.size
+        self._resize(currentNode)
 
     def rightRotate(self, currentNode):
         """From bottom to up."""
@@ -178,6 +274,8 @@ class Treap(object):
                 currentNode.parent.rightChild = node
         node.rightChild = currentNode
         currentNode.parent = node
+        node.size = currentNode.size
+        self._resize(currentNode)
     
     def get(self, key):
         if self.root:
@@ -215,6 +313,7 @@ class Treap(object):
 
     def remove(self,currentNode):
         if currentNode.isLeaf(): #leaf
+            self._shrink(currentNode.parent)
             if currentNode == currentNode.parent.leftChild:
                 currentNode.parent.leftChild = None
             else:
@@ -226,28 +325,92 @@ class Treap(object):
                 self.leftRotate(currentNode)
             self.remove(currentNode)
         else:
+            self._shrink(currentNode.parent)
             if currentNode.hasLeftChild():
-                currentNode.parent.leftChild = currentNode.leftChild
-                currentNode.leftChild.parent = currentNode.parent
-            if currentNode.hasRightChild():
-                currentNode.parent.rightChild = currentNode.rightChild
-                currentNode.rightChild.parent = currentNode.parent
-
-    def searchRange(self, kmin, kmax):
-        result = []
-        if self.root:
-            self._searchRange(kmin, kmax, result, self.root)
-        return result
-    
-    def _searchRange(self, kmin, kmax, result, currentNode):
-        if currentNode:
-            if  kmin < currentNode.key:
-                self._searchRange(kmin, kmax, result, currentNode.leftChild)
-            if kmin <= currentNode.key <= kmax:
-                result.append(currentNode)
-            if kmin > currentNode.key or currentNode.key < kmax:
-                self._searchRange(kmin, kmax, result, currentNode.rightChild)
-
+                child = currentNode.leftChild
+            else:
+                child = currentNode.rightChild
+            child.parent = currentNode.parent
+            if currentNode.isRoot():
+                self.root = child
+            elif currentNode.isLeftChild():
+                currentNode.parent.leftChild = child
+            else:
+                currentNode.parent.rightChild = child
+
+    #### split and merge
+
+    def _wrap(self, root):
+        tree = self.__class__()
+        if root:
+            root.parent = None
+            tree.root = root
+            tree.size = root.size
+        return tree
+
+    def _reset(self, root):
+        if root:
+            root.parent = None
+        self.root = root
+        self.size = root.size if root else 0
+
+    def split(self, key):
+        """
+        Split into two treaps, keys < key and keys >= key, in O(log n). The
+        nodes move to the new treaps, this one is left empty.
+
+        >>> t = Treap.from_sorted((k, None) for k in range(10))
+        >>> left, right = t.split(4)
+        >>> list(left), list(right), len(t)
+        ([0, 1, 2, 3], [4, 5, 6, 7, 8, 9], 0)
+        >>> list(Treap.join(left, right))
+        [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+        """
+        left, right = _split(self.root, key)
+        self._reset(None)
+        return self._wrap(left), self._wrap(right)
+
+    @classmethod
+    def join(cls, left, right):
+        """
+        Concatenate two treaps in O(log n), every key of left must be below
+        every key of right. Both are left empty.
+        """
+        if left.root and right.root and not left.root.findMax().key < right.root.findMin().key:
+            raise ValueError('keys of left and right overlap')
+        tree = cls()
+        tree._reset(_merge(left.root, right.root))
+        left._reset(None)
+        right._reset(None)
+        return tree
+
+    def delete_range(self, kmin, kmax):
+        """
+        Drop every key with kmin <= key <= kmax in O(log n), returns how
+        many were dropped.
+
+        >>> t = Treap.from_sorted((k, None) for k in range(10))
+        >>> t.delete_range(2, 6), list(t), t.count_range(0, 9)
+        (5, [0, 1, 7, 8, 9], 5)
+        """
+        left, rest = _split(self.root, kmin)
+        middle, right = _split(rest, kmax, True)
+        self._reset(_merge(left, right))
+        return middle.size if middle else 0
+
+    def union(self, other):
+        """
+        Move every item of other into this treap, other's value wins on
+        equal keys and other is left empty.
+
+        >>> a = Treap.from_sorted((k, 'a') for k in range(0, 10, 2))
+        >>> b = Treap.from_sorted((k, 'b') for k in range(0, 10, 3))
+        >>> a.union(b)
+        >>> [(node.key, node.payload) for node in a.iter_inorder()]
+        [(0, 'b'), (2, 'a'), (3, 'b'), (4, 'a'), (6, 'b'), (8, 'a'), (9, 'b')]
+        """
+        self._reset(_union(self.root, other.root, True))
+        other._reset(None)
 
     def splitLevels(self):
         if self.root:
@@ -305,45 +468,6 @@ class Treap(object):
             print ''.join(pair)
 
 
-    def preorder(self):
-        return self._preorder(self.root)
-    
-    def _preorder(self, currentNode):
-        nodes = []
-        nodes.append(currentNode)
-        if currentNode.hasLeftChild():
-            nodes.extend(self._preorder(currentNode.leftChild))
-        if currentNode.hasRightChild:
-            nodes.extend(self._preorder(currentNode.rightChild))
-        
-        return nodes
-
-    def inorder(self):
-        return self._inorder(self.root)
-    
-    def _inorder(self, currentNode):
-        nodes = []
-        if currentNode.hasLeftChild():
-            nodes.extend(self._inorder(currentNode.leftChild))
-        nodes.append(currentNode)
-        if currentNode.hasRightChild():
-            nodes.extend(self._inorder(currentNode.rightChild))
-        
-        return nodes
-
-    def postorder(self):
-        return self._postorder(self.root)
-    
-    def _postorder(self, currentNode):
-        nodes = []
-        if currentNode.hasLeftChild():
-            nodes.extend(self._postorder(currentNode.leftChild))
-        nodes.append(currentNode)
-        if currentNode.hasRightChild():
-            nodes.extend(self._postorder(currentNode.rightChild))
-        
-        return nodes
-
     def __getitem__(self, k):
         return self.get(k)
 
@@ -363,7 +487,7 @@ class Treap(object):
         return self.size
 
     def __iter__(self):
-        return self.root.__iter__()
+        return (node.key for node in self.iter_inorder())
 
 if __name__ == '__main__':
     #test_BinaryTree()
@@ -398,4 +522,4 @@ if __name__ == '__main__':
     #print result
     print 'Treap size: ', r.size
     r.printTree()
-    print r.searchRange(3, 7)
+    print list(r.searchRange(3, 7))